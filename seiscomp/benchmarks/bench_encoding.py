@@ -0,0 +1,108 @@
+"""Size and throughput of the MiniSEED encodings for myo counts.
+
+Encode the channels of a myo file (a synthetic 1 hour, 3 channel file by
+default, or a real upload with --file) with each encoding and record
+length, and report the archive size per sample, the compression ratio
+against raw int32, the size relative to the previous archive output, and
+the encoding and decoding throughputs. The previous output is the ObsPy
+default for int32 data, which already is STEIM2 in 4096 byte records:
+only uploads short enough to fit in a shorter record (tuned record
+length) differ from it.
+Calibrated float32 data (counts * coeff_1 + coeff_0) is included for
+reference.
+
+Usage: python benchmarks/bench_encoding.py [--file upload.myo]
+                                           [--sampling-rate 1000]
+                                           [--duration 3600]
+"""
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from obspy import Trace, read
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from myo_reader import read_myo  # noqa: E402
+from sds_writer import record_length  # noqa: E402
+from synthetic_myo import write_synthetic_myo  # noqa: E402
+
+CASES = [
+    # (label, dtype, encoding, record length or None for record_length())
+    # Previous output: ObsPy defaults (encoding and reclen not given)
+    ('previous (default)', np.int32, None, None),
+    ('INT32 4096', np.int32, 'INT32', 4096),
+    ('STEIM1 4096', np.int32, 'STEIM1', 4096),
+    ('STEIM2 512', np.int32, 'STEIM2', 512),
+    ('STEIM2 4096', np.int32, 'STEIM2', 4096),
+    ('STEIM2 tuned', np.int32, 'STEIM2', None),
+    ('FLOAT32 calibrated', np.float32, 'FLOAT32', 4096),
+]
+
+
+def bench(traces, encoding, reclen):
+    """Return (bytes, encoding time, decoding time) for all traces."""
+    size = encode_s = decode_s = 0.
+    for trace in traces:
+        kwargs = {}
+        if encoding is not None:
+            kwargs = {'encoding': encoding, 'reclen': reclen
+                      or record_length(trace.stats.npts, encoding)}
+        buffer = io.BytesIO()
+        start = time.perf_counter()
+        trace.write(buffer, format='MSEED', **kwargs)
+        encode_s += time.perf_counter() - start
+        size += buffer.tell()
+        buffer.seek(0)
+        start = time.perf_counter()
+        read(buffer, format='MSEED')
+        decode_s += time.perf_counter() - start
+    return size, encode_s, decode_s
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--file', help="myo file (default: synthetic).")
+    parser.add_argument('--sampling-rate', type=float, default=1000.,
+                        help="Sampling rate of the synthetic file (Hz).")
+    parser.add_argument('--duration', type=float, default=3600.,
+                        help="Duration of the synthetic file (s).")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fname = args.file
+        if fname is None:
+            fname = os.path.join(tmp_dir, 'synthetic.myo')
+            write_synthetic_myo(fname, duration=args.duration,
+                                sampling_rate=args.sampling_rate)
+        myo = read_myo(fname)
+        counts = [np.ascontiguousarray(myo.channel_data(sensor))
+                  for sensor in range(len(myo.sensors))]
+        calibrated = [
+            (data * sensor.coeff_1 + sensor.coeff_0).astype(np.float32)
+            for data, sensor in zip(counts, myo.sensors)
+        ]
+    n_samples = sum(len(data) for data in counts)
+    print(f"{len(counts)} channel(s), {n_samples} samples at "
+          f"{1 / myo.delta:g} Hz")
+    print(f"{'encoding':>20} {'bytes/sample':>13} {'ratio':>6} "
+          f"{'vs previous':>12} {'encode (Ms/s)':>14} {'decode (Ms/s)':>14}")
+    previous_size = None
+    for label, dtype, encoding, reclen in CASES:
+        traces = [Trace(data=data, header={'delta': myo.delta})
+                  for data in (counts if dtype == np.int32 else calibrated)]
+        size, encode_s, decode_s = bench(traces, encoding, reclen)
+        previous_size = previous_size or size  # first case
+        print(f"{label:>20} {size / n_samples:>13.2f} "
+              f"{4 * n_samples / size:>6.2f} "
+              f"{size / previous_size:>12.3f} "
+              f"{n_samples / encode_s / 1e6:>14.1f} "
+              f"{n_samples / decode_s / 1e6:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
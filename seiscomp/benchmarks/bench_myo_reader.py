@@ -0,0 +1,98 @@
+"""Benchmark of the structured-dtype myo reader against the legacy parser.
+
+Parse a synthetic 1 hour, 3 channel, 1 kHz myo file with both
+implementations and report the best time over several runs.
+
+Usage: python benchmarks/bench_myo_reader.py [--repeat N] [--duration S]
+"""
+
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from myo_reader import read_myo  # noqa: E402
+from synthetic_myo import write_synthetic_myo  # noqa: E402
+
+
+def legacy_parse(fname):
+    """Parsing section of the original myo2mseed.convert()."""
+    with open(fname, 'rb') as file:
+        started_time = int.from_bytes(file.read(8), 'little')
+        subsec = int.from_bytes(file.read(4), 'little')
+        tick_time = int.from_bytes(file.read(8), 'little')
+        sensor_count = int.from_bytes(file.read(2), 'little')
+        station_name = ''
+        while (c := file.read(1)) != b'\x00':
+            station_name += c.decode('ascii')
+        calib = []
+        for sensor in range(sensor_count):
+            int.from_bytes(file.read(2), 'little')
+            int.from_bytes(file.read(8), 'little')
+            calib.append([struct.unpack('<f', file.read(4))
+                          for _ in range(4)])
+        raw_data = np.frombuffer(file.read(), dtype=np.uint8)
+        raw_data.shape = (-1, 8 + 4 * sensor_count)
+        raw_clock = raw_data[:, :8].flatten()
+        clock = np.frombuffer(raw_clock, np.uint64)
+        data = []
+        for sensor in range(sensor_count):
+            raw_sensor = raw_data[:, 8 + sensor * 4:8 + (sensor + 1) * 4]
+            data.append(np.frombuffer(raw_sensor.flatten(), np.int32))
+    return started_time, subsec, tick_time, clock[0], data
+
+
+def new_parse(fname, mmap):
+    myo = read_myo(fname, mmap=mmap)
+    data = [myo.channel_data(i) for i in range(len(myo.sensors))]
+    return myo.start_ns, data
+
+
+def new_parse_contiguous(fname):
+    """New reader including the contiguous copy needed by the encoder."""
+    myo = read_myo(fname)
+    return [np.ascontiguousarray(myo.channel_data(i))
+            for i in range(len(myo.sensors))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--duration', type=float, default=3600.)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fname = os.path.join(tmp_dir, 'synthetic.myo')
+        n_records = write_synthetic_myo(fname, duration=args.duration)
+        size_mb = os.path.getsize(fname) / 1e6
+        print(f"Synthetic file: {n_records} records x 3 channels at 1 kHz "
+              f"({size_mb:.1f} MB)")
+
+        # Sanity check: both parsers must agree
+        legacy_data = legacy_parse(fname)[4]
+        new_data = new_parse(fname, mmap=True)[1]
+        assert all(np.array_equal(a, b)
+                   for a, b in zip(legacy_data, new_data))
+
+        cases = {
+            'legacy (struct + flatten)': lambda: legacy_parse(fname),
+            'read_myo (read into memory)': lambda: new_parse(fname, False),
+            'read_myo (memory map)': lambda: new_parse(fname, True),
+            'read_myo (memory map) + contiguous copy':
+                lambda: new_parse_contiguous(fname),
+        }
+        reference = None
+        for name, func in cases.items():
+            best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+            reference = reference or best
+            print(f"{name:42s} {best * 1e3:9.2f} ms  "
+                  f"(x{reference / best:.1f})")
+
+
+if __name__ == "__main__":
+    main()
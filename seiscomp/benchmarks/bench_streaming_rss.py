@@ -0,0 +1,68 @@
+"""Peak memory of the myo conversion, whole-file versus streaming mode.
+
+Convert synthetic 3 channel, 1 kHz myo files of increasing size (up to
+1 GB by default) into a temporary SDS archive, each conversion in a fresh
+process, and report the peak RSS of that process. In streaming mode the
+peak RSS should stay flat whatever the file size.
+
+Usage: python benchmarks/bench_streaming_rss.py [--sizes 128 512 1024]
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+SEISCOMP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, SEISCOMP_DIR)
+from myo_reader import record_dtype  # noqa: E402
+from synthetic_myo import write_synthetic_myo  # noqa: E402
+
+
+def child(fname, sds_root, mode):
+    """Convert one file and print elapsed time and peak RSS (MB)."""
+    import myo2mseed
+    if mode == 'whole':
+        myo2mseed.STREAMING_THRESHOLD = float('inf')
+    start = time.perf_counter()
+    myo2mseed.convert(fname, sds_root=sds_root)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{elapsed:.2f} {peak_mb:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[128, 512, 1024], help="File sizes (MB).")
+    parser.add_argument('--modes', nargs='+', default=['stream', 'whole'])
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    record_size = record_dtype(3).itemsize
+    print(f"{'size (MB)':>10} {'mode':>7} {'time (s)':>9} "
+          f"{'peak RSS (MB)':>14}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fname = os.path.join(tmp_dir, 'synthetic.myo')
+        for size in args.sizes:
+            duration = size * 1e6 / record_size / 1000.
+            write_synthetic_myo(fname, duration=duration)
+            for mode in args.modes:
+                sds_root = os.path.join(tmp_dir, f'archive_{size}_{mode}')
+                output = subprocess.run(
+                    [sys.executable, __file__, '--child', fname, sds_root,
+                     mode],
+                    check=True, capture_output=True, text=True,
+                    env={**os.environ, 'PYTHONPATH': SEISCOMP_DIR}
+                ).stdout.split()
+                print(f"{size:>10} {mode:>7} {output[0]:>9} {output[1]:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Synthetic myo file generator for the benchmarks."""
+
+import struct
+
+import numpy as np
+
+from myo_reader import record_dtype
+
+
+def write_synthetic_myo(fname, duration=3600., sampling_rate=1000.,
+                        channels=('HHZ', 'HHN', 'HHE'),
+                        stream='XX.SYNTH.00', started_time=1_700_000_000,
+                        chunk_records=1_000_000, seed=0):
+    """Write a myo file of random-walk counts and return its record count.
+
+    Records are generated by chunks so that large files can be created
+    with bounded memory.
+    """
+    rng = np.random.default_rng(seed)
+    sensor_count = len(channels)
+    n_records = int(duration * sampling_rate)
+    tick_time = int(round(1_000_000_000 / sampling_rate))
+    station_name = f"{stream}.{'_'.join(channels)}".encode('ascii')
+    dtype = record_dtype(sensor_count)
+    with open(fname, 'wb') as file:
+        file.write(struct.pack('<QIQH', started_time, 0, tick_time,
+                               sensor_count))
+        file.write(station_name + b'\x00')
+        for sensor in range(sensor_count):
+            file.write(struct.pack('<HQffff', sensor, 1, 1., 0., 0., 1.))
+        last = np.zeros(sensor_count, dtype=np.int64)
+        for first in range(0, n_records, chunk_records):
+            n = min(chunk_records, n_records - first)
+            records = np.empty(n, dtype=dtype)
+            records['clock'] = np.arange(first, first + n, dtype=np.uint64)
+            steps = rng.integers(-50, 51, size=(n, sensor_count))
+            walk = np.cumsum(steps, axis=0) + last
+            last = walk[-1]
+            records['counts'] = walk
+            file.write(records.tobytes())
+    return n_records
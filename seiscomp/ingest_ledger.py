@@ -0,0 +1,348 @@
+"""Ingestion ledger: SQLite record of every myo file through the pipeline.
+
+One row per uploaded file, written by the conversion step (ingestion
+service or backfill) and by the archiving step, with the file size, hash,
+sample span, per-stage timings, status and error message. The database
+lives in a volume shared with the Streamlit container, which queries it
+(e.g. files received during the last 24 h for a station).
+
+Status values: 'queued', 'converted' (waiting for the batch archiver),
+'archived', 'failed' and 'duplicate' (identical content, or all samples,
+already archived). Samples dropped because their time span was already
+archived (see span_index) are counted in duplicate_samples.
+
+The calibration coefficients found in the myo sensor headers are kept per
+stream in the calibrations table, one row per time interval with the
+same coefficients (the archive holds raw counts): the coefficients at a
+time are those of the last row starting before it (see calibration).
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from myo_reader import read_station_name
+
+LEDGER_PATH = '/data/ledger/ingest.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    network TEXT,
+    station TEXT,
+    size INTEGER,
+    mtime REAL,
+    sha1 TEXT,
+    received_at REAL NOT NULL,
+    start_ns INTEGER,
+    end_ns INTEGER,
+    samples INTEGER,
+    status TEXT NOT NULL,
+    error TEXT,
+    wait_s REAL,
+    convert_s REAL,
+    archive_s REAL,
+    duplicate_samples INTEGER,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_station_received
+    ON files (network, station, received_at);
+CREATE INDEX IF NOT EXISTS files_received ON files (received_at);
+CREATE INDEX IF NOT EXISTS files_sha1 ON files (sha1);
+CREATE TABLE IF NOT EXISTS calibrations (
+    id INTEGER PRIMARY KEY,
+    stream TEXT NOT NULL,
+    calib_0 REAL,
+    calib_1 REAL,
+    coeff_0 REAL,
+    coeff_1 REAL,
+    first_ns INTEGER NOT NULL,
+    last_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS calibrations_stream_first
+    ON calibrations (stream, first_ns);
+"""
+# First release: one row per set of coefficients (spans merged across
+# changes), rebuilt without the unique constraint
+CALIBRATIONS_REBUILD = """
+ALTER TABLE calibrations RENAME TO calibrations_old;
+DROP INDEX IF EXISTS calibrations_stream_first;
+CREATE TABLE calibrations (
+    id INTEGER PRIMARY KEY,
+    stream TEXT NOT NULL,
+    calib_0 REAL,
+    calib_1 REAL,
+    coeff_0 REAL,
+    coeff_1 REAL,
+    first_ns INTEGER NOT NULL,
+    last_ns INTEGER NOT NULL
+);
+INSERT INTO calibrations (stream, calib_0, calib_1, coeff_0, coeff_1,
+                          first_ns, last_ns)
+    SELECT stream, calib_0, calib_1, coeff_0, coeff_1, first_ns, last_ns
+    FROM calibrations_old ORDER BY stream, first_ns;
+DROP TABLE calibrations_old;
+CREATE INDEX calibrations_stream_first ON calibrations (stream, first_ns);
+"""
+# Columns added after the first release: (name, SQL type)
+ADDED_COLUMNS = [('duplicate_samples', 'INTEGER')]
+DONE_STATUSES = ('converted', 'archived', 'duplicate')
+DONE_PLACEHOLDERS = ', '.join('?' * len(DONE_STATUSES))  # bound values
+
+
+def file_hash(path):
+    """Return the sha1 hex digest of a file content."""
+    with open(path, 'rb') as file:
+        return hashlib.file_digest(file, 'sha1').hexdigest()
+
+
+class IngestLedger:
+    """Thread-safe access to the ingestion ledger database."""
+
+    def __init__(self, path=LEDGER_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30.,
+                                     check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            # WAL: the UI can read while the pipeline writes
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(SCHEMA)
+            columns = {row[1] for row
+                       in self._conn.execute('PRAGMA table_info(files)')}
+            for name, sql_type in ADDED_COLUMNS:
+                if name not in columns:
+                    self._conn.execute(
+                        f'ALTER TABLE files ADD COLUMN {name} {sql_type}')
+            table_sql = self._conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' "
+                "AND name = 'calibrations'").fetchone()[0]
+            if 'UNIQUE' in table_sql:
+                self._conn.executescript(CALIBRATIONS_REBUILD)
+
+    def station_of(self, path):
+        """Return the (network, station) of a file not converted yet.
+
+        Read from the myo header, else (unreadable file) taken from the
+        files converted from the same FTP folder, else (None, folder name):
+        FTP logins usually are the station codes.
+        """
+        try:
+            network, station = read_station_name(path).split('.')[:2]
+            return network, station
+        except (OSError, ValueError, UnicodeDecodeError):
+            pass
+        folder = os.path.dirname(path) + '/'
+        rows = self._execute(
+            'SELECT network, station FROM files WHERE network IS NOT NULL '
+            'AND substr(path, 1, ?) = ? ORDER BY updated_at DESC LIMIT 1',
+            (len(folder), folder))
+        if rows:
+            return rows[0]
+        return None, os.path.basename(os.path.dirname(path))
+
+    def _execute(self, sql, params=()):
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params).fetchall()
+
+    def is_unchanged(self, path, stat):
+        """Check if a file with the same path, mtime and size was processed."""
+        return bool(self._execute(
+            'SELECT 1 FROM files WHERE path = ? AND mtime = ? AND size = ? '
+            f'AND status IN ({DONE_PLACEHOLDERS})',
+            (path, stat.st_mtime, stat.st_size, *DONE_STATUSES)))
+
+    def has_content(self, sha1):
+        """Check if a file with the given content hash was processed."""
+        return bool(self._execute(
+            'SELECT 1 FROM files WHERE sha1 = ? '
+            f'AND status IN ({DONE_PLACEHOLDERS})', (sha1, *DONE_STATUSES)))
+
+    def is_done(self, path, stat, sha1=None):
+        """Check if a file, or a file with identical content, was processed.
+
+        Unchanged path, mtime and size avoid hashing the file again.
+        """
+        if self.is_unchanged(path, stat):
+            return True
+        return self.has_content(sha1 or file_hash(path))
+
+    def queued(self, path, received_at=None):
+        """Record a file waiting for conversion.
+
+        The status of a file already processed is kept until its new
+        version is converted (or found to be a duplicate).
+        """
+        now = time.time()
+        network, station = self.station_of(path)
+        self._execute(
+            'INSERT INTO files (path, network, station, received_at, status, '
+            'updated_at) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (path) DO '
+            'UPDATE SET network = excluded.network, '
+            'station = excluded.station, received_at = excluded.received_at, '
+            'status = excluded.status, error = NULL, '
+            'updated_at = excluded.updated_at '
+            f'WHERE files.status NOT IN ({DONE_PLACEHOLDERS})',
+            (path, network, station, received_at or now, 'queued', now,
+             *DONE_STATUSES))
+
+    def converted(self, path, stat, sha1, summary, wait_s, convert_s,
+                  archived):
+        """Record the result of a successful conversion.
+
+        If archived is False, the archive step is still pending (batch
+        archiver) and will be recorded later with archived().
+        """
+        now = time.time()
+        if summary.duplicate_samples == summary.samples:
+            status = 'duplicate'
+        else:
+            status = 'archived' if archived else 'converted'
+        self._execute(
+            'INSERT INTO files (path, network, station, size, mtime, sha1, '
+            'received_at, start_ns, end_ns, samples, status, error, wait_s, '
+            'convert_s, archive_s, duplicate_samples, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (path) DO UPDATE SET network = excluded.network, '
+            'station = excluded.station, size = excluded.size, '
+            'mtime = excluded.mtime, sha1 = excluded.sha1, '
+            'start_ns = excluded.start_ns, end_ns = excluded.end_ns, '
+            'samples = excluded.samples, status = excluded.status, '
+            'error = NULL, wait_s = excluded.wait_s, '
+            'convert_s = excluded.convert_s, archive_s = excluded.archive_s, '
+            'duplicate_samples = excluded.duplicate_samples, '
+            'updated_at = excluded.updated_at',
+            (path, summary.network, summary.station, stat.st_size,
+             stat.st_mtime, sha1, now, summary.start_ns, summary.end_ns,
+             summary.samples, status, wait_s, convert_s,
+             summary.archive_s if archived else None,
+             summary.duplicate_samples, now))
+        if summary.calibrations:
+            self.record_calibrations(summary.calibrations, summary.start_ns,
+                                     summary.end_ns)
+
+    def record_calibrations(self, calibrations, start_ns, end_ns):
+        """Record the sensor coefficients of streams over a time span.
+
+        calibrations maps stream IDs to (calib_0, calib_1, coeff_0,
+        coeff_1). The interval of the same coefficients just before (or
+        after) the span is extended, a new interval is started when the
+        coefficients differ, splitting an interval the span falls in
+        (files may be converted out of time order).
+        """
+        with self._lock, self._conn:
+            for stream, coefficients in calibrations.items():
+                self._record_calibration(stream, tuple(coefficients),
+                                         start_ns, end_ns)
+
+    def _record_calibration(self, stream, coefficients, start_ns, end_ns):
+        conn = self._conn
+        columns = 'id, calib_0, calib_1, coeff_0, coeff_1, first_ns, last_ns'
+        previous = conn.execute(
+            f'SELECT {columns} FROM calibrations WHERE stream = ? AND '
+            'first_ns <= ? ORDER BY first_ns DESC LIMIT 1',
+            (stream, start_ns)).fetchone()
+        following = conn.execute(
+            f'SELECT {columns} FROM calibrations WHERE stream = ? AND '
+            'first_ns > ? ORDER BY first_ns LIMIT 1',
+            (stream, start_ns)).fetchone()
+        if previous is not None and previous[1:5] == coefficients:
+            last_ns = max(previous[6], end_ns)
+            if following is not None and following[1:5] == coefficients \
+                    and following[5] <= last_ns:
+                # The span joins both intervals
+                last_ns = max(last_ns, following[6])
+                conn.execute('DELETE FROM calibrations WHERE id = ?',
+                             (following[0],))
+            conn.execute('UPDATE calibrations SET last_ns = ? WHERE id = ?',
+                         (last_ns, previous[0]))
+            return
+        if following is not None and following[1:5] == coefficients \
+                and following[5] <= end_ns:
+            conn.execute(
+                'UPDATE calibrations SET first_ns = ?, last_ns = ? '
+                'WHERE id = ?',
+                (start_ns, max(following[6], end_ns), following[0]))
+        else:
+            conn.execute(
+                'INSERT INTO calibrations (stream, calib_0, calib_1, '
+                'coeff_0, coeff_1, first_ns, last_ns) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (stream, *coefficients, start_ns, end_ns))
+        if previous is not None and previous[6] > end_ns:
+            # Different coefficients within a known interval: split it
+            conn.execute(
+                'INSERT INTO calibrations (stream, calib_0, calib_1, '
+                'coeff_0, coeff_1, first_ns, last_ns) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (stream, *previous[1:5], end_ns + 1, previous[6]))
+        if previous is not None and previous[6] >= start_ns:
+            conn.execute('UPDATE calibrations SET last_ns = ? WHERE id = ?',
+                         (start_ns - 1, previous[0]))
+
+    def calibration(self, stream, time_ns):
+        """Return the (calib_0, calib_1, coeff_0, coeff_1) of a stream at a
+        time, or None if unknown."""
+        rows = self._execute(
+            'SELECT calib_0, calib_1, coeff_0, coeff_1 FROM calibrations '
+            'WHERE stream = ? AND first_ns <= ? '
+            'ORDER BY first_ns DESC LIMIT 1', (stream, time_ns))
+        return rows[0] if rows else None
+
+    def archived(self, paths, archive_s):
+        """Record the completion of the archive step of several files."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'UPDATE files SET status = ?, archive_s = ?, updated_at = ? '
+                'WHERE path = ?',
+                [('archived', archive_s, now, path) for path in paths])
+
+    def failed(self, path, error):
+        """Record a conversion or archiving failure."""
+        now = time.time()
+        network, station = self.station_of(path)
+        self._execute(
+            'INSERT INTO files (path, network, station, received_at, status, '
+            'error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (path) DO UPDATE SET '
+            'network = COALESCE(files.network, excluded.network), '
+            'station = COALESCE(files.station, excluded.station), '
+            'status = excluded.status, error = excluded.error, '
+            'updated_at = excluded.updated_at',
+            (path, network, station, now, 'failed', error, now))
+
+    def requeue_unfinished(self):
+        """Return the files left queued or converted (not archived yet) by
+        a stopped service, recorded as queued again."""
+        with self._lock, self._conn:
+            paths = [row[0] for row in self._conn.execute(
+                'SELECT path FROM files WHERE status IN (?, ?) '
+                'ORDER BY received_at', ('queued', 'converted'))]
+            self._conn.execute(
+                'UPDATE files SET status = ?, updated_at = ? '
+                'WHERE status = ?', ('queued', time.time(), 'converted'))
+        return paths
+
+    def duplicate(self, path, stat, sha1):
+        """Record a file skipped because its content was already archived.
+
+        Nothing changes if the file itself was already processed (e.g.
+        re-upload of the same file).
+        """
+        now = time.time()
+        self._execute(
+            'INSERT INTO files (path, size, mtime, sha1, received_at, status, '
+            'updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (path) DO '
+            'UPDATE SET size = excluded.size, mtime = excluded.mtime, '
+            'sha1 = excluded.sha1, status = excluded.status, '
+            'updated_at = excluded.updated_at '
+            f'WHERE files.status NOT IN ({DONE_PLACEHOLDERS})',
+            (path, stat.st_size, stat.st_mtime, sha1, now, 'duplicate', now,
+             *DONE_STATUSES))
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,117 @@
+"""Minimal recursive inotify watcher (Linux only, no third party dependency).
+
+Used by the long-lived services of the seiscomp container in place of
+incron rules spawning one process per event.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+
+class InotifyWatcher:
+    """Watch a directory tree and yield (path, mask) file events.
+
+    Sub-directories created after start-up (e.g. a new station FTP folder)
+    are added to the watch list automatically when recursive is True, and
+    the files written in them before their watch was added are reported
+    as IN_CLOSE_WRITE (or IN_MOVED_TO) events. A file still being written
+    then is reported again when closed.
+    """
+
+    def __init__(self, root, mask, recursive=True):
+        self.root = root
+        self.mask = mask
+        self.recursive = recursive
+        self._fd = _libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._paths = {}  # watch descriptor -> directory path
+        self._add_tree(root)
+
+    def _add_watch(self, path):
+        # IN_CREATE is always needed to follow new sub-directories
+        mask = self.mask | (IN_CREATE if self.recursive else 0)
+        wd = _libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        self._paths[wd] = path
+
+    def _add_tree(self, path, scan=False):
+        """Watch a directory and its sub-directories (if recursive).
+
+        If scan is True, return the events of the files already in the
+        tree (written before the watches were added).
+        """
+        self._add_watch(path)
+        if not self.recursive:
+            return []
+        events = []
+        scan_mask = self.mask & IN_CLOSE_WRITE or self.mask & IN_MOVED_TO
+        for dirpath, dirnames, filenames in os.walk(path):
+            for dirname in dirnames:
+                self._add_watch(os.path.join(dirpath, dirname))
+            if scan and scan_mask:
+                events.extend((os.path.join(dirpath, name), scan_mask)
+                              for name in sorted(filenames))
+        return events
+
+    def read_events(self, timeout=None):
+        """Return the list of (path, mask) events available within timeout.
+
+        Return an empty list on timeout, so that callers can periodically
+        check for a shutdown request.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        buffer = os.read(self._fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+            offset += _EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b'\x00')
+            offset += length
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+            directory = self._paths.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if self.recursive and mask & IN_CREATE:
+                    try:
+                        events.extend(self._add_tree(path, scan=True))
+                    except OSError:
+                        pass  # removed before we could watch it
+                continue
+            if mask & self.mask:
+                events.append((path, mask))
+        return events
+
+    def close(self):
+        """Release the inotify file descriptor."""
+        os.close(self._fd)
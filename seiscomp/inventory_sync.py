@@ -0,0 +1,180 @@
+"""Debounced StationXML inventory synchronization service.
+
+Watch the StationXML folder shared with the UI and apply the changes to
+the SeisComP inventory by batches: XML writes and deletes are collected
+until no change happened for a short window, then only the changed files
+are imported (or removed), followed by a single update-config and a
+single fdsnws reload for the whole batch. Uploading 30 station files in a
+row thus costs one inventory rebuild and one web service reload instead
+of 30, and the FDSN web services stay available in between.
+
+The duration of each phase (import, update-config, reload) is logged and
+written as JSON to a status file.
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from inotify_watch import InotifyWatcher, IN_CLOSE_WRITE, IN_MOVED_TO, \
+    IN_DELETE, IN_MOVED_FROM
+
+SEISCOMP = '/usr/local/app/seiscomp/bin/seiscomp'
+INVENTORY_DIR = '/usr/local/app/seiscomp/etc/inventory'
+
+logger = logging.getLogger('inventory_sync')
+
+
+class InventorySync:
+    """Collect StationXML changes and apply them to SeisComP by batches.
+
+    A batch is applied once no change was seen for window seconds, or at
+    the latest max_delay seconds after its first change.
+    """
+
+    def __init__(self, xml_dir, inventory_dir=INVENTORY_DIR, window=5.,
+                 max_delay=60., status_file=None):
+        self.xml_dir = xml_dir
+        self.inventory_dir = inventory_dir
+        self.window = window
+        self.max_delay = max_delay
+        self.status_file = status_file
+        self.pending = {}  # file name -> True (import) or False (remove)
+        self.batches = 0
+
+    def stale_files(self):
+        """Return the XML files newer than their imported inventory file.
+
+        Catches up with the changes made while the service was not running.
+        """
+        changes = {}
+        for name in os.listdir(self.xml_dir):
+            if name.startswith('.'):
+                continue
+            target = os.path.join(self.inventory_dir, name)
+            if not os.path.exists(target) or \
+                    os.path.getmtime(target) < os.path.getmtime(
+                        os.path.join(self.xml_dir, name)):
+                changes[name] = True
+        return changes
+
+    def run(self, stop):
+        """Watch and apply changes until the stop event is set."""
+        watcher = InotifyWatcher(self.xml_dir, IN_CLOSE_WRITE | IN_MOVED_TO
+                                 | IN_DELETE | IN_MOVED_FROM, recursive=False)
+        logger.info("Watching %s", self.xml_dir)
+        self.pending.update(self.stale_files())
+        first = last = time.monotonic() if self.pending else None
+        try:
+            while not stop.is_set():
+                if self._collect(watcher, timeout=1.):
+                    last = time.monotonic()
+                    first = first or last
+                now = time.monotonic()
+                if self.pending and (now - last >= self.window
+                                     or now - first >= self.max_delay):
+                    self.apply()
+                    first = last = None
+            self._collect(watcher, timeout=0.)  # changes made during apply
+        finally:
+            watcher.close()
+        if self.pending:
+            self.apply()
+
+    def _collect(self, watcher, timeout):
+        """Add watcher events to the pending changes, return their count."""
+        count = 0
+        for path, mask in watcher.read_events(timeout=timeout):
+            name = os.path.basename(path)
+            if name.startswith('.'):  # editor or partial files
+                continue
+            self.pending[name] = bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO))
+            count += 1
+        return count
+
+    def apply(self):
+        """Import or remove the pending files, then update and reload once."""
+        changes, self.pending = self.pending, {}
+        timings = {}
+        start = time.monotonic()
+        failed = []
+        for name, imported in sorted(changes.items()):
+            target = os.path.join(self.inventory_dir, name)
+            if imported:
+                command = [SEISCOMP, 'exec', 'import_inv', 'fdsnxml',
+                           os.path.join(self.xml_dir, name), target]
+                if not self._run(command):
+                    failed.append(name)
+            elif os.path.exists(target):
+                os.remove(target)
+        timings['import_s'] = time.monotonic() - start
+        start = time.monotonic()
+        updated = self._run([SEISCOMP, '--asroot', 'update-config',
+                             'inventory'])
+        timings['update_config_s'] = time.monotonic() - start
+        start = time.monotonic()
+        if updated:
+            self._run([SEISCOMP, '--asroot', 'reload', 'fdsnws'])
+        timings['reload_s'] = time.monotonic() - start
+        self.batches += 1
+        logger.info(
+            "Synced %d file(s) (%d failed): import %.1f s, update-config "
+            "%.1f s, reload %.1f s", len(changes), len(failed),
+            timings['import_s'], timings['update_config_s'],
+            timings['reload_s']
+        )
+        self.write_status({'time': time.time(), 'batches': self.batches,
+                           'files': len(changes), 'failed': failed,
+                           **timings})
+
+    def _run(self, command):
+        """Run a SeisComP command, log its output on failure."""
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode:
+            logger.error("%s failed (%d): %s", ' '.join(command[1:]),
+                         result.returncode, result.stderr.strip())
+        return result.returncode == 0
+
+    def write_status(self, summary):
+        """Dump the last batch timings to the status file (if any)."""
+        if self.status_file is None:
+            return
+        tmp_file = self.status_file + '.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump(summary, file)
+        os.replace(tmp_file, self.status_file)  # atomic for readers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--xml-dir', default='/data/xml',
+                        help="StationXML folder to watch.")
+    parser.add_argument('--inventory-dir', default=INVENTORY_DIR)
+    parser.add_argument('--window', type=float, default=5.,
+                        help="Quiet time before applying a batch (s).")
+    parser.add_argument('--max-delay', type=float, default=60.,
+                        help="Maximum delay of a change (s).")
+    parser.add_argument('--status-file',
+                        default='/usr/local/app/inventory_sync_status.json',
+                        help="JSON file updated with the last batch timings.")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(name)s %(levelname)s %(message)s'
+    )
+    sync = InventorySync(args.xml_dir, args.inventory_dir, args.window,
+                         args.max_delay, args.status_file)
+    stop_requested = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_requested.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_requested.set())
+    sync.run(stop_requested)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,96 +3,144 @@
 To be replaced by a proper package from Myotis.
 """
 
-import struct
 import sys
+import time
+from dataclasses import dataclass
 
-from obspy.core import UTCDateTime, Stream, Trace
+from obspy.core import UTCDateTime, Trace
 import numpy as np
 
-
-def convert(fname):
-
-    # Parse station and sensor headers
-    with open(fname, 'rb') as file:  # should use uint instead of int...
-        #  crc = int.from_bytes(file.read(4), 'little')
-        #  version = int.from_bytes(file.read(2), 'little')
-        started_time = int.from_bytes(file.read(8), 'little')  # unix stamp (s)
-        subsec = int.from_bytes(file.read(4), 'little')  # us
-        #  uid = int.from_bytes(file.read(4), 'little')
-        tick_time = int.from_bytes(file.read(8), 'little')  # ns
-        sensor_count = int.from_bytes(file.read(2), 'little')
-        station_name = ''
-        while (c := file.read(1)) != b'\x00':
-            station_name += c.decode('ascii')
-
-        # Parse sensor headers
-        id = [0] * sensor_count
-        saving_ticks = [0] * sensor_count
-        calib_0 = [0] * sensor_count
-        calib_1 = [0] * sensor_count
-        coeff_0 = [0] * sensor_count
-        coeff_1 = [0] * sensor_count
-
-        for sensor in range(sensor_count):
-            id[sensor] = int.from_bytes(file.read(2), 'little')
-            saving_ticks[sensor] = int.from_bytes(file.read(8), 'little')
-            # unpack all in one shot instead?
-            calib_0[sensor] = struct.unpack('<f', file.read(4))
-            calib_1[sensor] = struct.unpack('<f', file.read(4))
-            coeff_0[sensor] = struct.unpack('<f', file.read(4))
-            coeff_1[sensor] = struct.unpack('<f', file.read(4))
-
-        # Parse data (only valid if equal saving tick)
-        raw_data = np.frombuffer(file.read(), dtype=np.uint8)
-        raw_data.shape = (-1, 8 + 4 * sensor_count)
-
-        raw_clock = raw_data[:, :8].flatten()
-        # number of ticks since beginning of measure (to be confirmed)
-        clock = np.frombuffer(raw_clock, np.uint64)
-        first_tick_n = clock[0]
-
-        data = []
-        dtype = np.dtype(np.int32)  # apparently counts are signed
-        dtype.newbyteorder('<')
-        for sensor in range(sensor_count):
-            raw_sensor = raw_data[:, 8 + sensor * 4:8 + (sensor + 1) * 4].flatten()
-            data.append(np.frombuffer(raw_sensor, dtype))  # looks like it's copied
-
-    # Convert to Obspy format and to quick deconv
-    time_first_tick = UTCDateTime(started_time + subsec / 1_000_000 + first_tick_n * tick_time / 1_000_000_000)
-    # time_first_tick = UTCDateTime.now()
-
-    # print(subsec, first_tick_n * tick_time / 1_000_000_000)
-    # print(time_first_tick)
-    # print(coeff_1[0], coeff_0[0])
-
-    net, sta, loc, cha_str = station_name.split('.')
-    channels = cha_str.split('_')
-    # print(net, sta, loc, cha_str, channels)
-    head = {'network': net, 'location': loc, 'station': sta, 'starttime': time_first_tick, 'delta': tick_time / 1_000_000_000}
-
-    for sensor in range(sensor_count):
+from myo_reader import read_myo
+from sds_writer import SDS_ROOT, write_trace
+
+
+STREAMING_THRESHOLD = 64 * 1024 ** 2  # bytes of records
+CHUNK_RECORDS = 1_000_000
+
+
+@dataclass
+class ConversionSummary:
+    """Stream, sample span and archive time of a converted file."""
+
+    network: str
+    station: str
+    start_ns: int
+    end_ns: int  # time of the last sample
+    samples: int  # all channels
+    archived: bool  # False if left to a BatchArchiver
+    archive_s: float = 0.  # time spent writing to SDS (direct writes)
+    duplicate_samples: int = 0  # dropped, already archived (all channels)
+    submitted: int = 0  # traces submitted to the BatchArchiver
+    # stream ID -> (calib_0, calib_1, coeff_0, coeff_1) of the sensor
+    calibrations: dict = None
+
+
+def convert(fname, sds_root=SDS_ROOT, archiver=None, chunk_records=None,
+            source=None, spans=None, encoding='STEIM2'):
+    """Convert a myo file and archive its traces in SDS.
+
+    Raw counts are archived with the given MiniSEED encoding (see
+    sds_writer.encode; a BatchArchiver uses its own encoding), and the
+    calibration coefficients of the sensors are returned in the summary
+    so that they can be recorded with the stream metadata (ledger).
+
+    If a BatchArchiver is given, traces are submitted to it (tagged with
+    source, see BatchArchiver.submit) instead of being written immediately.
+    If a SpanIndex (or SpanClaim) is given, samples already archived
+    (re-uploaded data) are dropped before encoding and only the missing
+    parts are archived.
+    Files with more than STREAMING_THRESHOLD bytes of records (or any file
+    if chunk_records is given) are converted by chunks of records, so that
+    peak memory does not depend on the file size. Chunks are written
+    directly, as buffering them in the archiver would defeat the purpose.
+    Return a ConversionSummary.
+    """
+
+    # Parse station and sensor headers, data is memory mapped (only valid
+    # if equal saving tick)
+    myo = read_myo(fname)
+
+    if chunk_records is None and myo.records.nbytes > STREAMING_THRESHOLD:
+        chunk_records = CHUNK_RECORDS
+    submitted = 0
+    if chunk_records is None:
+        archive_s, duplicates, submitted = _convert_records(
+            myo, myo.records, myo.start_ns, sds_root, archiver, source, spans,
+            encoding)
+    else:
+        archive_s = 0.
+        duplicates = 0
+        for first, records in myo.iter_chunks(chunk_records):
+            chunk_s, chunk_duplicates, _ = _convert_records(
+                myo, records, myo.start_ns + first * myo.tick_time, sds_root,
+                source=source, spans=spans, encoding=encoding)
+            archive_s += chunk_s
+            duplicates += chunk_duplicates
+    samples = myo.npts * len(myo.sensors)
+    return ConversionSummary(
+        network=myo.network,
+        station=myo.station,
+        start_ns=myo.start_ns,
+        end_ns=myo.start_ns + (myo.npts - 1) * myo.tick_time,
+        samples=samples,
+        # Nothing is left to the archiver if all samples were duplicates
+        archived=archiver is None or chunk_records is not None
+        or duplicates == samples,
+        archive_s=archive_s,
+        duplicate_samples=duplicates,
+        submitted=submitted,
+        calibrations={
+            f'{myo.network}.{myo.station}.{myo.location}.{cha}':
+                (sensor.calib_0, sensor.calib_1, sensor.coeff_0,
+                 sensor.coeff_1)
+            for cha, sensor in zip(myo.channels, myo.sensors)
+        },
+    )
+
+
+def _convert_records(myo, records, start_ns, sds_root, archiver=None,
+                     source=None, spans=None, encoding='STEIM2'):
+    """Convert records of a myo file to one trace per channel and archive.
+
+    Return the time spent writing to the archive (direct writes only),
+    the number of samples dropped as already archived and the number of
+    traces submitted to the archiver.
+    """
+    # Convert to Obspy format
+    net, sta, loc = myo.network, myo.station, myo.location
+    head = {'network': net, 'location': loc, 'station': sta,
+            'delta': myo.delta}
+
+    channels = myo.channels
+    archive_s = 0.
+    duplicates = 0
+    submitted = 0
+    for sensor in range(len(myo.sensors)):
         cha = channels[sensor]
         head['channel'] = cha
-        st = Stream(Trace(data=data[sensor], header=head))
-        # trace = data[0].astype(np.float64) * coeff_1[0] + coeff_0[0]  
-        # tr_myo = Trace(data=trace, header=head)
-        # print(head)
-        mseed_name = '.'.join((net, sta, loc, cha, str(time_first_tick.ns), 'mseed'))
-        st.write('/usr/local/app/mseed_segments/' + mseed_name)
-
-    # tr_myo.plot()
-    # tr_mseed.plot()
-
-    '''
-    fig = plt.figure()
-    ax = fig.add_subplot(1, 1, 1)
-    ax.plot(tr_myo.times("matplotlib"), tr_myo.data, "b-")
-    #ax.plot(tr_mseed.times("matplotlib"), tr_mseed.data, "r+")
-    ax.xaxis_date()
-    fig.autofmt_xdate()
-    plt.savefig('testplot.png')
-    '''
+        if spans is None:
+            ranges = [(0, len(records))]
+        else:
+            ranges = spans.claim(f'{net}.{sta}.{loc}.{cha}', start_ns,
+                                 myo.tick_time, len(records), source)
+            duplicates += len(records) - sum(last - first
+                                             for first, last in ranges)
+        for first, last in ranges:
+            head['starttime'] = UTCDateTime(ns=start_ns
+                                            + first * myo.tick_time)
+            # libmseed needs contiguous samples: single copy at encoding
+            data = np.ascontiguousarray(records['counts'][first:last, sensor])
+            # Raw counts: calibration is kept as metadata (compression)
+            trace = Trace(data=data, header=head)
+            if archiver is not None:
+                archiver.submit(trace, source)
+                submitted += 1
+            else:
+                # Records go straight to the SDS day file(s), no scart hop
+                start = time.perf_counter()
+                write_trace(trace, root=sds_root, encoding=encoding)
+                archive_s += time.perf_counter() - start
+    return archive_s, duplicates, submitted
 
 
 if __name__ == "__main__":
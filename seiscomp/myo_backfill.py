@@ -0,0 +1,138 @@
+"""Backfill command to (re)convert all the myo files of the FTP tree.
+
+Walk /data/ftp/<station>/ and convert every file into the SDS archive with
+a pool of processes sized to the number of cores. Converted files are
+recorded in the ingestion ledger (shared with the ingestion service), so
+that files already archived are skipped and an interrupted backfill can
+simply be restarted. Samples already archived (overlapping re-uploads) are
+dropped using the span index. Throughput is reported in files/s and
+samples/s.
+
+Usage examples (from /usr/local/app, with the obspy venv python):
+    python myo_backfill.py                    # whole FTP tree
+    python myo_backfill.py --station STA01    # a single station folder
+    python myo_backfill.py --ledger /tmp/l.db # after archive rebuild
+"""
+
+import argparse
+import fnmatch
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ingest_ledger import IngestLedger, LEDGER_PATH, file_hash
+from sds_writer import SDS_ROOT, ENCODINGS
+from span_index import SpanIndex
+
+_spans = None  # span index of a worker process
+
+
+def find_files(ftp_root, stations=None, pattern='*'):
+    """List the files of the station folders, sorted by station and name."""
+    paths = []
+    for station in sorted(os.listdir(ftp_root)):
+        station_dir = os.path.join(ftp_root, station)
+        if not os.path.isdir(station_dir) or \
+                (stations and station not in stations):
+            continue
+        for dirpath, _, filenames in os.walk(station_dir):
+            paths.extend(os.path.join(dirpath, name)
+                         for name in sorted(filenames)
+                         if fnmatch.fnmatch(name, pattern))
+    return paths
+
+
+def _init_worker(ledger_path):
+    global _spans
+    _spans = SpanIndex(ledger_path)
+
+
+def _convert_file(path, sds_root, encoding):
+    """Worker: convert one file, return (summary, convert time, error)."""
+    # Imported here so that the ObsPy import cost is paid once per worker
+    from myo2mseed import convert
+    start = time.perf_counter()
+    claim = _spans.new_claim()  # direct writes, never pending
+    try:
+        summary = convert(path, sds_root=sds_root, source=path, spans=claim,
+                          encoding=encoding)
+    except Exception as err:
+        claim.release()
+        return None, 0., f"{type(err).__name__}: {err}"
+    return summary, time.perf_counter() - start, None
+
+
+def backfill(paths, ledger, sds_root=SDS_ROOT, workers=None,
+             report_every=50, ledger_path=LEDGER_PATH, encoding='STEIM2'):
+    """Convert the files not yet processed with a process pool."""
+    todo = []
+    for path in paths:
+        stat = os.stat(path)
+        if ledger.is_unchanged(path, stat):
+            continue
+        sha1 = file_hash(path)
+        if ledger.has_content(sha1):
+            ledger.duplicate(path, stat, sha1)
+            continue
+        todo.append((path, stat, sha1))
+    print(f"{len(paths)} file(s) found, {len(paths) - len(todo)} already "
+          f"archived, {len(todo)} to convert")
+    start = time.monotonic()
+    n_done = n_failed = n_samples = n_duplicates = 0
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                             initializer=_init_worker,
+                             initargs=(ledger_path,)) as pool:
+        futures = {
+            pool.submit(_convert_file, item[0], sds_root, encoding): item
+            for item in todo
+        }
+        for future in as_completed(futures):
+            path, stat, sha1 = futures[future]
+            summary, convert_s, error = future.result()
+            if error is None:
+                ledger.converted(path, stat, sha1, summary, 0., convert_s,
+                                 archived=True)
+                n_done += 1
+                n_samples += summary.samples
+                n_duplicates += summary.duplicate_samples
+            else:
+                ledger.failed(path, error)
+                n_failed += 1
+                print(f"Failed: {path} ({error})")
+            if (n_done + n_failed) % report_every == 0:
+                _report(n_done, n_failed, n_samples, n_duplicates,
+                        len(todo), start)
+    _report(n_done, n_failed, n_samples, n_duplicates, len(todo), start)
+
+
+def _report(n_done, n_failed, n_samples, n_duplicates, n_total, start):
+    elapsed = max(time.monotonic() - start, 1e-9)
+    print(f"[{n_done + n_failed}/{n_total}] {n_failed} failed, "
+          f"{n_duplicates} duplicate samples dropped - "
+          f"{n_done / elapsed:.1f} files/s, "
+          f"{n_samples / elapsed / 1e6:.2f} Msamples/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--ftp-root', default='/data/ftp')
+    parser.add_argument('--station', action='append', dest='stations',
+                        help="Station folder to process (repeatable).")
+    parser.add_argument('--pattern', default='*',
+                        help="File name pattern (default: all files).")
+    parser.add_argument('--archive', default=SDS_ROOT)
+    parser.add_argument('--ledger', default=LEDGER_PATH,
+                        help="Ingestion ledger database.")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of processes (default: cpu count).")
+    parser.add_argument('--encoding', choices=ENCODINGS, default='STEIM2',
+                        help="MiniSEED encoding of the counts.")
+    args = parser.parse_args()
+
+    paths = find_files(args.ftp_root, args.stations, args.pattern)
+    backfill(paths, IngestLedger(args.ledger), args.archive, args.workers,
+             ledger_path=args.ledger, encoding=args.encoding)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+"""Long-lived ingestion service for the myo files uploaded by the stations.
+
+Watch the FTP tree with inotify and convert every closed myo file with
+myo2mseed.convert() from a bounded work queue. ObsPy and NumPy are imported
+once for the lifetime of the service instead of once per uploaded file.
+
+Converted traces go through a BatchArchiver, so that bursts of uploads
+(e.g. a station reconnecting after an outage) are coalesced into one SDS
+write per (stream, day). Every file is tracked in the ingestion ledger
+(status, sample span, per-stage timings), which is also used to skip
+files whose content was already archived, and samples already archived
+by a previous upload are dropped before encoding (span index). The spans
+of data waiting in the archiver are claimed as pending until written: at
+startup, the pending spans and the files left unfinished by a previous
+run (crash) are released and converted again. Per-file conversion
+latency, queue depth and duplicate counts are logged and periodically
+written as JSON to a status file.
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import queue
+import signal
+import threading
+import time
+
+from obspy import UTCDateTime
+
+from inotify_watch import InotifyWatcher, IN_CLOSE_WRITE, IN_MOVED_TO
+from ingest_ledger import IngestLedger, LEDGER_PATH, file_hash
+from myo2mseed import convert
+from sds_archiver import BatchArchiver
+from sds_writer import ENCODINGS
+from span_index import SpanIndex
+
+logger = logging.getLogger('myo_ingest')
+
+
+class IngestStats:
+    """Thread-safe counters and latency history of the ingestion service."""
+
+    def __init__(self, history=500):
+        self._lock = threading.Lock()
+        self.converted = 0
+        self.failed = 0
+        self.skipped = 0  # files with content already archived
+        self.duplicate_samples = 0  # dropped from partially new files
+        self.latencies = collections.deque(maxlen=history)
+
+    def record(self, latency, success):
+        with self._lock:
+            if success:
+                self.converted += 1
+            else:
+                self.failed += 1
+            self.latencies.append(latency)
+
+    def record_duplicates(self, samples=0, skipped=False):
+        with self._lock:
+            self.duplicate_samples += samples
+            self.skipped += skipped
+
+    def snapshot(self, queue_depth):
+        """Return a JSON serializable summary of the current state."""
+        with self._lock:
+            last = self.latencies[-1] if self.latencies else None
+            latencies = sorted(self.latencies)
+            converted, failed = self.converted, self.failed
+            skipped, duplicate_samples = self.skipped, self.duplicate_samples
+        summary = {
+            'time': time.time(),
+            'queue_depth': queue_depth,
+            'converted': converted,
+            'failed': failed,
+            'skipped': skipped,
+            'duplicate_samples': duplicate_samples,
+            'latency_last_s': last,
+            'latency_mean_s': None,
+            'latency_p95_s': None,
+            'latency_max_s': None,
+        }
+        if latencies:
+            summary['latency_mean_s'] = sum(latencies) / len(latencies)
+            p95_index = int(0.95 * (len(latencies) - 1))
+            summary['latency_p95_s'] = latencies[p95_index]
+            summary['latency_max_s'] = latencies[-1]
+        return summary
+
+
+class IngestService:
+    """Watcher thread feeding a bounded queue consumed by converter threads.
+
+    Conversion time is mostly spent in NumPy and in libmseed (through
+    ctypes), both releasing the GIL, so worker threads are sufficient.
+    When the queue is full the watcher blocks, and pending events are
+    buffered by the kernel inotify queue.
+    """
+
+    def __init__(self, watch_dir, workers=2, queue_size=256,
+                 status_file=None, status_interval=30., archive_window=5.,
+                 archive_writers=2, ledger=None, spans=None,
+                 encoding='STEIM2'):
+        self.watch_dir = watch_dir
+        self.ledger = ledger
+        self.spans = spans
+        self.encoding = encoding  # also for the direct writes of convert
+        self.archiver = BatchArchiver(window=archive_window,
+                                      max_writers=archive_writers,
+                                      encoding=encoding,
+                                      on_archived=self._archived)
+        # Files being converted or with traces in the archiver (by path),
+        # see _settle
+        self._files = {}
+        self._recovered = []  # unfinished files of a previous run
+        self._ledger_lock = threading.Lock()
+        self.n_workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.status_file = status_file
+        self.status_interval = status_interval
+        self.stats = IngestStats()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _watch(self):
+        watcher = InotifyWatcher(self.watch_dir, IN_CLOSE_WRITE | IN_MOVED_TO)
+        logger.info("Watching %s", self.watch_dir)
+        try:
+            for path in self._recovered:
+                self._enqueue(path, time.monotonic())
+            while not self._stop.is_set():
+                for path, _ in watcher.read_events(timeout=1.):
+                    enqueued = time.monotonic()
+                    if self.ledger is not None:
+                        self.ledger.queued(path)
+                    self._enqueue(path, enqueued)
+        finally:
+            watcher.close()
+
+    def _enqueue(self, path, enqueued):
+        while not self._stop.is_set():
+            try:
+                self.queue.put((path, enqueued), timeout=1.)
+                return
+            except queue.Full:
+                continue
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            path, enqueued = item
+            start = time.monotonic()
+            status = self._process(path, start - enqueued)
+            end = time.monotonic()
+            if status != 'Skipped':
+                self.stats.record(end - enqueued, status == 'Converted')
+            logger.info(
+                "%s %s in %.3f s (waited %.3f s, queue depth %d)",
+                status, path, end - start, start - enqueued,
+                self.queue.qsize()
+            )
+            self.queue.task_done()
+
+    def _process(self, path, wait_s):
+        """Convert one file and record it in the ledger, return a status."""
+        # Spans pending until archived, see the module doc
+        claim = None if self.spans is None \
+            else self.spans.new_claim(pending=True)
+        try:
+            stat = os.stat(path)
+            sha1 = file_hash(path)
+            if self.ledger is not None and \
+                    self.ledger.is_done(path, stat, sha1):
+                self.ledger.duplicate(path, stat, sha1)
+                self.stats.record_duplicates(skipped=True)
+                return 'Skipped'
+            with self._ledger_lock:
+                state = self._files.setdefault(path, {
+                    'converting': 0, 'claims': [], 'submitted': 0,
+                    'archived': 0, 'archive_s': 0., 'failures': []})
+                state['converting'] += 1
+            start = time.perf_counter()
+            summary = convert(path, archiver=self.archiver, source=path,
+                              spans=claim, encoding=self.encoding)
+            convert_s = time.perf_counter() - start
+        except Exception as err:
+            logger.exception("Conversion failed for %s", path)
+            with self._ledger_lock:
+                state = self._files.get(path)
+                if state is not None:
+                    state['converting'] -= 1
+                    if not state['converting']:
+                        # Archive results of its submitted traces ignored
+                        del self._files[path]
+            if claim is not None:
+                claim.release()
+            if self.ledger is not None:
+                self.ledger.failed(path, f"{type(err).__name__}: {err}")
+            return 'Failed'
+        if summary.duplicate_samples:
+            logger.info("Dropped %d already archived sample(s) of %s",
+                        summary.duplicate_samples, path)
+            self.stats.record_duplicates(summary.duplicate_samples)
+        with self._ledger_lock:
+            state = self._files[path]
+            state['converting'] -= 1
+            state['submitted'] += summary.submitted
+            if claim is not None:
+                state['claims'].append(claim)
+            if self.ledger is not None:
+                self.ledger.converted(path, stat, sha1, summary, wait_s,
+                                      convert_s, summary.archived)
+            self._settle(path)
+        return 'Converted'
+
+    def _archived(self, sources, elapsed, failures):
+        """BatchArchiver callback: count the archived traces of each file.
+
+        The traces of a file may be split across batches: failures are
+        accumulated until its last batch is written (see _settle).
+        """
+        with self._ledger_lock:
+            for path, count in sources.items():
+                state = self._files.get(path)
+                if state is None:  # conversion failed
+                    continue
+                state['archived'] += count
+                state['archive_s'] += elapsed
+                state['failures'].extend(failures.get(path, ()))
+                self._settle(path)
+
+    def _settle(self, path):
+        """Record the archive step of a file once converted and all its
+        traces archived (ledger lock held).
+
+        Its span claims are committed, except the spans of the failed
+        (stream, day) groups, which are released, and the file is recorded
+        as archived, or failed if any of its groups failed.
+        """
+        state = self._files[path]
+        if state['converting'] or state['archived'] < state['submitted']:
+            return
+        del self._files[path]
+        failures = state['failures']
+        for claim in state['claims']:
+            for stream, start_ns, end_ns, _ in failures:
+                claim.release(stream, start_ns, end_ns)
+            claim.commit()
+        if self.ledger is None or not state['submitted']:
+            return  # archived by the conversion (see ledger.converted)
+        if not failures:
+            self.ledger.archived([path], state['archive_s'])
+        else:
+            self.ledger.failed(path, '; '.join(
+                f"{stream} {UTCDateTime(ns=start_ns).strftime('%Y.%j')}: "
+                f"{message}" for stream, start_ns, _, message in failures))
+
+    def _report(self):
+        while not self._stop.wait(self.status_interval):
+            self.write_status()
+
+    def write_status(self):
+        """Dump the current statistics to the status file (if any)."""
+        if self.status_file is None:
+            return
+        summary = self.stats.snapshot(self.queue.qsize())
+        summary['archive_queue_depth'] = self.archiver.queue.qsize()
+        summary['archived_traces'] = self.archiver.traces_submitted
+        summary['archive_writes'] = self.archiver.writes
+        tmp_file = self.status_file + '.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump(summary, file)
+        os.replace(tmp_file, self.status_file)  # atomic for readers
+
+    def start(self):
+        """Start the watcher, converter and status threads.
+
+        Spans left pending by a previous run are released first, and its
+        unfinished files queued again (see module doc).
+        """
+        if self.spans is not None:
+            released = self.spans.release_pending()
+            if released:
+                logger.warning("Released %d pending span(s) of a previous "
+                               "run", released)
+        if self.ledger is not None:
+            self._recovered = self.ledger.requeue_unfinished()
+            if self._recovered:
+                logger.warning("Converting %d unfinished file(s) again",
+                               len(self._recovered))
+        for _ in range(self.n_workers):
+            self._threads.append(threading.Thread(target=self._work))
+        self._watcher = threading.Thread(target=self._watch)
+        self._reporter = threading.Thread(target=self._report, daemon=True)
+        for thread in self._threads + [self._watcher, self._reporter]:
+            thread.start()
+
+    def stop(self):
+        """Stop watching, convert the files already queued, then return."""
+        self._stop.set()
+        self._watcher.join()
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self.archiver.close()
+        self.write_status()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--watch', default='/data/ftp',
+                        help="Root of the FTP tree to watch.")
+    parser.add_argument('--workers', type=int,
+                        default=int(os.environ.get('INGEST_WORKERS', 2)),
+                        help="Number of converter threads.")
+    parser.add_argument('--queue-size', type=int, default=256,
+                        help="Maximum number of files waiting for conversion.")
+    parser.add_argument('--status-file',
+                        default='/usr/local/app/ingest_status.json',
+                        help="JSON file updated with latency and queue depth.")
+    parser.add_argument('--status-interval', type=float, default=30.,
+                        help="Status file update period (s).")
+    parser.add_argument('--archive-window', type=float, default=5.,
+                        help="Time window for coalescing archive writes (s).")
+    parser.add_argument('--archive-writers', type=int, default=2,
+                        help="Maximum number of concurrent archive writes.")
+    parser.add_argument('--ledger', default=LEDGER_PATH,
+                        help="Ingestion ledger database.")
+    parser.add_argument('--encoding', choices=ENCODINGS, default='STEIM2',
+                        help="MiniSEED encoding of the counts.")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(name)s %(levelname)s %(message)s'
+    )
+    service = IngestService(args.watch, args.workers, args.queue_size,
+                            args.status_file, args.status_interval,
+                            args.archive_window, args.archive_writers,
+                            IngestLedger(args.ledger), SpanIndex(args.ledger),
+                            args.encoding)
+    stop_requested = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_requested.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_requested.set())
+    service.start()
+    while not stop_requested.wait(1.):
+        pass
+    logger.info("Stop requested, draining queue...")
+    service.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Reader for the myo binary files sent by the NETRISK stations.
+
+File layout (little endian, packed):
+- station header: start time (u8, unix s), sub-second part (u4, us),
+  tick duration (u8, ns), sensor count (u2), then the NET.STA.LOC.CHA1_CHA2
+  stream name as a null terminated ascii string
+- one header per sensor: id (u2), saving ticks (u8), calib_0, calib_1,
+  coeff_0 and coeff_1 (f4)
+- interleaved records: clock (u8, ticks since start of measure) followed
+  by one int32 count per sensor
+
+The whole file is described with NumPy structured dtypes and memory mapped
+in one go, so that channels are exposed as strided views of the records
+without any per-sensor copy. Very large files can also be processed by
+fixed-size chunks of records (see MyoFile.iter_chunks) to bound memory.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+HEADER_DTYPE = np.dtype([
+    ('started_time', '<u8'),  # unix stamp (s)
+    ('subsec', '<u4'),  # us
+    ('tick_time', '<u8'),  # ns
+    ('sensor_count', '<u2'),
+])
+SENSOR_DTYPE = np.dtype([
+    ('id', '<u2'),
+    ('saving_ticks', '<u8'),
+    ('calib_0', '<f4'),
+    ('calib_1', '<f4'),
+    ('coeff_0', '<f4'),
+    ('coeff_1', '<f4'),
+])
+MAX_NAME_LENGTH = 256
+
+
+def record_dtype(sensor_count):
+    """Return the dtype of one record: clock followed by the sensor counts."""
+    return np.dtype([
+        ('clock', '<u8'),  # number of ticks since beginning of measure
+        ('counts', '<i4', (sensor_count,)),  # counts are signed
+    ])
+
+
+@dataclass(frozen=True)
+class MyoSensor:
+    """Header of one sensor, including its calibration coefficients."""
+
+    id: int
+    saving_ticks: int
+    calib_0: float
+    calib_1: float
+    coeff_0: float
+    coeff_1: float
+
+
+@dataclass(frozen=True)
+class MyoFile:
+    """Parsed content of a myo file."""
+
+    station_name: str
+    started_time: int
+    subsec: int
+    tick_time: int
+    sensors: list
+    records: np.ndarray  # structured array of record_dtype(len(sensors))
+    path: str = None
+    data_offset: int = 0  # offset of the first record in the file
+
+    @property
+    def network(self):
+        return self.station_name.split('.')[0]
+
+    @property
+    def station(self):
+        return self.station_name.split('.')[1]
+
+    @property
+    def location(self):
+        return self.station_name.split('.')[2]
+
+    @property
+    def channels(self):
+        return self.station_name.split('.')[3].split('_')
+
+    @property
+    def npts(self):
+        return len(self.records)
+
+    @property
+    def delta(self):
+        """Sampling interval (s)."""
+        return self.tick_time / 1_000_000_000
+
+    @property
+    def start_ns(self):
+        """Time of the first record (ns since epoch)."""
+        return (self.started_time * 1_000_000_000 + self.subsec * 1_000
+                + int(self.records['clock'][0]) * self.tick_time)
+
+    def channel_data(self, sensor):
+        """Return the counts of a sensor as a strided (non copied) view."""
+        return self.records['counts'][:, sensor]
+
+    def iter_chunks(self, chunk_records):
+        """Yield (first record index, records) by chunks of the file.
+
+        Each chunk is a separate, short-lived memory map, so that pages of
+        already processed chunks are released and memory stays bounded
+        regardless of the file size.
+        """
+        dtype = self.records.dtype
+        for first in range(0, self.npts, chunk_records):
+            chunk = np.memmap(self.path, dtype=dtype, mode='r',
+                              offset=self.data_offset + first * dtype.itemsize,
+                              shape=(min(chunk_records, self.npts - first),))
+            yield first, chunk
+            del chunk
+
+
+def _parse_headers(raw):
+    """Parse the station and sensor headers of a uint8 buffer.
+
+    Return the header fields, the station name, the sensors and the offset
+    of the first record.
+    """
+    header = raw[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+    offset = HEADER_DTYPE.itemsize
+    name_field = raw[offset:offset + MAX_NAME_LENGTH].tobytes()
+    name_length = name_field.find(b'\x00')
+    if name_length < 0:
+        raise ValueError("Station name is not null terminated.")
+    station_name = name_field[:name_length].decode('ascii')
+    offset += name_length + 1
+    sensor_count = int(header['sensor_count'])
+    sensor_end = offset + sensor_count * SENSOR_DTYPE.itemsize
+    sensor_headers = raw[offset:sensor_end].view(SENSOR_DTYPE)
+    sensors = [
+        MyoSensor(int(s['id']), int(s['saving_ticks']), float(s['calib_0']),
+                  float(s['calib_1']), float(s['coeff_0']),
+                  float(s['coeff_1']))
+        for s in sensor_headers
+    ]
+    return header, station_name, sensors, sensor_end
+
+
+def read_station_name(fname):
+    """Return the NET.STA.LOC.CHA1_CHA2 stream name of a myo file header,
+    reading only the header bytes."""
+    with open(fname, 'rb') as file:
+        file.seek(HEADER_DTYPE.itemsize)
+        name_field = file.read(MAX_NAME_LENGTH)
+    name_length = name_field.find(b'\x00')
+    if name_length < 0:
+        raise ValueError("Station name is not null terminated.")
+    return name_field[:name_length].decode('ascii')
+
+
+def read_myo(fname, mmap=True):
+    """Parse a myo file.
+
+    With mmap (default), the records are a read-only view of a memory map
+    of the file. Otherwise the file is read into memory at once.
+    An incomplete trailing record (interrupted upload) is dropped.
+    """
+    if mmap:
+        raw = np.memmap(fname, dtype=np.uint8, mode='r')
+    else:
+        with open(fname, 'rb') as file:
+            raw = np.frombuffer(file.read(), dtype=np.uint8)
+    header, station_name, sensors, offset = _parse_headers(raw)
+    dtype = record_dtype(len(sensors))
+    n_records = (len(raw) - offset) // dtype.itemsize
+    if n_records < 1:
+        raise ValueError(f"No data record in {fname}.")
+    records = raw[offset:offset + n_records * dtype.itemsize].view(dtype)
+    return MyoFile(
+        station_name=station_name,
+        started_time=int(header['started_time']),
+        subsec=int(header['subsec']),
+        tick_time=int(header['tick_time']),
+        sensors=sensors,
+        records=records,
+        path=fname,
+        data_offset=offset,
+    )
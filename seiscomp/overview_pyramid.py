@@ -0,0 +1,253 @@
+"""Build the min/max overview pyramid of the SDS archive (cron job).
+
+For every day file of the archive, the minimum and maximum of the samples
+are computed per 1 s bucket, and reduced to 10 s, 1 min and 10 min
+buckets. Each level is stored as a (buckets, 2) float32 NumPy file (NaN
+for buckets without data) mirroring the archive tree:
+overview/YYYY/NET/STA/CHA.D/NET.STA.LOC.CHA.D.YYYY.DOY.<level>s.npy
+The UI reads (memory maps) the coarsest level resolving the plot width,
+so that plotting a long window does not require decoding the raw samples.
+
+Updates are incremental: the size of each day file and a checksum of its
+last record are kept in a small SQLite database, so that only the records
+appended since the previous run are decoded and merged into the existing
+buckets. Day files rewritten by late record insertions (see sds_writer)
+are processed again from the start.
+
+Usage (from /usr/local/app, with the obspy venv python):
+    python overview_pyramid.py
+    python overview_pyramid.py --rebuild    # ignore the previous state
+"""
+
+import argparse
+import fcntl
+import io
+import os
+import sqlite3
+import sys
+import time
+import zlib
+
+import numpy as np
+from obspy import read, UTCDateTime
+
+from sds_writer import SDS_ROOT, record_start_times
+
+OVERVIEW_ROOT = '/usr/local/app/seiscomp/var/lib/overview'
+LEVELS = (1, 10, 60, 600)  # bucket lengths (s), multiples of the first
+CHUNK_BYTES = 8 * 1024 ** 2  # records decoded at once (bounds memory)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS day_files (
+    path TEXT PRIMARY KEY,  -- relative to the archive root
+    size INTEGER NOT NULL,  -- bytes processed
+    tail_length INTEGER NOT NULL,  -- length of the last record processed
+    tail_crc INTEGER NOT NULL
+);
+"""
+
+
+def overview_path(root, rel_path, level):
+    """Return the path of the overview of a day file at a level."""
+    return os.path.join(root, f'{rel_path}.{level}s.npy')
+
+
+def day_start_ns(rel_path):
+    """Return the start time (ns) of an SDS day file from its name."""
+    year, doy = rel_path.rsplit('.', 2)[-2:]
+    return UTCDateTime(year=int(year), julday=int(doy)).ns
+
+
+def find_day_files(archive):
+    """List the day files of the archive (paths relative to the root)."""
+    paths = []
+    for dirpath, _, filenames in os.walk(archive):
+        if not dirpath.endswith('.D'):
+            continue
+        rel_dir = os.path.relpath(dirpath, archive)
+        paths.extend(os.path.join(rel_dir, name) for name in filenames
+                     if '.D.' in name)
+    return sorted(paths)
+
+
+def read_from(path, offset):
+    """Return the size of a day file and its bytes from offset.
+
+    The file is read under a shared lock (see sds_writer.append_records).
+    """
+    with open(path, 'rb') as file:
+        fcntl.flock(file, fcntl.LOCK_SH)
+        try:
+            size = file.seek(0, os.SEEK_END)
+            file.seek(min(offset, size))
+            return size, file.read()
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def merge_trace(buckets, trace, day_ns):
+    """Merge the min/max of a trace into the 1 s buckets of a day."""
+    data = trace.data
+    if not len(data):
+        return
+    level_ns = LEVELS[0] * 1_000_000_000
+    offsets = trace.stats.starttime.ns - day_ns + np.round(
+        np.arange(len(data)) * trace.stats.delta * 1e9).astype(np.int64)
+    index = offsets // level_ns
+    inside = (index >= 0) & (index < len(buckets))
+    if not inside.all():
+        data, index = data[inside], index[inside]
+        if not len(data):
+            return
+    # Index is sorted: reduce each run of samples of the same bucket
+    runs = np.concatenate(([0], np.flatnonzero(np.diff(index)) + 1))
+    index = index[runs]
+    buckets[index, 0] = np.fmin(buckets[index, 0],
+                                np.minimum.reduceat(data, runs))
+    buckets[index, 1] = np.fmax(buckets[index, 1],
+                                np.maximum.reduceat(data, runs))
+
+
+def reduce_level(buckets, factor):
+    """Reduce (n, 2) min/max buckets by an integer factor (NaN ignored)."""
+    buckets = buckets.reshape(-1, factor, 2)
+    return np.stack((np.fmin.reduce(buckets[:, :, 0], axis=1),
+                     np.fmax.reduce(buckets[:, :, 1], axis=1)), axis=1)
+
+
+def save_atomic(path, array):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        np.save(file, array)
+    os.replace(tmp_path, path)  # readers never see a partial file
+
+
+class OverviewBuilder:
+    """Incremental builder of the overview files of an archive."""
+
+    def __init__(self, archive=SDS_ROOT, overview=OVERVIEW_ROOT):
+        self.archive = archive
+        self.overview = overview
+        os.makedirs(overview, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(overview, 'state.db'))
+        self._conn.executescript(SCHEMA)
+
+    def run(self, rebuild=False):
+        """Update the overviews of the day files changed since last run.
+
+        Return the number of day files and bytes processed.
+        """
+        state = {} if rebuild else {
+            row[0]: row[1:] for row in self._conn.execute(
+                'SELECT path, size, tail_length, tail_crc FROM day_files')}
+        n_files, n_bytes = 0, 0
+        rel_paths = find_day_files(self.archive)
+        for rel_path in rel_paths:
+            try:
+                size = os.path.getsize(os.path.join(self.archive, rel_path))
+            except FileNotFoundError:
+                continue
+            if rel_path in state and state[rel_path][0] == size:
+                continue
+            n_bytes += self.update(rel_path, state.get(rel_path))
+            n_files += 1
+        for rel_path in set(state) - set(rel_paths):  # deleted day files
+            self.remove(rel_path)
+        return n_files, n_bytes
+
+    def update(self, rel_path, previous=None):
+        """Merge the new records of a day file into its overview.
+
+        Return the number of bytes decoded.
+        """
+        path = os.path.join(self.archive, rel_path)
+        buckets = None
+        offset = 0
+        if previous is not None:
+            old_size, tail_length, tail_crc = previous
+            size, data = read_from(path, old_size - tail_length)
+            # Pure append if the last record processed has not moved
+            if size > old_size and \
+                    zlib.crc32(data[:tail_length]) == tail_crc:
+                try:
+                    buckets = np.load(overview_path(
+                        self.overview, rel_path, LEVELS[0]))
+                    data = data[tail_length:]
+                    offset = old_size
+                except (OSError, ValueError):
+                    buckets = None
+        if buckets is None:
+            _, data = read_from(path, 0)
+            offset = 0
+            buckets = np.full((86400 // LEVELS[0], 2), np.nan, np.float32)
+        records = record_start_times(data)
+        day_ns = day_start_ns(rel_path)
+        first = 0
+        while first < len(records):
+            # Group records into chunks of about CHUNK_BYTES
+            start = records[first][0]
+            last = first + 1
+            while last < len(records) and \
+                    records[last][0] + records[last][1] - start < CHUNK_BYTES:
+                last += 1
+            end = records[last - 1][0] + records[last - 1][1]
+            for trace in read(io.BytesIO(data[start:end]), format='MSEED'):
+                merge_trace(buckets, trace, day_ns)
+            first = last
+        for level in LEVELS:
+            save_atomic(overview_path(self.overview, rel_path, level),
+                        reduce_level(buckets, level // LEVELS[0]))
+        processed, tail_length, tail_crc = offset + len(data), 0, 0
+        if records:
+            tail_offset, tail_length, _ = records[-1]
+            processed = offset + tail_offset + tail_length
+            tail_crc = zlib.crc32(
+                data[tail_offset:tail_offset + tail_length])
+        elif offset:  # no complete record appended
+            tail_length, tail_crc = previous[1:]
+        with self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO day_files VALUES (?, ?, ?, ?)',
+                (rel_path, processed, tail_length, tail_crc))
+        return len(data)
+
+    def remove(self, rel_path):
+        for level in LEVELS:
+            try:
+                os.remove(overview_path(self.overview, rel_path, level))
+            except FileNotFoundError:
+                pass
+        with self._conn:
+            self._conn.execute('DELETE FROM day_files WHERE path = ?',
+                               (rel_path,))
+
+    def close(self):
+        self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--archive', default=SDS_ROOT)
+    parser.add_argument('--overview', default=OVERVIEW_ROOT)
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Process all the day files from the start.")
+    args = parser.parse_args()
+
+    os.makedirs(args.overview, exist_ok=True)
+    with open(os.path.join(args.overview, '.lock'), 'w') as lock:
+        try:  # previous cron run still going
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            sys.exit(0)
+        builder = OverviewBuilder(args.archive, args.overview)
+        start = time.monotonic()
+        n_files, n_bytes = builder.run(args.rebuild)
+        builder.close()
+    if n_files:
+        print(f"{n_files} day files updated ({n_bytes / 1e6:.1f} MB) in "
+              f"{time.monotonic() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
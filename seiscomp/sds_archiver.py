@@ -0,0 +1,198 @@
+"""Batched, coalescing archiving stage in front of the SDS writer.
+
+Traces submitted by the converters are collected over a short window,
+grouped by stream ID and day, merged when contiguous, and each group is
+archived with a single append to its SDS day file. When a station flushes
+dozens of files after an outage, this costs about one archive write per
+(stream, day) instead of one per uploaded file.
+
+Back-pressure: submit() blocks when the bounded input queue is full, which
+happens when the writers (limited by a concurrency cap) cannot keep up.
+
+Can also be run as a script to archive a directory of MiniSEED segment
+files (e.g. leftovers of the former mseed_segments + scart pipeline).
+"""
+
+import argparse
+import collections
+import glob
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from obspy import read
+from obspy.core import Stream
+
+from sds_writer import SDS_ROOT, NS_PER_DAY, split_by_day, sds_path, \
+    append_records, encode
+
+logger = logging.getLogger('sds_archiver')
+
+
+def group_by_stream_and_day(traces, sources=None):
+    """Split traces at day boundaries and group them by (id, day).
+
+    Contiguous traces of a group are merged into a single trace. If
+    sources (one per trace, or None) are given, return the groups and the
+    set of sources of each group.
+    """
+    groups = collections.defaultdict(Stream)
+    group_sources = collections.defaultdict(set)
+    for trace, source in zip(traces, sources or itertools.repeat(None)):
+        for piece in split_by_day(trace):
+            key = (piece.id, piece.stats.starttime.strftime('%Y.%j'))
+            groups[key].append(piece)
+            if source is not None:
+                group_sources[key].add(source)
+    for stream in groups.values():
+        stream.sort(keys=['starttime'])
+        stream.merge(method=-1)  # only merges contiguous or identical data
+    if sources is None:
+        return groups
+    return groups, group_sources
+
+
+def archive_group(stream, root=SDS_ROOT, **kwargs):
+    """Encode all traces of one (id, day) group and append them at once."""
+    stats = stream[0].stats
+    path = sds_path(root, stats.network, stats.station, stats.location,
+                    stats.channel, stats.starttime)
+    append_records(path, b''.join(encode(tr, **kwargs) for tr in stream))
+    return path
+
+
+class BatchArchiver:
+    """Collect traces over a time window and archive them by (id, day).
+
+    on_archived(sources, elapsed, failures) is called once all the writes
+    of a batch are done, with the number of traces of each source (e.g.
+    myo file paths) in that batch, as a Counter (the traces of a source
+    may be split across batches), the batch archiving time, and the failed
+    groups of each source with a failed group, as a dict of lists of
+    (stream id, day start ns, day end ns, error message).
+    """
+
+    def __init__(self, root=SDS_ROOT, window=5., max_writers=2,
+                 queue_size=64, on_archived=None, **encode_kwargs):
+        self.root = root
+        self.window = window
+        self.on_archived = on_archived
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.encode_kwargs = encode_kwargs
+        self._executor = ThreadPoolExecutor(max_workers=max_writers)
+        self._slots = threading.Semaphore(max_writers)
+        self._thread = threading.Thread(target=self._collect)
+        self.traces_submitted = 0
+        self.writes = 0
+        self._thread.start()
+
+    def submit(self, trace, source=None):
+        """Queue a trace for archiving (blocks when the queue is full)."""
+        self.queue.put((trace, source))
+
+    def _collect(self):
+        pending = []
+        deadline = None
+        stopping = False
+        while not stopping or pending:
+            timeout = None if deadline is None \
+                else max(0., deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+                if item is None:
+                    stopping = True
+                else:
+                    pending.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.window
+            except queue.Empty:
+                pass
+            expired = deadline is not None and time.monotonic() >= deadline
+            if pending and (expired or stopping):
+                self._flush(pending)
+                pending = []
+                deadline = None
+
+    def _flush(self, items):
+        groups, group_sources = group_by_stream_and_day(
+            [trace for trace, _ in items], [source for _, source in items])
+        batch = {
+            'sources': collections.Counter(
+                source for _, source in items if source is not None),
+            'remaining': len(groups),
+            'start': time.monotonic(),
+            'failures': collections.defaultdict(list),
+            'lock': threading.Lock(),
+        }
+        logger.info("Archiving %d trace(s) in %d write(s)", len(items),
+                    len(groups))
+        for key, stream in groups.items():
+            self._slots.acquire()  # concurrency cap, blocks the collector
+            future = self._executor.submit(archive_group, stream, self.root,
+                                           **self.encode_kwargs)
+            future.add_done_callback(
+                lambda future, key=key, stream=stream: self._done(
+                    future, batch, stream, group_sources[key]))
+        self.traces_submitted += len(items)
+        self.writes += len(groups)
+
+    def _done(self, future, batch, stream, sources):
+        self._slots.release()
+        error = future.exception()
+        if error is not None:
+            logger.error("Archiving failed for %s: %s", stream[0].id, error)
+        with batch['lock']:
+            if error is not None:
+                day_start = stream[0].stats.starttime.ns \
+                    // NS_PER_DAY * NS_PER_DAY
+                failure = (stream[0].id, day_start, day_start + NS_PER_DAY,
+                           f"Archiving: {type(error).__name__}: {error}")
+                for source in sources:
+                    batch['failures'][source].append(failure)
+            batch['remaining'] -= 1
+            if batch['remaining'] or self.on_archived is None:
+                return
+        self.on_archived(batch['sources'],
+                         time.monotonic() - batch['start'],
+                         dict(batch['failures']))
+
+    def close(self):
+        """Archive all pending traces and wait for the writers."""
+        self.queue.put(None)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+
+def archive_segment_files(paths, root=SDS_ROOT, delete=False):
+    """Archive MiniSEED segment files by (id, day) groups in one pass."""
+    traces = []
+    for path in paths:
+        traces.extend(read(path, format='MSEED'))
+    groups = group_by_stream_and_day(traces)
+    for stream in groups.values():
+        archive_group(stream, root)
+    if delete:
+        for path in paths:
+            os.remove(path)
+    return len(groups)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Archive a directory of MiniSEED segment files in SDS.")
+    parser.add_argument('segments_dir')
+    parser.add_argument('--archive', default=SDS_ROOT)
+    parser.add_argument('--delete', action='store_true',
+                        help="Remove segment files once archived.")
+    args = parser.parse_args()
+    paths = sorted(glob.glob(os.path.join(args.segments_dir, '*')))
+    n_writes = archive_segment_files(paths, args.archive, args.delete)
+    print(f"Archived {len(paths)} segment file(s) in {n_writes} write(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Direct writer of MiniSEED records into the SeisComP SDS archive.
+
+Traces are split at day boundaries and the encoded records are appended to
+archive/YYYY/NET/STA/CHA.D/NET.STA.LOC.CHA.D.YYYY.DOY under an exclusive
+file lock, so that several conversion workers can write concurrently.
+Records arriving late (older than the end of a day file) are inserted in
+time order, as expected by the SeisComP SDS record stream.
+
+Integer counts are Steim2 compressed by default (as ObsPy does for int32
+data), in 4096 byte records (the ObsPy default) unless the whole trace
+fits in a shorter record (see record_length).
+"""
+
+import fcntl
+import io
+import math
+import os
+import struct
+
+import numpy as np
+from obspy.core import Trace, UTCDateTime
+from obspy.io.mseed import InternalMSEEDError
+
+SDS_ROOT = '/usr/local/app/seiscomp/var/lib/archive'
+NS_PER_DAY = 86400 * 1_000_000_000
+ENCODINGS = ('STEIM2', 'STEIM1', 'INT32')  # for int32 counts
+# Estimated encoded size of a count (bytes), see record_length
+SAMPLE_BYTES = {'STEIM2': 1.2, 'STEIM1': 1.6, 'INT32': 4.}
+RECORD_HEADER = 64  # fixed header and blockettes 1000 and 1001 (bytes)
+
+
+def sds_path(root, net, sta, loc, cha, time):
+    """Return the path of the SDS day file containing time."""
+    year, doy = time.year, time.julday
+    return os.path.join(
+        root, str(year), net, sta, f'{cha}.D',
+        f'{net}.{sta}.{loc}.{cha}.D.{year}.{doy:03d}'
+    )
+
+
+def split_by_day(trace):
+    """Split a trace at day boundaries (UTC) without copying its data."""
+    start_ns = trace.stats.starttime.ns
+    delta_ns = int(round(trace.stats.delta * 1_000_000_000))
+    npts = trace.stats.npts
+    pieces = []
+    first = 0
+    while first < npts:
+        sample_ns = start_ns + first * delta_ns
+        next_day_ns = (sample_ns // NS_PER_DAY + 1) * NS_PER_DAY
+        # index of the first sample at or after midnight
+        last = min(npts, -(-(next_day_ns - start_ns) // delta_ns))
+        header = trace.stats.copy()
+        header.starttime = UTCDateTime(ns=sample_ns)
+        header.npts = last - first  # not updated by Trace() from Stats
+        pieces.append(Trace(data=trace.data[first:last], header=header))
+        first = last
+    return pieces
+
+
+def record_length(npts, encoding='STEIM2'):
+    """Return a MiniSEED record length suited to a trace of npts counts.
+
+    Records are 4096 bytes (least header overhead), unless the whole
+    trace is estimated to fit in a shorter record (512 bytes at least):
+    a short upload then does not pad most of a 4096 byte record.
+    """
+    size = RECORD_HEADER + npts * SAMPLE_BYTES.get(encoding, 4.)
+    return min(4096, max(512, 2 ** math.ceil(math.log2(size))))
+
+
+def encode(trace, encoding='STEIM2', **kwargs):
+    """Encode a trace as MiniSEED records (kwargs passed to ObsPy).
+
+    Integer counts are encoded with the given encoding (one of ENCODINGS)
+    and a record length depending on the trace length, unless reclen is
+    given. Traces that Steim cannot compress (differences of consecutive
+    samples above 30 bits) fall back to INT32. Other data types keep the
+    ObsPy default encoding.
+    """
+    if trace.data.dtype == np.int32:
+        kwargs['encoding'] = encoding
+        kwargs.setdefault('reclen', record_length(trace.stats.npts,
+                                                  encoding))
+    buffer = io.BytesIO()
+    try:
+        trace.write(buffer, format='MSEED', **kwargs)
+    except InternalMSEEDError:
+        if kwargs.get('encoding') not in ('STEIM1', 'STEIM2'):
+            raise
+        buffer = io.BytesIO()
+        trace.write(buffer, format='MSEED', **{**kwargs, 'encoding': 'INT32'})
+    return buffer.getvalue()
+
+
+def record_start_times(data):
+    """Return (offset, length, start time in ns) of each record in data.
+
+    Only the fixed header and blockette 1000 of each record are decoded.
+    """
+    records = []
+    offset = 0
+    while offset + 48 <= len(data):
+        year = struct.unpack_from('>H', data, offset + 20)[0]
+        order = '>' if 1900 <= year <= 2100 else '<'
+        year, doy, hour, minute, second, _, fract = struct.unpack_from(
+            order + 'HHBBBBH', data, offset + 20)
+        reclen = 4096
+        blockette = struct.unpack_from(order + 'H', data, offset + 46)[0]
+        while blockette and offset + blockette + 7 <= len(data):
+            b_type, b_next = struct.unpack_from(order + 'HH', data,
+                                                offset + blockette)
+            if b_type == 1000:
+                reclen = 2 ** data[offset + blockette + 6]
+                break
+            blockette = b_next
+        start = UTCDateTime(year=year, julday=doy, hour=hour, minute=minute,
+                            second=second, microsecond=fract * 100)
+        records.append((offset, reclen, start.ns))
+        offset += reclen
+    return records
+
+
+def _last_record_start(file, size):
+    """Return the start time (ns) of the last record of an open day file."""
+    file.seek(0)
+    first = record_start_times(file.read(512))
+    if first and size % first[0][1] == 0:
+        reclen = first[0][1]
+        file.seek(size - reclen)
+        return record_start_times(file.read(reclen))[-1][2]
+    # Mixed record lengths: scan the whole file
+    file.seek(0)
+    return record_start_times(file.read())[-1][2]
+
+
+def append_records(path, data):
+    """Append encoded records to an SDS day file under an exclusive lock.
+
+    If the new records start before the last record of the file, the whole
+    file is rewritten with all records sorted by start time.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a+b') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            size = file.seek(0, os.SEEK_END)
+            new_records = record_start_times(data)
+            if size == 0 or not new_records or \
+                    new_records[0][2] >= _last_record_start(file, size):
+                file.write(data)  # append mode: always at end of file
+                return
+            file.seek(0)
+            existing = file.read()
+            chunks = [(start, existing[offset:offset + length])
+                      for offset, length, start
+                      in record_start_times(existing)]
+            chunks += [(start, data[offset:offset + length])
+                       for offset, length, start in new_records]
+            chunks.sort(key=lambda chunk: chunk[0])  # stable sort
+            # Rewrite in place to keep the lock on the same inode
+            file.truncate(0)
+            file.write(b''.join(chunk for _, chunk in chunks))
+        finally:
+            file.flush()
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def write_trace(trace, root=SDS_ROOT, **kwargs):
+    """Write a trace in the SDS archive and return the day files touched."""
+    paths = []
+    for piece in split_by_day(trace):
+        stats = piece.stats
+        path = sds_path(root, stats.network, stats.station, stats.location,
+                        stats.channel, stats.starttime)
+        append_records(path, encode(piece, **kwargs))
+        paths.append(path)
+    return paths
@@ -0,0 +1,173 @@
+"""Index of the sample spans already archived, per stream.
+
+Stations re-send files after FTP timeouts, sometimes with more (or fewer)
+records than the first upload. Before archiving the traces of a converted
+file, the converter claims their time span in this index and only keeps
+the samples not yet covered, so that duplicated data is neither encoded
+nor written, and the SDS archive holds no overlapping records.
+
+Spans are stored in the ingestion ledger database (one row per claimed
+span, tagged with the source file and the claim of one conversion), so the
+index survives restarts and is shared by the ingestion service and the
+backfill worker processes. The spans claimed by a conversion are released
+if archiving its data fails. Spans of data left to the batch archiver are
+claimed as pending until written: pending spans left by a crash are
+released at startup, so that the re-converted files are archived again.
+"""
+
+import os
+import sqlite3
+import threading
+import uuid
+
+from ingest_ledger import LEDGER_PATH
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spans (
+    stream TEXT NOT NULL,
+    start_ns INTEGER NOT NULL,
+    end_ns INTEGER NOT NULL,  -- exclusive: last sample time + delta
+    source TEXT,
+    claim TEXT,  -- one per conversion (see SpanIndex.new_claim)
+    pending INTEGER NOT NULL DEFAULT 0  -- not archived yet
+);
+CREATE INDEX IF NOT EXISTS spans_stream_end ON spans (stream, end_ns);
+"""
+
+# Columns added after the first release (spans table created without them)
+ADDED_COLUMNS = [('claim', 'TEXT'),
+                 ('pending', 'INTEGER NOT NULL DEFAULT 0')]
+
+
+def missing_ranges(start_ns, delta_ns, npts, covered):
+    """Return the (first, last) sample index ranges not in covered spans.
+
+    A sample is covered if its time is within one of the (start, end)
+    half-open spans of covered.
+    """
+    ranges = []
+    first = 0
+    for span_start, span_end in sorted(covered):
+        # Index of the first sample at or after a time (clipped)
+        last = min(npts, max(0, -(-(span_start - start_ns) // delta_ns)))
+        if last > first:
+            ranges.append((first, last))
+        first = max(first, min(npts, -(-(span_end - start_ns) // delta_ns)))
+    if first < npts:
+        ranges.append((first, npts))
+    return ranges
+
+
+class SpanIndex:
+    """Per-stream interval index of the archived sample spans.
+
+    Thread-safe: the threads of a process share one connection, each
+    operation holds a lock (SQLite transactions are per connection).
+    """
+
+    def __init__(self, path=LEDGER_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Autocommit mode: transactions are explicit (see claim)
+        self._conn = sqlite3.connect(path, timeout=30., isolation_level=None,
+                                     check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(SCHEMA)
+            columns = {row[1] for row in
+                       self._conn.execute('PRAGMA table_info(spans)')}
+            for name, sql_type in ADDED_COLUMNS:
+                if name not in columns:
+                    self._conn.execute(
+                        f'ALTER TABLE spans ADD COLUMN {name} {sql_type}')
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS spans_claim ON spans (claim)')
+
+    def new_claim(self, pending=False):
+        """Return a SpanClaim, to claim the spans of one conversion."""
+        return SpanClaim(self, uuid.uuid4().hex, pending)
+
+    def claim(self, stream, start_ns, delta_ns, npts, source=None,
+              claim=None, pending=False):
+        """Return the sample ranges of a trace not archived yet.
+
+        The returned (first, last) index ranges are recorded as archived in
+        the same transaction, so that concurrent claims (threads or
+        processes) never return the same samples twice.
+        """
+        end_ns = start_ns + npts * delta_ns
+        conn = self._conn
+        with self._lock:
+            conn.execute('BEGIN IMMEDIATE')  # write lock for the whole check
+            try:
+                covered = conn.execute(
+                    'SELECT start_ns, end_ns FROM spans WHERE stream = ? '
+                    'AND end_ns > ? AND start_ns < ?',
+                    (stream, start_ns, end_ns)).fetchall()
+                ranges = missing_ranges(start_ns, delta_ns, npts, covered)
+                conn.executemany(
+                    'INSERT INTO spans (stream, start_ns, end_ns, source, '
+                    'claim, pending) VALUES (?, ?, ?, ?, ?, ?)',
+                    [(stream, start_ns + first * delta_ns,
+                      start_ns + last * delta_ns, source, claim, pending)
+                     for first, last in ranges])
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return ranges
+
+    def release(self, claim, stream=None, start_ns=None, end_ns=None):
+        """Forget the spans of a claim (e.g. failed archiving).
+
+        If stream is given, only the spans of that stream overlapping
+        [start_ns, end_ns) are released.
+        """
+        sql = 'DELETE FROM spans WHERE claim = ?'
+        params = (claim,)
+        if stream is not None:
+            sql += ' AND stream = ? AND end_ns > ? AND start_ns < ?'
+            params += (stream, start_ns, end_ns)
+        with self._lock:
+            self._conn.execute(sql, params)
+
+    def commit(self, claim):
+        """Mark the spans of a claim as archived (no longer pending)."""
+        with self._lock:
+            self._conn.execute(
+                'UPDATE spans SET pending = 0 WHERE claim = ?', (claim,))
+
+    def release_pending(self):
+        """Forget all pending spans (lost batches), return their count."""
+        with self._lock:
+            return self._conn.execute(
+                'DELETE FROM spans WHERE pending').rowcount
+
+    def close(self):
+        self._conn.close()
+
+
+class SpanClaim:
+    """Spans claimed by one conversion.
+
+    Has the claim() method of SpanIndex, so that it can be given to the
+    converter in its place.
+    """
+
+    def __init__(self, index, claim_id, pending=False):
+        self.index = index
+        self.claim_id = claim_id
+        self.pending = pending
+
+    def claim(self, stream, start_ns, delta_ns, npts, source=None):
+        """Return the sample ranges of a trace not archived yet."""
+        return self.index.claim(stream, start_ns, delta_ns, npts, source,
+                                self.claim_id, self.pending)
+
+    def release(self, stream=None, start_ns=None, end_ns=None):
+        """Forget the spans of this claim (see SpanIndex.release)."""
+        self.index.release(self.claim_id, stream, start_ns, end_ns)
+
+    def commit(self):
+        """Mark the spans of this claim as archived."""
+        self.index.commit(self.claim_id)
@@ -28,8 +28,11 @@ seiscomp/bin/seiscomp --asroot enable fdsnws
 
 # signal trap function inspired by https://github.com/panubo/docker-vsftpd/blob/main/entry.sh
 seiscomp_stop() {
-  echo "Received SIGINT or SIGTERM: shutting down Seiscomp, Cron, and Incron..."
+  echo "Received SIGINT or SIGTERM: shutting down myo ingestion, inventory sync, Seiscomp, Cron and Incron..."
 
+  # Python services first: their final flush still needs the seiscomp modules
+  kill -TERM $ingest_pid && wait $ingest_pid # converts already queued files before exiting
+  kill -TERM $inventory_pid && wait $inventory_pid # applies pending StationXML changes (update-config, fdsnws reload) before exiting
   seiscomp/bin/seiscomp --asroot stop fdsnws
   seiscomp/bin/seiscomp --asroot stop scmaster
   service incron stop
@@ -46,6 +49,10 @@ service incron start # Daemon to trigger myo to mseed conversion and SDS archivi
 service cron start # For data availability updates
 seiscomp/bin/seiscomp --asroot start scmaster # Run Seiscomp master as background process
 seiscomp/bin/seiscomp --asroot start fdsnws # Run Web services as background to allow reload when inventory updates
+obspy/bin/python myo_ingest.py & # Long-lived myo to mseed conversion service (watches /data/ftp)
+ingest_pid=$!
+obspy/bin/python inventory_sync.py & # Debounced StationXML to inventory sync (watches /data/xml)
+inventory_pid=$!
 #pid_incron=$(cat /var/run/incrond.pid)
 #pid_scmaster=$(cat seiscomp/var/run/scmaster.pid)
 #pid_fdsnws=$(cat seiscomp/var/run/fdsnws.pid)
@@ -70,7 +77,7 @@ pidwait --pidfile seiscomp/var/run/fdsnws.pid &
 fdsnws_waiter=$!
 
 # if any of the process finishes, call the stop sequence
-wait -n $incron_waiter $cron_waiter $scmaster_waiter $fdsnws_waiter && seiscomp_stop
+wait -n $incron_waiter $cron_waiter $scmaster_waiter $fdsnws_waiter $ingest_pid $inventory_pid && seiscomp_stop
 
 
 
@@ -15,6 +15,7 @@ from utils.XML_build import (
     build_custom_datalogger_response
 )
 from utils.dataframe import dataframe_with_selections
+from utils.metadata_cache import invalidate_station_metadata
 
 
 st.header('Create station XML')
@@ -262,6 +263,7 @@ if create:
         st.stop()
     res = create_xml(fname, net)
     st.success("StationXML file created successfully", icon="✅")
+    invalidate_station_metadata()  # for all users
     if 'stations_txt' in st.session_state:
         del st.session_state['stations_txt']  # to allow update
     if 'df_stations' in st.session_state:
@@ -13,6 +13,7 @@ import streamlit as st
 import pandas as pd
 
 from utils.dataframe import dataframe_with_selections
+from utils.metadata_cache import invalidate_station_metadata
 
 
 st.header('Station XML files')
@@ -39,6 +40,7 @@ def delete_files(rows):
     if st.button("Delete", key='delete_xml'):
         for row in rows:
             os.remove('/data/xml/' + df['File name'].iloc[row])
+        invalidate_station_metadata()  # for all users
         if 'stations_txt' in st.session_state:
             del st.session_state['stations_txt']  # For update of Home page
         if 'df_stations' in st.session_state:
@@ -8,15 +8,17 @@ Allow optional filtering and response removal. Display traces in interactive
 plot. Allow trace download in various formats.
 - Day plot: get user input for location, single channel, and day. Show
 corresponding a day plot (24h of data in one figure).
+- Record section: get user input for a channel code, a source location and a
+time window. Show the traces of all stations aligned by distance.
 Display a map of all stations on the right column.
 """
 import io
+import time
 
 import pandas as pd
 import streamlit as st
 from streamlit import session_state as sstate
 from streamlit_folium import st_folium
-from obspy.clients.fdsn import Client
 
 from utils.data_fetch import (
     fetch_stations,
@@ -24,23 +26,46 @@ from utils.data_fetch import (
     fetch_latest_data_times
 )
 from utils.station_map import create_map, get_map_column_width
-from utils.station_infos import display_channels, display_availability
+from utils.record_section import (
+    load_network_channels,
+    select_section_params,
+    section_channels,
+    fetch_section_traces,
+    plot_section
+)
+from utils.waveform_cache import get_waveform_cache
+from utils.station_infos import (
+    display_channels,
+    display_availability,
+    display_ingested_files
+)
 from utils.trace_view import (
     select_channels_and_dates,
     select_day_plot_params,
+    fetch_day_rows,
+    prefetch_adjacent_days,
+    day_navigation,
+    plot_day,
     select_filter_params,
+    select_overview_level,
+    fetch_overview,
     preprocess_traces,
     plot_traces,
+    plot_overview,
+    is_downsampled,
+    select_downsampling,
+    start_zoom,
+    zoom_controls,
+    cached_view,
+    cache_view,
+    show_zoomable_chart,
+    show_plot_debug,
     download_trace,
+    MIN_MAX_NPTS,
 )
 
 
 st.header('Stations and traces')  # st.title too big
-try:
-    client = Client("http://seiscomp:8080")
-except Exception as e:
-    st.error(f"Connection error to FDSN server: {e}", icon="🚨")
-    st.stop()
 
 # Fetch stations info and populate dataframe if not already done
 if "df_stations" not in sstate:
@@ -79,7 +104,7 @@ if "df_stations" not in sstate:
     sstate.df_stations = sstate.df_stations[cols]
 
 # use client instead?
-# inv = client.get_stations(level="station")  # combine with previous fetch ?
+# inv = get_inventory(level="station")  # combine with previous fetch ?
 # net_codes = {net.code: ind for ind, net in enumerate(inv.networks)}
 # # need to test if empty
 
@@ -98,8 +123,8 @@ with map_column:
     # with df very convoluted (could try with updating keys to refresh map
     # select and df select)
 
-station_tab, trace_tab, day_plot_tab = data_column.tabs(
-    ["Stations", "Trace", "Day plot"]
+station_tab, trace_tab, day_plot_tab, section_tab = data_column.tabs(
+    ["Stations", "Trace", "Day plot", "Record section"]
 )
 
 net, sta = None, None
@@ -137,6 +162,8 @@ with station_tab:
             display_channels(net, sta)
         with st.expander('Data availability'):
             display_availability(net, sta)
+        with st.expander('Received files (last 24h)'):
+            display_ingested_files(net, sta)
     else:
         st.info(
             "Select station by ticking box in the leftmost column.",
@@ -166,27 +193,83 @@ with trace_tab:
             "inverse spectrum and prevent noise overamplification (see obspy)."
         )
         resp_remove = st.checkbox('Remove instrument response', help=resp_msg)
+        downsampling = select_downsampling()
+        plot_debug = st.checkbox('Show plot debug info', key='plot_debug',
+                                 help="Figure payload size and timings.")
 
+        view_key = (net, sta, loc, tuple(chans), start_date, end_date,
+                    fmin, fmax, resp_remove, downsampling)
         if st.button('View Trace', disabled=False if chans else True):
-            with st.spinner('Fetching traces...'):
-                traces = fetch_traces(
-                    client, net, sta, loc, ','.join(chans),
-                    start_date, end_date
-                )
-                if traces is None:
-                    sstate.traces = None
-                    st.stop()
-            sstate.traces = preprocess_traces(traces, fmin, fmax, resp_remove)
-
-            if sstate.traces is not None:
-                with st.spinner('Loading plot...'):
-                    # Width will be auto adjusted to fit column container
-                    height = 200 + 300 * len(chans)
-                    plot_traces(sstate.traces, resp_remove, height)
-
-                download_trace(
-                    net, sta, loc, chans, start_date, end_date, fmin, fmax
+            start_zoom(view_key, start_date, end_date)
+        # Viewed until the selection changes (zooming reruns the page)
+        if sstate.get('zoom_key') == view_key:
+            window = zoom_controls()
+            height = 200 + 300 * len(chans)
+            view = cached_view(window)
+            # Long unprocessed windows: plot the precomputed min/max overview
+            level = None
+            if view is None and fmin is None and not resp_remove:
+                level = select_overview_level(loc, chans, *window)
+            if level is not None:
+                overviews = fetch_overview(net, sta, loc, chans, *window,
+                                           level)
+                if overviews is not None:
+                    build_start = time.perf_counter()
+                    fig = plot_overview(overviews, *window, height)
+                    view = cache_view(
+                        window, fig, level=level,
+                        build_s=time.perf_counter() - build_start
+                    )
+            if view is None:
+                traces = fetch_traces(net, sta, loc, ','.join(chans), *window)
+                if traces is not None:
+                    cache_stats = get_waveform_cache().stats()
+                    st.caption(
+                        f"Waveform cache: {cache_stats['hit_rate']:.0%} chunk "
+                        f"hit rate, {cache_stats['bytes_served'] / 1e6:.1f} "
+                        f"MB served, {cache_stats['bytes'] / 1e6:.1f} MB in "
+                        "use"
+                    )
+                    traces = preprocess_traces(traces, fmin, fmax,
+                                               resp_remove)
+                    build_start = time.perf_counter()
+                    with st.spinner('Loading plot...'):
+                        # Width will be auto adjusted to fit column container
+                        fig = plot_traces(traces, resp_remove, height,
+                                          downsampling)
+                    view = cache_view(
+                        window, fig, traces=traces,
+                        build_s=time.perf_counter() - build_start
+                    )
+
+            if view is not None:
+                fig, sstate.traces, level, build_s = view
+                send_s = show_zoomable_chart(fig)
+                if plot_debug:
+                    with st.expander('Plot debug info', expanded=True):
+                        show_plot_debug(fig, build_s, send_s)
+                zoom_msg = (
+                    "Box select a time range to zoom in: the range is "
+                    "fetched again, at full resolution once short enough."
                 )
+                if level is not None:
+                    st.info(
+                        f"Long window plotted from the {level} s min/max "
+                        "overview of the archive (updated every 10 mins). "
+                        f"{zoom_msg} Zoom in or apply a filter to download "
+                        "the raw data.",
+                        icon="ℹ️"
+                    )
+                elif is_downsampled(sstate.traces):
+                    st.info(
+                        f"Traces including more than {MIN_MAX_NPTS} samples "
+                        f"({int(MIN_MAX_NPTS / 6000)} mins at 100Hz) are "
+                        "downsampled to the plot width (see Downsampling). "
+                        + zoom_msg,
+                        icon="ℹ️"
+                    )
+                if sstate.traces is not None:
+                    download_trace(net, sta, loc, chans, *window, fmin, fmax)
 
 # ****** Day plot
 with day_plot_tab:
@@ -204,33 +287,44 @@ with day_plot_tab:
             fmin, fmax = select_filter_params(loc, [chan], key="day_filter")
         # TODO: add validity check vs fs
 
-        if "day_traces" not in sstate:
-            sstate.day_traces = None
+        # Day not in the key: browsing days keeps the day plot shown
+        day_key = (net, sta, loc, chan, fmin, fmax)
         disable_day_plot = True if chan is None else False
         if st.button('View day plot', disabled=disable_day_plot):
-            with st.spinner('Fetching traces...'):
-                traces = fetch_traces(
-                    client, net, sta, loc, chan, start_date, end_date
-                )
-                if traces is None:
-                    sstate.day_traces = None
-                    st.stop()
-
-            if fmin is not None and fmax is not None:
-                sstate.day_traces = preprocess_traces(traces, fmin, fmax,
-                                                      resp_remove=False)
+            sstate.day_key = day_key
+        # Viewed until the selection changes
+        if sstate.get('day_key') == day_key:
+            day_navigation(start_date)
+            rows = fetch_day_rows(net, sta, loc, chan, start_date, fmin,
+                                  fmax)
+            if rows is not None:
+                st.plotly_chart(plot_day(rows), use_container_width=True)
             else:
-                traces.detrend("linear")  # Necessary for decent visualization
-                sstate.day_traces = traces
-            if sstate.day_traces is not None:
-                with st.spinner('Loading plot...'):
-                    date_str = start_date.strftime("%A %d %B %Y")
-                    # prev_col, date_col, next_col = st.columns(3)  #TODO?
-                    # if prev_col.button('◀️'):
-                    st.markdown(
-                        f'<div style="text-align: center;">{date_str}</div>',
-                        unsafe_allow_html=True
-                    )
-                    # if next_col.button('▶️')
-                    fig = sstate.day_traces.plot(handle=True, type='dayplot')
-                    st.pyplot(fig)
+                st.warning('No data found for the requested period.',
+                           icon="⚠️")
+            # Next steps are likely the previous or next day
+            prefetch_adjacent_days(net, sta, loc, chan, start_date, fmin,
+                                   fmax)
+
+
+# ****** Record section
+with section_tab:
+    channel_df = load_network_channels()
+    if channel_df is not None:
+        chan, source, start_date, end_date, norm_method = \
+            select_section_params(channel_df)
+        coordinates = section_channels(channel_df, chan)
+        st.info(f"{len(coordinates)} stations record {chan}. A linear "
+                "detrend is applied to all traces.", icon="ℹ️")
+        section_key = (chan, source, start_date, end_date)
+        if st.button('View record section', disabled=not coordinates):
+            sstate.section_key = section_key
+            sstate.section_traces = fetch_section_traces(
+                coordinates, start_date, end_date)
+        # Viewed until the selection changes (normalization excepted)
+        if sstate.get('section_key') == section_key and \
+                sstate.section_traces is not None:
+            with st.spinner('Loading plot...'):
+                fig = plot_section(sstate.section_traces, source, start_date,
+                                   end_date, norm_method)
+            st.plotly_chart(fig, use_container_width=True)
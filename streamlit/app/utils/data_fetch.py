@@ -1,38 +1,62 @@
 """Data and metadata fetching module for the local Seiscomp (FDSNWS) server.
 
 Fetch stations, channels, traces, and data availability from
-the local Seiscomp (FDSNWS) server through HTTP requests (Docker network).
+the local Seiscomp (FDSNWS) server through HTTP requests (Docker network),
+all sent with the shared pooled session of utils.fdsn_client. Metadata
+responses and waveforms are cached for all sessions (see
+utils.metadata_cache and utils.waveform_cache).
+Also query the ingestion ledger (SQLite database shared with the seiscomp
+container) for the status of the files uploaded by the stations.
 """
 
 import requests
 import io
 import datetime
+import sqlite3
+import time
 
-from obspy.core import UTCDateTime
-from obspy.clients.fdsn.header import FDSNNoDataException
 import streamlit as st
 import pandas as pd
 
-BASE_URL = 'http://seiscomp:8080/fdsnws'
+from utils.fdsn_client import fdsn_get
+from utils.metadata_cache import get_metadata_cache, METADATA_TTL
+from utils.waveform_cache import get_waveform_cache
 
+LEDGER_PATH = '/data/ledger/ingest.db'
 
-# @st.cache_data  # use obspy client instead?
-def fetch_stations():
-    """Fetch all stations from the Seiscomp FDSNWS server."""
-    suffix = '/station/1/query?network=*&format=text&level=station'
+
+def fetch_cached_text(suffix, endpoint):
+    """GET a text response through the shared metadata cache.
+
+    Return (text, None) on success, or (None, reason) if the server did not
+    return data (failures are not cached).
+    """
+    cache = get_metadata_cache()
+    text = cache.get(suffix)
+    if text is not None:
+        return text, None
     try:
-        data = requests.get(BASE_URL + suffix)
+        data = fdsn_get(suffix)
     except requests.exceptions.RequestException as e:
         st.error(f"Request error: {e}", icon="🚨")
         st.stop()
     if data.status_code != 200:
-        st.warning(data.reason, icon="⚠️")
-        return None
+        return None, data.reason
     text = data.content.decode('utf-8')
+    cache.set(suffix, text, METADATA_TTL[endpoint])
+    return text, None
+
+
+def fetch_stations():
+    """Fetch all stations from the Seiscomp FDSNWS server."""
+    suffix = '/station/1/query?network=*&format=text&level=station'
+    text, reason = fetch_cached_text(suffix, 'station')
+    if text is None:
+        st.warning(reason, icon="⚠️")
+        return None
     return text
 
 
-# @st.cache_data
 def fetch_channels(net, sta):
     """Fetch all channels for a given station."""
     suffix = f'/station/1/query?' \
@@ -40,34 +64,33 @@ def fetch_channels(net, sta):
              f'&station={sta}' \
              f'&format=text' \
              f'&level=channel'
-    try:
-        data = requests.get(BASE_URL + suffix)
-    except requests.exceptions.RequestException as e:
-        st.error(f"Request error: {e}", icon="🚨")
-        st.stop()
-    if data.status_code != 200:
-        st.warning(data.reason, icon="⚠️")
+    text, reason = fetch_cached_text(suffix, 'station')
+    if text is None:
+        st.warning(reason, icon="⚠️")
+        return None
+    return text
+
+
+def fetch_network_channels():
+    """Fetch the channels of all stations (one request)."""
+    suffix = '/station/1/query?network=*&format=text&level=channel'
+    text, reason = fetch_cached_text(suffix, 'station')
+    if text is None:
+        st.warning(reason, icon="⚠️")
         return None
-    text = data.content.decode('utf-8')
     return text
 
 
-# @st.cache_data
 def fetch_availability(net, sta):
     """Fetch data availability for a given station."""
     suffix = f'/availability/1/query?' \
              f'&network={net}' \
              f'&station={sta}' \
              f'&merge=overlap,samplerate,quality'
-    try:
-        data = requests.get(BASE_URL + suffix)
-    except requests.exceptions.RequestException as e:
-        st.error(f"Request error: {e}", icon="🚨")
-        st.stop()
-    if data.status_code != 200:
-        st.write(data.reason)
+    text, reason = fetch_cached_text(suffix, 'availability')
+    if text is None:
+        st.write(reason)
         return None
-    text = data.content.decode('utf-8')
     return text
 
 
@@ -82,15 +105,10 @@ def fetch_latest_data_times():
     """
     suffix = '/availability/1/extent?' \
              'network=*&station=*&merge=samplerate,quality'
-    try:
-        data = requests.get(BASE_URL + suffix)
-    except requests.exceptions.RequestException as e:
-        st.error(f"Request error: {e}", icon="🚨")
-        st.stop()
-    if data.status_code != 200:
-        st.write(data.reason)
+    text, reason = fetch_cached_text(suffix, 'extent')
+    if text is None:
+        st.write(reason)
         return None
-    text = data.content.decode('utf-8')
     if text is None:
         st.info("Data availability not available", icon="ℹ️")
         return None
@@ -119,22 +137,68 @@ def fetch_latest_data_times():
 
 
 # @st.cache_data(show_spinner=False)
-def fetch_traces(client, net, sta, loc, chans, start_date, end_date):
-    """Fetch traces for a given station, location, channels, and time frame."""
+def fetch_traces(net, sta, loc, chans, start_date, end_date):
+    """Fetch traces for a given station, location, channels, and time frame.
+
+    Data not cached yet is fetched by concurrent (channel x day)
+    sub-requests, with a progress bar.
+    """
+    progress_bar = st.empty()
+
+    def show_progress(done, total):
+        progress_bar.progress(
+            done / total, text=f'Fetching traces... ({done}/{total} requests)'
+        )
+
     try:
-        waveform_stream = client.get_waveforms(
+        waveform_stream = get_waveform_cache().get_waveforms(
             net,
             sta,
             loc,
             chans,
-            UTCDateTime(start_date),
-            UTCDateTime(end_date),
-            attach_response=True
+            start_date,
+            end_date,
+            attach_response=True,
+            progress=show_progress
         )
-    except FDSNNoDataException:
-        st.warning('No data found for the requested period.', icon="⚠️")
-        return None
     except requests.exceptions.RequestException as e:
         st.error(f"Request error: {e}", icon="🚨")
         st.stop()
+    finally:
+        progress_bar.empty()
+    if waveform_stream is None:
+        st.warning('No data found for the requested period.', icon="⚠️")
     return waveform_stream
+
+
+def fetch_ingested_files(net, sta, hours=24):
+    """Fetch the myo files of a station received in the last hours.
+
+    Return a dataframe (most recent first) or None if the ingestion ledger
+    is not available yet.
+    """
+    query = (
+        "SELECT path, received_at, status, samples, duplicate_samples, "
+        "start_ns, end_ns, wait_s, convert_s, archive_s, error FROM files "
+        "WHERE station = ? AND (network = ? OR network IS NULL) "
+        "AND received_at >= ? "
+        "ORDER BY received_at DESC"
+    )
+    try:
+        with sqlite3.connect(f'file:{LEDGER_PATH}?mode=ro', uri=True) as conn:
+            df = pd.read_sql_query(query, conn, params=(
+                sta, net, time.time() - hours * 3600))
+    except (sqlite3.Error, pd.errors.DatabaseError):
+        return None
+    df['received_at'] = pd.to_datetime(df['received_at'], unit='s', utc=True)
+    df['start_ns'] = pd.to_datetime(df['start_ns'], unit='ns', utc=True)
+    df['end_ns'] = pd.to_datetime(df['end_ns'], unit='ns', utc=True)
+    df['path'] = df['path'].str.rsplit('/', n=1).str[-1]
+    df.rename(columns={
+        'path': 'File', 'received_at': 'Received', 'status': 'Status',
+        'samples': 'Samples', 'duplicate_samples': 'Duplicate samples',
+        'start_ns': 'Data start', 'end_ns': 'Data end',
+        'wait_s': 'Queue (s)', 'convert_s': 'Conversion (s)',
+        'archive_s': 'Archiving (s)', 'error': 'Error'
+    }, inplace=True)
+    return df
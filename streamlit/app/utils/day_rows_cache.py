@@ -0,0 +1,166 @@
+"""Process-wide cache of reduced day plots, with background prefetch.
+
+A day plot is reduced to min/max rows (obspy_plot_mod.day_rows) of a few
+MB, whatever the sampling rate of the channel. Reduced days are kept in a
+small cache shared by all sessions, so that a day viewed again is shown
+at once, and the days around the one viewed are computed ahead by a
+background thread pool, so that stepping through days (helicorder
+browsing) does not wait for a fetch either.
+
+Prefetched days are read straight from the archive (fetch function of
+the waveform cache), without storing their raw samples in the waveform
+cache: a day of a 1 kHz channel (350 MB of samples) would evict most of
+it. Days that may still receive data (recent, empty or with gaps) are
+computed again after RECENT_TTL.
+"""
+
+import collections
+import datetime
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+from obspy import UTCDateTime
+
+from utils.obspy_plot_mod import day_rows
+from utils.overview import PLOT_WIDTH
+from utils.waveform_cache import (
+    get_waveform_cache,
+    is_complete,
+    COMPLETE_AFTER,
+    RECENT_TTL
+)
+
+DAY_INTERVAL = 15  # mins, one day plot row per interval
+MAX_ENTRIES = 16  # reduced days kept (about 3 MB each)
+PREFETCH_WORKERS = 2
+
+
+def reduce_day(traces, day, fmin=None, fmax=None):
+    """Detrend (or filter) the traces of a day, return its day plot rows.
+
+    Traces are processed in place. The rows tell if the day is complete
+    (no gaps).
+    """
+    starttime = UTCDateTime(day)
+    complete = is_complete(traces, starttime, starttime + 86400 - 1e-6)
+    if fmin is not None and fmax is not None:
+        traces.detrend("linear")
+        traces.taper(max_percentage=0.05)
+        traces.filter("bandpass", freqmin=fmin, freqmax=fmax)
+    else:
+        traces.detrend("linear")  # Necessary for decent visualization
+    rows = day_rows(traces, starttime, starttime + 86400, 60 * DAY_INTERVAL,
+                    PLOT_WIDTH)
+    rows['complete'] = complete
+    return rows
+
+
+def read_day_rows(net, sta, loc, chan, day, fmin, fmax):
+    """Read a day from the archive and reduce it (None if no data).
+
+    The samples are not stored in the waveform cache (see module doc).
+    """
+    starttime = UTCDateTime(day)
+    traces = get_waveform_cache().fetch(net, sta, loc, chan, starttime,
+                                        starttime + 86400)
+    if not traces:
+        return None
+    traces.merge(method=-1)  # join the records of continuous data
+    return reduce_day(traces, day, fmin, fmax)
+
+
+class DayRowsCache:
+    """Thread-safe LRU cache of reduced days, with background prefetch.
+
+    Keys are (net, sta, loc, chan, day, fmin, fmax), compute(*key)
+    returns the rows of a day or None (no data, cached too).
+    """
+
+    def __init__(self, compute=read_day_rows, max_entries=MAX_ENTRIES,
+                 workers=PREFETCH_WORKERS):
+        self.compute = compute
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()  # key -> (rows, expiry)
+        self._pending = {}  # key -> Future of a prefetch
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='day_prefetch')
+
+    def get(self, key, compute=None):
+        """Return the rows of a day, computed by compute() if not cached.
+
+        A prefetch in progress for the day is waited for. compute defaults
+        to self.compute(*key).
+        """
+        with self._lock:
+            entry = self._entry(key)
+            future = self._pending.get(key)
+        if entry is not None:
+            return entry[0]
+        if future is not None:
+            try:
+                return future.result()
+            except Exception:  # failed in background, retry below
+                pass
+        rows = compute() if compute is not None else self.compute(*key)
+        self._store(key, rows)
+        return rows
+
+    def prefetch(self, key):
+        """Compute the rows of a day in background, if not cached yet."""
+        with self._lock:
+            if key in self._pending or self._entry(key) is not None:
+                return
+            self._pending[key] = self._executor.submit(self._prefetch, key)
+
+    def _prefetch(self, key):
+        try:
+            rows = self.compute(*key)
+            self._store(key, rows)
+            return rows
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _entry(self, key):
+        """Return the valid entry of a key (lock held), or None."""
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] < time.monotonic():
+            del self._entries[key]
+            entry = None
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, rows):
+        day_end = UTCDateTime(key[4]) + 86400
+        expiry = math.inf
+        if time.time() - day_end.timestamp < COMPLETE_AFTER or \
+                rows is None or not rows.get('complete'):
+            expiry = time.monotonic() + RECENT_TTL
+        with self._lock:
+            self._entries[key] = (rows, expiry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def adjacent_days(day, days=1):
+    """Return the days around a day to prefetch (none in the future)."""
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    adjacent = []
+    for offset in range(1, days + 1):
+        for sign in (-1, 1):
+            other = day + datetime.timedelta(days=sign * offset)
+            if other <= today:
+                adjacent.append(other)
+    return adjacent
+
+
+@st.cache_resource(show_spinner=False)
+def get_day_rows_cache():
+    """Return the reduced day cache shared by all sessions."""
+    return DayRowsCache()
@@ -0,0 +1,250 @@
+"""Vectorized decimation of waveform segments for plotting.
+
+Segments (start time, sampling rate, samples) are reduced to the minimum
+and maximum of each pixel of one time grid shared by all segments, with
+one numpy reduceat call per segment over pixel boundaries computed in
+sample index space (no per-sample index array, no copy of the samples).
+Times are int64 nanoseconds since epoch, so that sub-second start times
+are kept exactly.
+
+Pixels without samples are dropped, and a NaN row is inserted where the
+data has a gap (a pixel not covered by any segment), so that Plotly
+breaks the line there. Pixels without samples inside a segment (more
+pixels than samples) are simply dropped: the line stays continuous.
+
+Besides min/max (an envelope), two downsampling methods keep actual
+samples, so that the waveform shape is kept and hover shows true values:
+M4 (first, last, min and max sample of each pixel) and LTTB (largest
+triangle three buckets, a few points per pixel).
+"""
+
+import numpy as np
+
+NS = 1_000_000_000
+CHUNK_SAMPLES = 2 ** 22  # bound of the temporary arrays of m4
+LTTB_POINTS_PER_PIXEL = 2
+
+
+def segments_from_stream(stream):
+    """Return the (start ns, sampling rate, samples) segments of traces.
+
+    Masked traces (merged with gaps) are split at the masked samples.
+    """
+    segments = []
+    for trace in stream:
+        for piece in trace.split() if np.ma.isMaskedArray(trace.data) \
+                else [trace]:
+            if piece.stats.npts:
+                segments.append((piece.stats.starttime.ns,
+                                 piece.stats.sampling_rate, piece.data))
+    return segments
+
+
+def pixel_grid(starttime_ns, endtime_ns, n_pixels):
+    """Return the pixel width (ns, integer) and the number of pixels."""
+    width = max(1, -(-(endtime_ns - starttime_ns) // n_pixels))
+    return width, -(-(endtime_ns - starttime_ns) // width)
+
+
+def _pixel_runs(start_ns, sampling_rate, data, starttime_ns, width,
+                n_pixels):
+    """Return the samples of a segment in the pixel grid, by pixel.
+
+    Return (first pixel, last pixel, pixels with samples, start index of
+    their samples), or None if the segment has no sample in the grid.
+    """
+    delta_ns = NS / sampling_rate
+    offset = starttime_ns - start_ns  # window start in segment time
+    first = max(0, -offset // width)
+    last = min(n_pixels - 1,
+               int((-offset + (len(data) - 1) * delta_ns) // width))
+    if last < first:
+        return None  # segment outside of the window
+    # First sample of each pixel, and end of the last one (rounded
+    # before ceil: a sample on a pixel boundary starts that pixel)
+    bounds = np.ceil(np.round(
+        (offset + np.arange(first, last + 2, dtype=np.int64) * width)
+        / delta_ns, 6))
+    bounds = np.clip(bounds, 0, len(data)).astype(np.int64)
+    starts, stops = bounds[:-1], bounds[1:]
+    filled = np.flatnonzero(starts < stops)
+    if not len(filled):
+        return None
+    return first, last, first + filled, \
+        np.append(starts[filled], stops[filled[-1]])
+
+
+def minmax(segments, starttime_ns, endtime_ns, n_pixels):
+    """Reduce segments to the min/max of each pixel of a window.
+
+    Return (times, mins, maxs): pixel start times (int64 ns) and float64
+    extremes of the pixels with samples, with NaN rows at the gaps.
+    The grid starts at starttime_ns and covers endtime_ns (its last pixel
+    may end after it), samples outside of the grid are ignored.
+    """
+    width, n_pixels = pixel_grid(starttime_ns, endtime_ns, n_pixels)
+    mins = np.full(n_pixels, np.nan)
+    maxs = np.full(n_pixels, np.nan)
+    # Coverage: +1 at the first pixel of a segment, -1 after the last one
+    coverage = np.zeros(n_pixels + 1, dtype=np.int64)
+    for start_ns, sampling_rate, data in segments:
+        runs = _pixel_runs(start_ns, sampling_rate, data, starttime_ns,
+                           width, n_pixels)
+        if runs is None:
+            continue
+        first, last, pixels, bounds = runs
+        samples = data[bounds[0]:bounds[-1]]
+        offsets = bounds[:-1] - bounds[0]
+        mins[pixels] = np.fmin(mins[pixels],
+                               np.minimum.reduceat(samples, offsets))
+        maxs[pixels] = np.fmax(maxs[pixels],
+                               np.maximum.reduceat(samples, offsets))
+        coverage[first] += 1
+        coverage[last + 1] -= 1
+    pixels = np.flatnonzero(~np.isnan(mins))
+    times = starttime_ns + pixels * width
+    mins, maxs = mins[pixels], maxs[pixels]
+    if len(pixels) < 2:
+        return times, mins, maxs
+    # Gap between two pixels with samples: an uncovered pixel in between
+    uncovered = np.cumsum(np.cumsum(coverage[:-1]) == 0)
+    gaps = np.flatnonzero(uncovered[pixels[1:] - 1]
+                          - uncovered[pixels[:-1]] > 0)
+    return (np.insert(times, gaps + 1, times[gaps] + width),
+            np.insert(mins, gaps + 1, np.nan),
+            np.insert(maxs, gaps + 1, np.nan))
+
+
+def _first_equal(samples, bounds, values):
+    """Return the index of the first sample equal to values[k] in each
+    run k of samples (bounds[k] to bounds[k + 1]), by chunks of runs."""
+    indexes = np.empty(len(values), dtype=np.int64)
+    start = 0
+    while start < len(values):
+        # At least one run, at most about CHUNK_SAMPLES samples
+        stop = max(start + 1, int(np.searchsorted(
+            bounds, bounds[start] + CHUNK_SAMPLES, 'right')) - 1)
+        stop = min(stop, len(values))
+        part = samples[bounds[start]:bounds[stop]]
+        expected = np.repeat(values[start:stop],
+                             np.diff(bounds[start:stop + 1]))
+        equal = np.flatnonzero(part == expected) + bounds[start]
+        indexes[start:stop] = equal[
+            np.searchsorted(equal, bounds[start:stop])]
+        start = stop
+    return indexes
+
+
+def _join(parts, width):
+    """Join the (first pixel, last pixel, times, values) of segments in
+    time order, with a NaN point where no segment covers a pixel."""
+    times, values = [], []
+    covered = None  # last pixel covered so far
+    for first, last, part_times, part_values in sorted(
+            parts, key=lambda part: part[2][0]):
+        if covered is not None and first > covered + 1:
+            times.append(part_times[:1] - width)
+            values.append(np.array([np.nan]))
+        times.append(part_times)
+        values.append(part_values)
+        covered = last if covered is None else max(covered, last)
+    if not times:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    return np.concatenate(times), np.concatenate(values).astype(np.float64)
+
+
+def m4(segments, starttime_ns, endtime_ns, n_pixels):
+    """Reduce segments with M4: the first, last, min and max sample of
+    each pixel, in time order (exact rendering of a line plot).
+
+    Return (times, values): sample times (int64 ns) and values, with NaN
+    points at the gaps (see minmax).
+    """
+    width, n_pixels = pixel_grid(starttime_ns, endtime_ns, n_pixels)
+    parts = []
+    for start_ns, sampling_rate, data in segments:
+        runs = _pixel_runs(start_ns, sampling_rate, data, starttime_ns,
+                           width, n_pixels)
+        if runs is None:
+            continue
+        first, last, _, bounds = runs
+        samples = data[bounds[0]:bounds[-1]]
+        offsets = bounds - bounds[0]
+        mins = np.minimum.reduceat(samples, offsets[:-1])
+        maxs = np.maximum.reduceat(samples, offsets[:-1])
+        # Per pixel: first, min, max and last samples, sorted, no repeats
+        indexes = np.sort(np.column_stack((
+            offsets[:-1], _first_equal(samples, offsets, mins),
+            _first_equal(samples, offsets, maxs), offsets[1:] - 1
+        )), axis=1).ravel()
+        indexes = indexes[np.append(True, np.diff(indexes) > 0)]
+        times = start_ns + np.round(
+            (indexes + bounds[0]) * (NS / sampling_rate)).astype(np.int64)
+        parts.append((first, last, times, samples[indexes]))
+    return _join(parts, width)
+
+
+def lttb_indexes(values, n_out):
+    """Return the indexes of the samples kept by Largest-Triangle-Three-
+    Buckets (Steinarsson, 2013) to downsample values to n_out points.
+
+    Samples are assumed evenly spaced. Buckets are processed in sequence
+    (each selection depends on the previous one), with the triangle areas
+    of a bucket computed at once.
+    """
+    n = len(values)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    # n_out - 2 buckets between the first and last samples, kept as is
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    means = np.add.reduceat(values[:n - 1], edges[:-1],
+                            dtype=np.float64) / np.diff(edges)
+    centers = (edges[:-1] + edges[1:] - 1) / 2.
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for k in range(n_out - 2):
+        start, stop = edges[k], edges[k + 1]
+        if k + 1 < n_out - 2:  # mean point of the next bucket
+            c_x, c_y = centers[k + 1], means[k + 1]
+        else:
+            c_x, c_y = n - 1, values[n - 1]
+        a_y = float(values[a])
+        # Twice the area of the triangles (a, b, c) for b in the bucket
+        area = np.abs((a - c_x) * (values[start:stop] - a_y)
+                      - (a - np.arange(start, stop)) * (c_y - a_y))
+        a = start + int(np.argmax(area))
+        selected[k + 1] = a
+    return selected
+
+
+def lttb(segments, starttime_ns, endtime_ns, n_pixels,
+         points_per_pixel=LTTB_POINTS_PER_PIXEL):
+    """Downsample segments with LTTB to about points_per_pixel points per
+    pixel of a window (shared between segments by time span).
+
+    Return (times, values) as m4.
+    """
+    width, n_pixels = pixel_grid(starttime_ns, endtime_ns, n_pixels)
+    parts = []
+    for start_ns, sampling_rate, data in segments:
+        runs = _pixel_runs(start_ns, sampling_rate, data, starttime_ns,
+                           width, n_pixels)
+        if runs is None:
+            continue
+        first, last, _, bounds = runs
+        samples = data[bounds[0]:bounds[-1]]
+        indexes = lttb_indexes(
+            samples, int(points_per_pixel * (last - first + 1)))
+        times = start_ns + np.round(
+            (indexes + bounds[0]) * (NS / sampling_rate)).astype(np.int64)
+        parts.append((first, last, times, samples[indexes]))
+    return _join(parts, width)
+
+
+def minmax_line(times, mins, maxs):
+    """Return the x (int64 ns) and y arrays of a min/max line plot.
+
+    Each pixel is drawn as a vertical segment from its min to its max.
+    """
+    return np.repeat(times, 2), np.column_stack((mins, maxs)).ravel()
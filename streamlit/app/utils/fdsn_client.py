@@ -0,0 +1,97 @@
+"""Shared HTTP client for the local Seiscomp FDSN web services.
+
+A single requests Session is created per Streamlit server process (cached
+resource), so that connections to seiscomp:8080 are pooled and kept alive
+across script reruns and user sessions instead of being opened for every
+request. Requests have connect/read timeouts, are retried with exponential
+backoff on connection errors and server errors (e.g. fdsnws restarting
+during an inventory reload), and ask for gzip compressed responses.
+
+Waveforms are fetched from fdsnws-dataselect and decoded with ObsPy, the
+instrument responses (if needed) from fdsnws-station at response level.
+"""
+
+import io
+
+import requests
+import streamlit as st
+from obspy import read, read_inventory, UTCDateTime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BASE_URL = 'http://seiscomp:8080/fdsnws'
+TIMEOUT = (3.05, 120.)  # connect, read (s)
+RETRIES = 3
+BACKOFF = 0.5  # s, doubled at each retry
+GZIP = True
+POOL_SIZE = 16  # concurrent connections kept alive
+
+
+@st.cache_resource(show_spinner=False)
+def get_session():
+    """Return the process-wide pooled session to the FDSN server."""
+    session = requests.Session()
+    retry = Retry(total=RETRIES, backoff_factor=BACKOFF,
+                  status_forcelist=(500, 502, 503, 504),
+                  allowed_methods=('GET',), raise_on_status=False)
+    adapter = HTTPAdapter(pool_maxsize=POOL_SIZE, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Accept-Encoding'] = 'gzip' if GZIP else 'identity'
+    return session
+
+
+def fdsn_get(suffix):
+    """GET BASE_URL + suffix with the shared session, return the response."""
+    return get_session().get(BASE_URL + suffix, timeout=TIMEOUT)
+
+
+def _nslc_suffix(net, sta, loc, cha, starttime=None, endtime=None):
+    suffix = f'network={net}' \
+             f'&station={sta}' \
+             f'&location={loc or "--"}' \
+             f'&channel={cha}'
+    if starttime is not None:
+        suffix += f'&starttime={UTCDateTime(starttime).isoformat()}'
+    if endtime is not None:
+        suffix += f'&endtime={UTCDateTime(endtime).isoformat()}'
+    return suffix
+
+
+def get_inventory(net, sta, loc, cha, starttime=None, endtime=None,
+                  level='response'):
+    """Fetch the StationXML inventory of channels (None if no match).
+
+    All the channel epochs are returned if no time window is given.
+    """
+    response = fdsn_get(
+        '/station/1/query?'
+        + _nslc_suffix(net, sta, loc, cha, starttime, endtime)
+        + f'&level={level}'
+    )
+    if response.status_code in (204, 404):
+        return None
+    response.raise_for_status()
+    return read_inventory(io.BytesIO(response.content), format='STATIONXML')
+
+
+def get_waveforms(net, sta, loc, cha, starttime, endtime,
+                  attach_response=False):
+    """Fetch waveforms as an ObsPy Stream (None if no data).
+
+    Raise requests.exceptions.RequestException on connection or HTTP
+    errors (after retries).
+    """
+    response = fdsn_get(
+        '/dataselect/1/query?'
+        + _nslc_suffix(net, sta, loc, cha, starttime, endtime)
+    )
+    if response.status_code in (204, 404) or not response.content:
+        return None
+    response.raise_for_status()
+    stream = read(io.BytesIO(response.content), format='MSEED')
+    if attach_response:
+        inventory = get_inventory(net, sta, loc, cha, starttime, endtime)
+        if inventory is not None:
+            stream.attach_response(inventory)
+    return stream
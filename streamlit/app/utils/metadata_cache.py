@@ -0,0 +1,107 @@
+"""Process-wide cache of the FDSNWS metadata responses.
+
+Station, channel and availability queries are cached by query, with a
+time to live depending on the endpoint, and evicted in least recently used
+order above a memory budget. One cache is shared by all the sessions of
+the Streamlit server (cached resource), so that UI users do not each
+re-fetch the same metadata at every widget interaction.
+
+Station and channel entries are invalidated explicitly when a StationXML
+file is written or deleted. The inventory is only updated by the seiscomp
+container after a short debounce window (see inventory_sync.py), so
+entries fetched during a grace period after an invalidation get a short
+time to live instead of caching the outdated inventory for an hour.
+"""
+
+import collections
+import threading
+import time
+
+import streamlit as st
+
+from utils.waveform_cache import get_waveform_cache
+
+# Time to live (s) of the cached responses, by endpoint. Availability is
+# updated hourly by the scardac cron job, the extent (latest data time,
+# used for the station status lights) needs to be more current.
+METADATA_TTL = {
+    'station': 3600.,
+    'availability': 600.,
+    'extent': 120.,
+}
+MAX_BYTES = 32 * 1024 ** 2
+INVALIDATION_GRACE = 120.  # s, see module docstring
+GRACE_TTL = 10.  # s
+
+
+class MetadataCache:
+    """Thread-safe TTL + LRU cache of text responses, bounded in bytes."""
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()  # key -> (text, expiry)
+        self._grace_until = {}  # key prefix -> end of grace period
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached text of a key, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, text, ttl):
+        """Cache a text for ttl seconds, evicting the oldest entries."""
+        now = time.monotonic()
+        with self._lock:
+            if any(key.startswith(prefix) and now < end
+                   for prefix, end in self._grace_until.items()):
+                ttl = min(ttl, GRACE_TTL)
+            if key in self._entries:
+                self._remove(key)
+            if len(text) > self.max_bytes:
+                return
+            self._entries[key] = (text, now + ttl)
+            self.size += len(text)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, prefix='', grace=INVALIDATION_GRACE):
+        """Drop the entries whose key starts with prefix (all by default).
+
+        Entries cached within grace seconds get a short time to live.
+        """
+        with self._lock:
+            for key in [key for key in self._entries
+                        if key.startswith(prefix)]:
+                self._remove(key)
+            if grace:
+                self._grace_until[prefix] = time.monotonic() + grace
+
+    def _remove(self, key):
+        text, _ = self._entries.pop(key)
+        self.size -= len(text)
+
+
+@st.cache_resource(show_spinner=False)
+def get_metadata_cache():
+    """Return the metadata cache shared by all sessions."""
+    return MetadataCache()
+
+
+def invalidate_station_metadata():
+    """Invalidate the station, channel and instrument response metadata.
+
+    To be called when a StationXML file is written or deleted.
+    """
+    get_metadata_cache().invalidate('/station/')
+    get_waveform_cache().invalidate_responses()
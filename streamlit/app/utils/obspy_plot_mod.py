@@ -26,17 +26,24 @@ from copy import copy
 import numpy as np
 import plotly.graph_objects as go
 from obspy import Stream, Trace
-from obspy.geodetics import kilometer2degrees
+from obspy.geodetics import (
+    gps2dist_azimuth,
+    kilometer2degrees,
+    locations2degrees
+)
 from obspy.imaging.util import _id_key
 from matplotlib.dates import date2num
 from plotly.subplots import make_subplots
 
+from utils import decimate
+
 MINMAX_ZOOMLEVEL_WARNING_TEXT = "Warning: Zooming into MinMax Plot!"
 SECONDS_PER_DAY = 3600.0 * 24.0
 DATELOCATOR_WARNING_MSG = (
     "AutoDateLocator was unable to pick an appropriate interval for this date "
     "range. It may be necessary to add an interval value to the "
     "AutoDateLocator's intervald dictionary.")
+DAYPLOT_COLORS = ('#B2000F', '#004C12', '#847200', '#0E01FF')
 
 
 class ModifiedWaveformPlotting(object):
@@ -70,7 +77,6 @@ class ModifiedWaveformPlotting(object):
         if len(self.stream) < 1:
             msg = "Empty stream object"
             raise IndexError(msg)
-        self.stream = self.stream.copy()
         # Type of the plot.
         self.type = kwargs.get('type', 'normal')
         # Start and end times of the plots.
@@ -83,7 +89,13 @@ class ModifiedWaveformPlotting(object):
                                   self.stream])
         if not self.endtime:
             self.endtime = max([trace.stats.endtime for trace in self.stream])
-        self.stream.trim(self.starttime, self.endtime)
+        # Trim by slicing (new headers, data views) instead of copying
+        # all the samples, and make sure plotting never writes to them
+        self.stream = self.stream.slice(self.starttime, self.endtime)
+        for trace in self.stream:
+            trace.data = trace.data.view()
+            trace.data.flags.writeable = False
+        self._y_buffer = np.empty(0, dtype=np.float32)
         # Assigning values for type 'section'
         self.sect_offset_min = kwargs.get('offset_min', None)
         self.sect_offset_max = kwargs.get('offset_max', None)
@@ -112,6 +124,9 @@ class ModifiedWaveformPlotting(object):
         # "fast" method will be used above some threshold of data points to
         # plot.
         self.plotting_method = kwargs.get('method', None)
+        # Method used above the threshold if not set: 'fast' (min/max),
+        # or 'm4' or 'lttb' (downsampled samples, see utils.decimate)
+        self.downsampling = kwargs.get('downsampling', 'fast')
         # Below that value the data points will be plotted normally. Above it
         # the data will be plotted using a different approach (details see
         # below). Can be overwritten by the above self.plotting_method kwarg.
@@ -158,8 +173,7 @@ class ModifiedWaveformPlotting(object):
         self.dpi = kwargs.get('dpi', 100)
         # Color of the graph.
         if self.type == 'dayplot':
-            self.color = kwargs.get('color', ('#B2000F', '#004C12', '#847200',
-                                              '#0E01FF'))
+            self.color = kwargs.get('color', DAYPLOT_COLORS)
             if isinstance(self.color, str):
                 self.color = (self.color,)
             self.number_of_ticks = kwargs.get('number_of_ticks', None)
@@ -272,11 +286,11 @@ class ModifiedWaveformPlotting(object):
             self.fig = self.fig_obj
         # Determine kind of plot and do the actual plotting.
         if self.type == 'dayplot':
-            return  # not yet implemented with plotly
-            # self.plot_day(*args, **kwargs)
+            self.plot_day(*args, **kwargs)
+            return self.fig  # axes set up by plot_day_rows
         elif self.type == 'section':
-            return  # not yet implemented with plotly
-            # self.plot_section(*args, **kwargs)
+            self.plot_section(*args, **kwargs)
+            return self.fig  # axes set up by plot_section
         else:
             self.plot(*args, **kwargs)
         # Adjust the subplot so there is always a fixed margin on every side
@@ -367,7 +381,7 @@ class ModifiedWaveformPlotting(object):
             if method_ is None:
                 if ((self.endtime - self.starttime) * sampling_rate >
                         self.max_npts):
-                    method_ = "fast"
+                    method_ = self.downsampling
                 else:
                     method_ = "full"
             method_ = method_.lower()
@@ -375,6 +389,8 @@ class ModifiedWaveformPlotting(object):
                 self.__plot_straight(stream_new[_i], ax, *args, **kwargs)
             elif method_ == 'fast':
                 self.__plot_min_max(stream_new[_i], ax, *args, **kwargs)
+            elif method_ in ('m4', 'lttb'):
+                self.__plot_downsampled(stream_new[_i], ax, method_)
             else:
                 msg = "Invalid plot method: '%s'" % method_
                 raise ValueError(msg)
@@ -396,6 +412,142 @@ class ModifiedWaveformPlotting(object):
         # ax.set_xlim(xmin, xmax)
         # self._draw_overlap_axvspan_legend()
 
+    def plot_day(self, *args, **kwargs):
+        """
+        Plots the stream as a day plot with Plotly: one row per
+        self.interval, reduced to min/max per pixel (see day_rows).
+        """
+        plot_day_rows(self.fig, day_rows(self.stream, self.starttime,
+                                         self.endtime, self.interval,
+                                         self.width),
+                      self.color, self.vertical_scaling_range)
+
+    def plot_section(self, *args, **kwargs):
+        """
+        Plots a record section with Plotly, one Scattergl trace per
+        seismogram, normalized (self.sect_norm_method) and drawn at its
+        offset (see __sect_offset). Seismograms of more than self.max_npts
+        samples are reduced to self.max_npts // 2 min/max pixels, so that
+        the payload stays bounded with hundreds of stations.
+        """
+        reftime = self.sect_reftime or self.starttime
+        lines = []
+        for trace in self.stream:
+            offset = self.__sect_offset(trace)
+            if self.sect_offset_min is not None and \
+                    offset < self.__sect_user_offset(self.sect_offset_min):
+                continue
+            if self.sect_offset_max is not None and \
+                    offset > self.__sect_user_offset(self.sect_offset_max):
+                continue
+            times, values = self.__sect_line(trace)
+            if not len(times) or np.all(np.isnan(values)):
+                continue
+            # Time relative to reftime (s), reduced by the offset if set
+            times = (times - reftime.ns) / 1e9
+            if self.sect_vred:
+                vred = self.sect_vred if self.sect_dist_degree \
+                    else self.sect_vred / 1e3  # km/s
+                times -= offset / vred
+            lines.append((trace.id, offset, times, values))
+        if not lines:
+            return
+        if self.sect_norm_method == 'stream':
+            norms = [max(np.nanmax(np.abs(line[3])) for line in lines)] \
+                * len(lines)
+        else:  # 'trace'
+            norms = [np.nanmax(np.abs(line[3])) for line in lines]
+        offsets = [line[1] for line in lines]
+        # Largest deflection: the mean spacing between seismograms
+        spread = (max(offsets) - min(offsets)) / len(lines) or 1.
+        vertical = self.sect_orientation == 'vertical'
+        for (tr_id, offset, times, values), norm in zip(lines, norms):
+            amplitudes = offset + values * (self.sect_user_scale * spread
+                                            / (norm or 1.))
+            # float32 halves the payload (precise enough for plotting)
+            amplitudes = amplitudes.astype(np.float32)
+            times = times.astype(np.float32)
+            x, y = (amplitudes, times) if vertical else (times, amplitudes)
+            self.fig.add_trace(go.Scattergl(
+                x=x, y=y, mode='lines', name=tr_id, line=dict(width=1),
+                showlegend=False, hovertemplate=tr_id + '<extra></extra>'
+            ))
+        unit = '°' if self.sect_dist_degree else 'km'
+        time_axis = dict(title_text='Time (s)' if not self.sect_vred
+                         else 'Reduced time (s)')
+        if self.sect_recordstart is not None or \
+                self.sect_recordlength is not None:
+            start = self.sect_recordstart or 0.
+            stop = start + self.sect_recordlength \
+                if self.sect_recordlength else max(
+                    np.nanmax(line[2]) for line in lines)
+            time_axis['range'] = [start, stop]
+        if vertical and self.sect_timedown:
+            if 'range' in time_axis:
+                time_axis['range'] = time_axis['range'][::-1]
+            else:
+                time_axis['autorange'] = 'reversed'
+        offset_axis = dict(title_text=f'Offset ({unit})')
+        if self.sect_plot_dx:
+            offset_axis['dtick'] = self.sect_plot_dx
+        x_axis, y_axis = (offset_axis, time_axis) if vertical \
+            else (time_axis, offset_axis)
+        self.fig.update_xaxes(showline=True, linewidth=1, mirror=True,
+                              showgrid=True, **x_axis)
+        self.fig.update_yaxes(showline=True, linewidth=1, mirror=True,
+                              showgrid=True, **y_axis)
+
+    def __sect_offset(self, trace):
+        """
+        Returns the offset of a seismogram, in km (degrees if
+        self.sect_dist_degree): from self.ev_coord (latitude, longitude)
+        and trace.stats.coordinates if given, else trace.stats.distance (m).
+        """
+        if self.ev_coord is not None:
+            coords = trace.stats.coordinates
+            if self.sect_dist_degree:
+                return locations2degrees(
+                    self.ev_coord[0], self.ev_coord[1],
+                    coords.latitude, coords.longitude)
+            return gps2dist_azimuth(
+                self.ev_coord[0], self.ev_coord[1],
+                coords.latitude, coords.longitude)[0] / 1e3
+        if self.sect_dist_degree:
+            return kilometer2degrees(trace.stats.distance / 1e3)
+        return trace.stats.distance / 1e3
+
+    def __sect_user_offset(self, offset):
+        """
+        Converts a user offset (m, or degrees) to the plot unit.
+        """
+        return offset if self.sect_dist_degree else offset / 1e3
+
+    def __sect_line(self, trace):
+        """
+        Returns the times (int64 ns) and calibrated values of a
+        seismogram, NaN at gaps, min/max reduced above self.max_npts.
+        """
+        segments = decimate.segments_from_stream(Stream([trace]))
+        npts = sum(len(segment[2]) for segment in segments)
+        calib = trace.stats.calib
+        if npts > self.max_npts:
+            times, values = decimate.minmax_line(*decimate.minmax(
+                segments, trace.stats.starttime.ns, trace.stats.endtime.ns,
+                self.max_npts // 2))
+            return times, values * calib
+        times, values = [], []
+        for start_ns, sampling_rate, data in segments:
+            if times:  # NaN point between segments
+                times.append(times[-1][-1:])
+                values.append(np.array([np.nan]))
+            times.append(start_ns + np.round(
+                np.arange(len(data)) * (1e9 / sampling_rate)
+            ).astype(np.int64))
+            values.append(np.asarray(data, dtype=np.float64) * calib)
+        if not times:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        return np.concatenate(times), np.concatenate(values)
+
     def __plot_straight(self, trace, ax, *args, **kwargs):  # @UnusedVariable
         """
         Just plots the data samples in the self.stream. Useful for smaller
@@ -424,28 +576,26 @@ class ModifiedWaveformPlotting(object):
                 # The times are not supposed to change.
                 trace.stats.delta = (
                     old_time_range / float(trace.stats.npts - 1))
-            trace.data = np.require(trace.data, np.float64) * trace.stats.calib
+            # Compact payload, y as float32 (sent as a binary array)
+            # and x as start + sample interval instead of one timestamp per
+            # sample, rendered with WebGL
+            y_values = self._scaled_float32(trace.data, trace.stats.calib)
             if self.type == 'relative':
                 # use seconds of relative sample times and shift by trace's
                 # start time, which was set relative to `reftime`.
-                x_values = (
-                    trace.times() + (trace.stats.starttime - self.reftime))
+                x0 = trace.stats.starttime - self.reftime
+                dx = trace.stats.delta
             else:
-                # convert seconds of relative sample times to days and add
-                # start time of trace.
-                # x_values = ((trace.times() / SECONDS_PER_DAY) +
-                #            date2num(trace.stats.starttime.datetime))
-                # Tho: this below should be double checked
-                x_values = np.array(
-                    trace.stats.starttime.ns + trace.times() * 1_000_000_000,
-                    dtype='datetime64[ns]'
-                )
+                # date axis: start time string (us) and interval in ms
+                x0 = trace.stats.starttime.strftime('%Y-%m-%d %H:%M:%S.%f')
+                dx = trace.stats.delta * 1000.
             # ax.plot(x_values, trace.data, color=self.color,
             #        linewidth=self.linewidth, linestyle=self.linestyle)
-            # self.fig.add_scatter(x=x_values, y=trace.data, row=ax, col=1,
-            # showlegend=False, line_color='blue', hoverinfo='skip')
-            self.fig.add_scatter(x=x_values, y=trace.data, row=ax, col=1,
-                                 showlegend=False, hoverinfo='skip')
+            self.fig.add_trace(
+                go.Scattergl(x0=x0, dx=dx, y=y_values, mode='lines',
+                             showlegend=False, hoverinfo='skip'),
+                row=ax, col=1
+            )
         # Write to self.ids
         # trace = st[0]
         trace = st.traces[0]
@@ -464,68 +614,19 @@ class ModifiedWaveformPlotting(object):
         much faster with large data sets.
         """
         # self._draw_overlap_axvspans(Stream(trace), ax)
-        # Some variables to help calculate the values.
-        starttime = self._time_to_xvalue(self.starttime)
-        endtime = self._time_to_xvalue(self.endtime)
-        # The same trace will always have the same sampling_rate.
-        sampling_rate = trace[0].stats.sampling_rate
-        # width of x axis in seconds
-        x_width = endtime - starttime
-        # normal plots have x-axis in days, so convert x_width to seconds
-        if self.type != "relative":
-            x_width = x_width * SECONDS_PER_DAY
-        # number of samples that get represented by one min-max pair
-        pixel_length = int(
-            np.ceil((x_width * sampling_rate + 1) / self.width))
-        # Loop over all the traces. Do not merge them as there are many samples
-        # and therefore merging would be slow.
-        for _i, tr in enumerate(trace):
-            trace_length = len(tr.data)
-            pixel_count = int(trace_length // pixel_length)
-            remaining_samples = int(trace_length % pixel_length)
-            remaining_seconds = remaining_samples / sampling_rate
-            if self.type != "relative":
-                remaining_seconds /= SECONDS_PER_DAY
-            # Reference to new data array which does not copy data but can be
-            # reshaped.
-            if remaining_samples:
-                data = tr.data[:-remaining_samples]
-            else:
-                data = tr.data
-            data = data.reshape(pixel_count, pixel_length)
-            min_ = data.min(axis=1) * tr.stats.calib
-            max_ = data.max(axis=1) * tr.stats.calib
-            # Calculate extreme_values and put them into new array.
-            if remaining_samples:
-                extreme_values = np.empty((pixel_count + 1, 2), dtype=float)
-                extreme_values[:-1, 0] = min_
-                extreme_values[:-1, 1] = max_
-                extreme_values[-1, 0] = \
-                    tr.data[-remaining_samples:].min() * tr.stats.calib
-                extreme_values[-1, 1] = \
-                    tr.data[-remaining_samples:].max() * tr.stats.calib
-            else:
-                extreme_values = np.empty((pixel_count, 2), dtype=float)
-                extreme_values[:, 0] = min_
-                extreme_values[:, 1] = max_
-            # Finally plot the data.
-            start = self._time_to_xvalue(tr.stats.starttime)
-            end = self._time_to_xvalue(tr.stats.endtime)
-            if remaining_samples:
-                # the last minmax pair is inconsistent regarding x-spacing
-                x_values = np.linspace(start, end - remaining_seconds,
-                                       num=extreme_values.shape[0] - 1)
-                x_values = np.concatenate([x_values, [end]])
-            else:
-                x_values = np.linspace(start, end, num=extreme_values.shape[0])
-            x_values = np.repeat(x_values, 2)
-            y_values = extreme_values.flatten()
-            # ax.plot(x_values, y_values, color=self.color)
-
-            x_values_plotly = np.array(x_values * SECONDS_PER_DAY,
-                                       dtype='datetime64[s]')
-            self.fig.add_scatter(x=x_values_plotly, y=y_values, row=ax, col=1,
-                                 showlegend=False, hoverinfo='skip')
+        # Pixels of all the traces on one grid, in a vectorized pass
+        # (see utils.decimate), gaps are NaN breaking the line
+        times, mins, maxs = decimate.minmax(
+            decimate.segments_from_stream(trace), self.starttime.ns,
+            self.endtime.ns, self.width)
+        calib = trace[0].stats.calib
+        if calib < 0:
+            mins, maxs = maxs, mins
+        x_values, y_values = decimate.minmax_line(times, mins * calib,
+                                                  maxs * calib)
+        self.fig.add_scatter(x=self._ns_to_xvalues(x_values), y=y_values,
+                             row=ax, col=1, showlegend=False,
+                             hoverinfo='skip')
 
         # remember xlim state and add callback to warn when zooming in
         self._initial_xrange = (self._time_to_xvalue(self.endtime) -
@@ -539,6 +640,48 @@ class ModifiedWaveformPlotting(object):
             tr_id = trace[0].id
         self.ids.append(tr_id)
 
+    def __plot_downsampled(self, trace, ax, method):
+        """
+        Plots the samples kept by the M4 or LTTB downsampling method
+        (see utils.decimate), tuned to the figure width in pixels. Unlike
+        min/max, the line goes through actual samples (hover enabled).
+        """
+        reduce = decimate.m4 if method == 'm4' else decimate.lttb
+        times, values = reduce(
+            decimate.segments_from_stream(trace), self.starttime.ns,
+            self.endtime.ns, self.width)
+        self.fig.add_scatter(x=self._ns_to_xvalues(times),
+                             y=values * trace[0].stats.calib, row=ax, col=1,
+                             showlegend=False)
+        if hasattr(trace[0], 'label'):
+            tr_id = trace[0].label
+        else:
+            tr_id = trace[0].id
+        self.ids.append(f'{tr_id} [{method.upper()}]')
+
+    def _scaled_float32(self, data, calib):
+        """
+        Returns data * calib as float32, computed in a buffer reused
+        across traces (Plotly copies the values it is given). Masked
+        samples are NaN (gaps break the line).
+        """
+        if len(self._y_buffer) < len(data):
+            self._y_buffer = np.empty(len(data), dtype=np.float32)
+        y_values = self._y_buffer[:len(data)]
+        np.multiply(np.ma.getdata(data), calib, out=y_values,
+                    casting='unsafe')
+        if np.ma.is_masked(data):
+            y_values[np.ma.getmaskarray(data)] = np.nan
+        return y_values
+
+    def _ns_to_xvalues(self, times):
+        """
+        Converts int64 ns times to the x values of the plot type.
+        """
+        if self.type == 'relative':
+            return (times - self.reftime.ns) / 1e9
+        return times.astype('datetime64[ns]')
+
     def __setup_figure(self):
         """
         The design and look of the whole plot to be produced.
@@ -645,6 +788,88 @@ class ModifiedWaveformPlotting(object):
             return date2num(t.datetime)
 
 
+def day_rows(stream, starttime, endtime, interval, width):
+    """
+    Reduces a stream to the min/max rows of a day plot.
+
+    The window is cut into rows of interval seconds, each reduced to width
+    pixels, with one vectorized pass over all the rows (see
+    utils.decimate). The result holds a few arrays of about 4 * width
+    values per row whatever the sampling rate, so it is cheap to cache
+    and to plot again (see plot_day_rows).
+
+    Return a dict: id of the first trace, start time (ns) and interval (s)
+    of the rows, number of rows, and the min/max line of all rows, as the
+    row index, the time since the row start (s) and the calibrated value
+    (NaN at gaps) of each point.
+    """
+    interval_ns = int(interval * decimate.NS)
+    start_ns = starttime.ns
+    n_rows = max(1, -(-(endtime.ns - start_ns) // interval_ns))
+    times, mins, maxs = decimate.minmax(
+        decimate.segments_from_stream(stream), start_ns,
+        start_ns + n_rows * interval_ns, n_rows * width)
+    times, values = decimate.minmax_line(times, mins, maxs)
+    rows, offsets = np.divmod(times - start_ns, interval_ns)
+    return {
+        'id': stream[0].id,
+        'starttime': start_ns,
+        'interval': interval,
+        'n_rows': n_rows,
+        'row': rows.astype(np.int32),
+        'x': (offsets / decimate.NS).astype(np.float32),
+        'y': (values * stream[0].stats.calib).astype(np.float32),
+    }
+
+
+def plot_day_rows(fig, rows, colors=DAYPLOT_COLORS,
+                  vertical_scaling_range=None):
+    """
+    Plots day plot rows (see day_rows) in a figure, first row on
+    top, one Scattergl trace per color (rows cycle through colors).
+
+    Rows are spaced by one y unit, with the amplitude range
+    vertical_scaling_range (default: twice the 99.5th percentile of the
+    absolute values, robust to a few spikes) taking one row height.
+    """
+    row, y = rows['row'], rows['y']
+    if not vertical_scaling_range:
+        finite = np.abs(y[~np.isnan(y)])
+        vertical_scaling_range = 2 * np.percentile(finite, 99.5) \
+            if len(finite) else 0
+    scale = 1. / (vertical_scaling_range or 1.)
+    y_values = (y * scale - row).astype(np.float32)
+    x_values = rows['x'] / 60.  # minutes
+    for index, color in enumerate(colors):
+        selected = np.flatnonzero(row % len(colors) == index)
+        if not len(selected):
+            continue
+        # NaN point between rows, so that their lines are not joined
+        breaks = np.flatnonzero(np.diff(row[selected])) + 1
+        fig.add_trace(go.Scattergl(
+            x=np.insert(x_values[selected], breaks, np.nan),
+            y=np.insert(y_values[selected], breaks, np.nan),
+            mode='lines', line=dict(color=color, width=1),
+            showlegend=False, hoverinfo='skip'
+        ))
+    # Row start times on the left, one label per hour (or per row)
+    n_rows, interval = rows['n_rows'], rows['interval']
+    step = max(1, int(round(3600 / interval)))
+    labeled = np.arange(0, n_rows, step)
+    labels = (rows['starttime'] + labeled * int(interval * decimate.NS)) \
+        .astype('datetime64[ns]').astype('datetime64[m]')
+    fig.update_yaxes(
+        tickvals=-labeled,
+        ticktext=[str(label)[11:] for label in labels],
+        range=[-n_rows, 1], showline=True, linewidth=1, mirror=True,
+        showgrid=False, zeroline=False, title_text='Time (UTC)'
+    )
+    fig.update_xaxes(range=[0, interval / 60.], showline=True, linewidth=1,
+                     mirror=True, showgrid=True,
+                     title_text='Time in minutes')
+    return fig
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod(exclude_empty=True)
@@ -0,0 +1,72 @@
+"""Reader of the min/max overview pyramid of the SDS archive.
+
+The overview_pyramid.py cron job of the seiscomp container stores the
+minimum and maximum of every channel per 1 s, 10 s, 1 min and 10 min
+bucket, one NumPy file per day file and level, in a volume mounted
+read-only in the UI container. Long windows are plotted from the coarsest
+level still giving at least one bucket per pixel, read by memory mapping
+a few small files, instead of fetching and decoding every raw sample.
+The overview lags the archive by up to the cron period (10 mins).
+"""
+
+import datetime
+import os
+
+import numpy as np
+from obspy import UTCDateTime
+
+from utils.sds_reader import sds_path
+
+OVERVIEW_ROOT = os.environ.get('OVERVIEW_ARCHIVE', '/data/overview')
+LEVELS = (1, 10, 60, 600)  # bucket lengths (s), see overview_pyramid.py
+PLOT_WIDTH = 1200  # px, upper bound of the plot width
+
+
+def overview_path(root, net, sta, loc, cha, day, level):
+    """Return the path of the overview of a channel day at a level."""
+    return f'{sds_path(root, net, sta, loc, cha, day)}.{level}s.npy'
+
+
+def choose_level(span_s, width_px=PLOT_WIDTH):
+    """Return the coarsest level with at least one bucket per pixel.
+
+    Return None if the window is too short for any level (raw data).
+    """
+    levels = [level for level in LEVELS if span_s / level >= width_px]
+    return max(levels) if levels else None
+
+
+def read_overview(net, sta, loc, cha, starttime, endtime, level,
+                  root=OVERVIEW_ROOT):
+    """Return the overview of a channel in a window at a level, or None.
+
+    Return (bucket start times as datetime64[s], minimums, maximums), with
+    NaN for the buckets without data, or None if no overview file exists
+    for the window (overview not built, or no data).
+    """
+    starttime, endtime = UTCDateTime(starttime), UTCDateTime(endtime)
+    per_day = 86400 // level
+    day = starttime.datetime.date()
+    first_bucket = int(starttime.timestamp // level)
+    last_bucket = int(endtime.timestamp // level) + 1
+    found = False
+    pieces = []
+    while day <= endtime.datetime.date():
+        day_bucket = (day - datetime.date(1970, 1, 1)).days * per_day
+        start = max(first_bucket - day_bucket, 0)
+        stop = min(last_bucket - day_bucket, per_day)
+        try:
+            buckets = np.load(
+                overview_path(root, net, sta, loc or '', cha, day, level),
+                mmap_mode='r')
+            found = True
+            pieces.append(np.asarray(buckets[start:stop]))
+        except FileNotFoundError:
+            pieces.append(np.full((stop - start, 2), np.nan, np.float32))
+        day += datetime.timedelta(days=1)
+    if not found:
+        return None
+    buckets = np.concatenate(pieces)
+    times = (np.arange(first_bucket, first_bucket + len(buckets))
+             * level).astype('datetime64[s]')
+    return times, buckets[:, 0], buckets[:, 1]
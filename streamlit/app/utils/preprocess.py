@@ -0,0 +1,206 @@
+"""Preprocessing pipeline of the plotted traces, with cached stages.
+
+Traces go through explicit stages, applied in order: instrument response
+removal, then bandpass filter. The output of each stage is cached for all
+sessions, keyed by a hash of the stage input (traces data and headers)
+and the stage parameters, in a cache bounded in bytes with least recently
+used eviction. Changing the filter band thus reuses the response-removed
+traces (the FFT-heavy step), and going back to settings already viewed
+costs no processing at all.
+
+Response removal follows Trace.remove_response (mean removal, 5% cosine
+taper, 60 dB water level), but the gap-split segments of a channel are
+deconvolved as a batch: the segments with the same response (channel
+epoch) are all zero padded to the FFT length of the longest one, so that
+the instrument response is evaluated once per channel epoch, and
+transformed together (2D FFTs of at most BATCH_BYTES), instead of once per
+segment. The longer padding of the shorter segments only reduces the
+wrap-around of the deconvolution.
+"""
+
+import collections
+import hashlib
+import pickle
+import threading
+
+import numpy as np
+import streamlit as st
+from obspy import Stream, Trace
+from obspy.core.inventory import PolynomialResponseStage
+from obspy.signal.invsim import cosine_taper, invert_spectrum
+from obspy.signal.util import _npts2nfft
+
+MAX_BYTES = 256 * 1024 ** 2
+BATCH_BYTES = 64 * 1024 ** 2  # padded segments transformed at once
+WATER_LEVEL = 60  # dB
+TAPER_FRACTION = 0.05
+
+
+def stream_key(stream):
+    """Return a hash of the data and headers (response included) of
+    traces."""
+    digest = hashlib.blake2b(digest_size=16)
+    for trace in stream:
+        digest.update(f'{trace.id}|{trace.stats.starttime.ns}|'
+                      f'{trace.stats.sampling_rate}|{trace.stats.calib}|'
+                      f'{trace.data.dtype}|'.encode())
+        if 'response' in trace.stats:  # StationXML may be updated
+            digest.update(response_key(trace.stats.response))
+        digest.update(np.ascontiguousarray(np.ma.getdata(trace.data)))
+        if np.ma.is_masked(trace.data):
+            digest.update(np.ma.getmaskarray(trace.data))
+    return digest.hexdigest()
+
+
+def response_key(response):
+    """Return a hash of an instrument response (all stages and values)."""
+    return hashlib.blake2b(pickle.dumps(response), digest_size=16).digest()
+
+
+def _evalresp_response(trace):
+    """Return the response of a trace if evalresp is needed, else None
+    (polynomial responses, left to Trace.remove_response)."""
+    response = trace.stats.response
+    if not response.response_stages or isinstance(
+            response.response_stages[0], PolynomialResponseStage):
+        return None
+    return response
+
+
+def remove_response(stream):
+    """Stage: remove the instrument response of traces, in place.
+
+    The traces of a channel with the same response are deconvolved
+    together (see module doc). Responses must be attached (stats.response).
+    """
+    stream.detrend("linear")
+    groups = collections.defaultdict(list)
+    for trace in stream:
+        if _evalresp_response(trace) is None:
+            trace.remove_response(output='DEF', water_level=WATER_LEVEL,
+                                  zero_mean=True, taper=True,
+                                  taper_fraction=TAPER_FRACTION)
+            continue
+        groups[(trace.id, trace.stats.delta,
+                response_key(trace.stats.response))].append(trace)
+    for (_, delta, _), traces in groups.items():
+        nfft = _npts2nfft(max(trace.stats.npts for trace in traces))
+        freq_response, _ = _evalresp_response(traces[0]) \
+            .get_evalresp_response(delta, nfft, output='DEF')
+        invert_spectrum(freq_response, WATER_LEVEL)
+        batch_rows = max(1, BATCH_BYTES // (8 * nfft))
+        for first in range(0, len(traces), batch_rows):
+            _deconvolve(traces[first:first + batch_rows], nfft,
+                        freq_response)
+    return stream
+
+
+def _deconvolve(traces, nfft, freq_response):
+    """Deconvolve traces by an inverted response of nfft points."""
+    # Zero mean, tapered segments, zero padded to nfft (one per row)
+    block = np.zeros((len(traces), nfft))
+    for row, trace in enumerate(traces):
+        data = block[row, :trace.stats.npts]
+        data[:] = trace.data
+        data -= data.mean()
+        data *= cosine_taper(trace.stats.npts, TAPER_FRACTION,
+                             sactaper=True, halfcosine=False)
+    spectra = np.fft.rfft(block, axis=1)
+    del block
+    spectra *= freq_response
+    spectra[:, -1] = np.abs(spectra[:, -1]) + 0.0j
+    block = np.fft.irfft(spectra, axis=1)
+    for row, trace in enumerate(traces):
+        trace.data = block[row, :trace.stats.npts].copy()
+
+
+def bandpass(stream, fmin, fmax):
+    """Stage: linear detrend, taper and bandpass filter traces, in place."""
+    stream.detrend("linear")
+    stream.taper(max_percentage=TAPER_FRACTION)
+    stream.filter("bandpass", freqmin=fmin, freqmax=fmax)
+    return stream
+
+
+STAGES = {
+    'response': remove_response,
+    'bandpass': bandpass,
+}
+
+
+class StageCache:
+    """Thread-safe cache of stage outputs, bounded in bytes."""
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()  # key -> (stream, bytes)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, stream):
+        nbytes = sum(trace.data.nbytes for trace in stream)
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (stream, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                self.size -= self._entries.popitem(last=False)[1][1]
+
+
+@st.cache_resource(show_spinner=False)
+def get_stage_cache():
+    """Return the stage output cache shared by all sessions."""
+    return StageCache()
+
+
+class Pipeline:
+    """Preprocessing stages, as (name, parameters) pairs applied in order.
+
+    run(stream) returns the processed traces, from the cache of each
+    stage output when available (see get_stage_cache). The returned traces
+    share their data with the cache: they must not be modified in place.
+    """
+
+    def __init__(self, stages, cache=None):
+        unknown = [name for name, _ in stages if name not in STAGES]
+        if unknown:
+            raise ValueError(f"Unknown preprocessing stage(s): {unknown}")
+        self.stages = [(name, tuple(params)) for name, params in stages]
+        self.cache = cache if cache is not None else get_stage_cache()
+
+    def run(self, stream, progress=None):
+        """Run the stages on traces (left unchanged).
+
+        If given, progress(name) is called before computing a stage.
+        """
+        if not self.stages:
+            return stream
+        key = stream_key(stream)
+        for name, params in self.stages:
+            key = hashlib.blake2b(f'{key}|{name}|{params!r}'.encode(),
+                                  digest_size=16).hexdigest()
+            output = self.cache.get(key)
+            if output is None:
+                if progress is not None:
+                    progress(name)
+                output = STAGES[name](stream.copy(), *params)
+                self.cache.set(key, output)
+            stream = output
+        # New headers, so that callers can change them (not the data)
+        return Stream([Trace(trace.data, trace.stats.copy())
+                       for trace in stream])
@@ -0,0 +1,155 @@
+"""Module to display a record section of the whole network.
+
+Get user input for a channel code, a source location and a time window,
+fetch the window for every station recording that channel at once (the
+missing chunks of all stations are fetched concurrently by the thread
+pool of the waveform cache), and plot the traces aligned by distance from
+the source, each normalized and reduced to a bounded number of points
+(see ModifiedWaveformPlotting.plot_section).
+"""
+
+import datetime
+import io
+
+import pandas as pd
+import requests
+import streamlit as st
+from obspy import Stream, UTCDateTime
+from obspy.core import AttribDict
+from streamlit import session_state as sstate
+
+from utils.data_fetch import fetch_network_channels
+from utils.obspy_plot_mod import ModifiedWaveformPlotting
+from utils.overview import PLOT_WIDTH
+from utils.waveform_cache import get_waveform_cache
+
+MAX_DURATION = 3600  # s, longest window of a section
+
+
+def load_network_channels():
+    """Return the channels of all stations as a dataframe (or None)."""
+    if 'network_channel_df' not in sstate:
+        channel_data = fetch_network_channels()
+        if channel_data is None:
+            return None
+        # Remove first char '#' (header line included as comment)
+        sstate.network_channel_df = pd.read_csv(
+            io.StringIO(channel_data[1:]), sep='|',
+            dtype={'Network': str, 'Station': str, 'Location': str}
+        )
+    return sstate.network_channel_df
+
+
+def select_section_params(channel_df):
+    """Get user input for the channel, source and time window."""
+    chan = st.selectbox(
+        "Select channel", sorted(channel_df['Channel'].unique().tolist()),
+        key='section_channel'
+    )
+    lat_column, lon_column = st.columns(2)
+    center = sstate.df_stations[['Latitude', 'Longitude']].mean()
+    source_lat = lat_column.number_input(
+        'Source latitude (°)', min_value=-90., max_value=90.,
+        value=float(center['Latitude']), format='%.4f'
+    )
+    source_lon = lon_column.number_input(
+        'Source longitude (°)', min_value=-180., max_value=180.,
+        value=float(center['Longitude']), format='%.4f'
+    )
+    date_column, time_column, duration_column = st.columns(3)
+    day = date_column.date_input('Origin day', value="today",
+                                 key='section_day')
+    if not isinstance(day, datetime.date):
+        st.error("Please select a valid date.")
+        st.stop()
+    origin_time = time_column.time_input(
+        'Origin time (UTC)', value=datetime.time(0, 0), step=60
+    )
+    duration = duration_column.number_input(
+        'Duration (s)', min_value=10, max_value=MAX_DURATION, value=300,
+        step=10
+    )
+    norm_method = st.radio(
+        "Normalization", ['trace', 'stream'], horizontal=True,
+        format_func=lambda method: {'trace': 'Per trace',
+                                    'stream': 'Whole section'}[method],
+        key='section_norm'
+    )
+    start_date = datetime.datetime.combine(day, origin_time)
+    end_date = start_date + datetime.timedelta(seconds=duration)
+    return chan, (source_lat, source_lon), start_date, end_date, norm_method
+
+
+def section_channels(channel_df, chan):
+    """Return the channel of each station for a channel code, first
+    location only, as a dict of station coordinates by (net, sta, loc,
+    cha), from sstate.df_stations."""
+    sub_df = channel_df[channel_df['Channel'] == chan].fillna(
+        {'Location': ''}).sort_values('Location')
+    sub_df = sub_df.drop_duplicates(['Network', 'Station'])
+    sub_df = sub_df.merge(
+        sstate.df_stations[['Network', 'Station', 'Latitude', 'Longitude']],
+        on=['Network', 'Station'], suffixes=('_channel', '')
+    )
+    return {
+        (row.Network, row.Station, row.Location, row.Channel):
+            (row.Latitude, row.Longitude)
+        for row in sub_df.itertuples()
+    }
+
+
+def fetch_section_traces(coordinates, start_date, end_date):
+    """Fetch a window for many channels at once, with a progress bar.
+
+    Return a detrended Stream with station coordinates attached (see
+    section_channels), or None if there is no data.
+    """
+    progress_bar = st.empty()
+
+    def show_progress(done, total):
+        progress_bar.progress(
+            done / total, text=f'Fetching traces... ({done}/{total} requests)'
+        )
+
+    try:
+        streams = get_waveform_cache().get_bulk(
+            list(coordinates), start_date, end_date, progress=show_progress
+        )
+    except requests.exceptions.RequestException as e:
+        st.error(f"Request error: {e}", icon="🚨")
+        st.stop()
+    finally:
+        progress_bar.empty()
+    traces = Stream()
+    for nslc, stream in streams.items():
+        if stream is None:
+            continue
+        latitude, longitude = coordinates[nslc]
+        for trace in stream:
+            trace.stats.coordinates = AttribDict(
+                {'latitude': latitude, 'longitude': longitude})
+        traces += stream
+    if not traces:
+        st.warning('No data found for the requested period.', icon="⚠️")
+        return None
+    traces.detrend("linear")
+    return traces
+
+
+def plot_section(traces, source, start_date, end_date, norm_method):
+    """Plot a record section, return the figure."""
+    height = 600 + 10 * len(traces)
+    waveform = ModifiedWaveformPlotting(
+        stream=traces, type='section', handle=True, ev_coord=source,
+        starttime=UTCDateTime(start_date), endtime=UTCDateTime(end_date),
+        reftime=UTCDateTime(start_date), norm_method=norm_method,
+        size=(PLOT_WIDTH, height)
+    )
+    fig = waveform.plot_waveform(handle=True)
+    fig.add_scatter(x=[0.], y=[0.], mode='markers', showlegend=False,
+                    marker=dict(symbol='star', size=16, color='red'),
+                    hovertemplate='Source<extra></extra>')
+    n_stations = len({trace.id for trace in traces})
+    fig.update_layout(title_text=f"{n_stations} traces, from "
+                      f"{start_date.ctime()} (UTC)")
+    return fig
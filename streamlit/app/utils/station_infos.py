@@ -1,6 +1,7 @@
 """Module to display detailed station metadata.
 
 Display channels info as a dataframe and data availability as a timeline plot.
+Display the status of the recently uploaded data files.
 """
 
 import io
@@ -10,7 +11,11 @@ import pandas as pd
 import plotly.express as px
 from plotly.exceptions import PlotlyError
 
-from utils.data_fetch import fetch_channels, fetch_availability
+from utils.data_fetch import (
+    fetch_channels,
+    fetch_availability,
+    fetch_ingested_files
+)
 
 
 def display_channels(net, sta):
@@ -96,3 +101,20 @@ def display_availability(net, sta):
     except PlotlyError as err:
         st.error(f'Plot error: {err}', icon="🚨")
     return
+
+
+def display_ingested_files(net, sta, hours=24):
+    """Display the files uploaded by a station and their ingestion status."""
+    st.markdown(f'{net} - {sta}')
+    df = fetch_ingested_files(net, sta, hours)
+    if df is None:
+        st.warning('Ingestion ledger not available', icon="⚠️")
+        return
+    if df.empty:
+        st.info(f'No file received in the last {hours} hours', icon="ℹ️")
+        return
+    counts = df['Status'].value_counts()
+    st.markdown(' — '.join(f'__{status}__: {count}'
+                           for status, count in counts.items()))
+    st.dataframe(df, hide_index=True)
+    return
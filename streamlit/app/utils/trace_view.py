@@ -3,14 +3,33 @@
 TODO write details after refactor.
 """
 
+import collections
 import datetime
 import copy
 import io
+import time
 
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import requests
 import streamlit as st
+from plotly.subplots import make_subplots
 from streamlit import session_state as sstate
 
-from utils.obspy_plot_mod import ModifiedWaveformPlotting
+from utils.day_rows_cache import (
+    adjacent_days,
+    get_day_rows_cache,
+    reduce_day
+)
+from utils.obspy_plot_mod import ModifiedWaveformPlotting, plot_day_rows
+from utils.overview import choose_level, read_overview, PLOT_WIDTH
+from utils.preprocess import Pipeline
+from utils.waveform_cache import get_waveform_cache
+
+# Raw samples above which traces are plotted as min/max (as obspy_plot_mod)
+MIN_MAX_NPTS = 400000
+ZOOM_CACHE_SIZE = 8  # figures of the zoomed windows kept per session
 
 # @st.fragment # this only work if output stored in session state:
 # need to rethink how to handle fragment logic
@@ -186,37 +205,65 @@ def fetch_trace_units(trace, is_resp_removed):
 
 
 def preprocess_traces(traces, fmin, fmax, resp_remove):
-    """Preprocess traces (filter and/or response removal) before plotting."""
-    if fmin is not None and fmax is not None:
-        with st.spinner('Filtering...'):
-            traces.detrend("linear")
-            traces.taper(max_percentage=0.05)
-            traces.filter("bandpass", freqmin=fmin, freqmax=fmax)
+    """Preprocess traces (response removal and/or filter) before plotting.
+
+    Stages are run by a utils.preprocess pipeline, whose cached outputs
+    are shared: the returned traces must not be modified in place.
+    """
+    stages = []
     if resp_remove:
-        with st.spinner('Removing instrument response...'):
-            try:
-                traces.detrend("linear")
-                traces.remove_response(
-                    output='DEF', water_level=60, pre_filt=None,
-                    zero_mean=True, taper=True,
-                    taper_fraction=0.05, plot=False, fig=None
-                )
-            except Exception as err:
-                st.error(err, icon="🚨")
-                st.stop()
-    return traces
+        stages.append(('response', ()))
+    if fmin is not None and fmax is not None:
+        stages.append(('bandpass', (fmin, fmax)))
+    if not stages:
+        return traces
+    spinner = st.empty()
+    messages = {
+        'response': 'Removing instrument response...',
+        'bandpass': 'Filtering...',
+    }
+
+    def show_stage(name):
+        spinner.caption(messages[name])
+
+    try:
+        with st.spinner('Preprocessing...'):
+            return Pipeline(stages).run(traces, progress=show_stage)
+    except Exception as err:
+        st.error(err, icon="🚨")
+        st.stop()
+    finally:
+        spinner.empty()
+
+
+def select_downsampling():
+    """Get user input for the downsampling method of long traces."""
+    methods = {"Min/max": 'fast', "M4": 'm4', "LTTB": 'lttb'}
+    help_msg = (
+        f"Method used for traces of more than {MIN_MAX_NPTS} samples. "
+        "Min/max: envelope of each pixel. M4: first, last, min and max "
+        "samples of each pixel (exact line shape). LTTB: largest triangle "
+        "three buckets, 2 samples per pixel (smoother shape). M4 and LTTB "
+        "plot actual samples, with hover."
+    )
+    method = st.radio("Downsampling", methods, horizontal=True,
+                      help=help_msg, key='trace_downsampling')
+    return methods[method]
 
 
-def plot_traces(traces, resp_remove, height):
+def plot_traces(traces, resp_remove, height, downsampling='fast'):
     """Plot traces using a modified Obspy plotting class and Plotly.
 
     One subplot per channel. Height is fixed and width is auto-adjusted to
-    fit the container.
+    fit the container. Traces of more than MIN_MAX_NPTS samples are
+    downsampled to the plot width with the given method ('fast' min/max,
+    'm4' or 'lttb'). Return the figure (see show_zoomable_chart).
     """
-    # Nb: width will be auto adjusted to fit column container
-    width = height
+    # Nb: width will be auto adjusted to fit column container, the
+    # downsampling resolution is tuned to the largest expected width
     waveform = ModifiedWaveformPlotting(
-        stream=traces, handle=True, size=(width, height)
+        stream=traces, handle=True, size=(PLOT_WIDTH, height),
+        downsampling=downsampling
     )
     fig = waveform.plot_waveform(handle=True)
     if fig is None:
@@ -228,18 +275,180 @@ def plot_traces(traces, resp_remove, height):
         xref='paper', xanchor='right', xshift=-90,
         x=0, yref='paper', y=0.5, showarrow=False
     )
-    st.plotly_chart(fig, use_container_width=True, theme=None)
-    max_npts = waveform.max_npts
-    st.info(
-        f"Traces including more than {max_npts} samples "
-        f"({int(max_npts / 6000)} mins at 100Hz) are plotted using the low "
-        "resolution [min/max](https://docs.obspy.org/packages/autogen/"
-        "obspy.imaging.waveform.WaveformPlotting.html#obspy.imaging.waveform."
-        "WaveformPlotting.__plot_min_max) nethod. To interact with the fully "
-        "resolved data, reduce the time window.",
-        icon="ℹ️"
+    return fig
+
+
+def is_downsampled(traces):
+    """Return True if the traces are plotted downsampled (long traces)."""
+    return any(trace.stats.npts > MIN_MAX_NPTS for trace in traces)
+
+
+def start_zoom(view_key, start_date, end_date):
+    """Reset the zoom history of the trace viewer for a new request."""
+    sstate.zoom_key = view_key
+    sstate.zoom_stack = [(start_date, end_date)]
+    sstate.zoom_serial = sstate.get('zoom_serial', 0) + 1
+    if 'zoom_cache' not in sstate:
+        sstate.zoom_cache = collections.OrderedDict()
+
+
+def _chart_key():
+    # New key at each zoom change: no stale box selection
+    return f'trace_chart_{sstate.zoom_serial}'
+
+
+def _to_datetime(value):
+    """Convert a Plotly date axis value (string or epoch ms) to datetime."""
+    if isinstance(value, str):
+        return pd.Timestamp(value).to_pydatetime()
+    return pd.Timestamp(value, unit='ms').to_pydatetime()
+
+
+def _on_box_select():
+    """Zoom in on the time range of a box selection."""
+    event = sstate.get(_chart_key())
+    boxes = event['selection']['box'] if event else []
+    if not boxes:
+        return
+    start, end = sstate.zoom_stack[-1]
+    box_start, box_end = sorted(_to_datetime(x) for x in boxes[0]['x'])
+    start, end = max(start, box_start), min(end, box_end)
+    if end > start:
+        sstate.zoom_stack.append((start, end))
+        sstate.zoom_serial += 1
+
+
+def _zoom_out(reset=False):
+    del sstate.zoom_stack[1 if reset else -1:]
+    sstate.zoom_serial += 1
+
+
+def zoom_controls():
+    """Display the zoom out/reset buttons, return the current window."""
+    out_column, reset_column, _ = st.columns([1, 1, 3])
+    disabled = len(sstate.zoom_stack) < 2
+    out_column.button('Zoom out', on_click=_zoom_out, disabled=disabled)
+    reset_column.button('Reset zoom', on_click=_zoom_out, args=(True,),
+                        disabled=disabled)
+    return sstate.zoom_stack[-1]
+
+
+def cached_view(window):
+    """Return the (figure, traces, level, build time) viewed for a window,
+    or None."""
+    key = (sstate.zoom_key, window)
+    view = sstate.zoom_cache.get(key)
+    if view is not None:
+        sstate.zoom_cache.move_to_end(key)
+    return view
+
+
+def cache_view(window, fig, traces=None, level=None, build_s=None):
+    """Keep the figure (and traces or overview level) of a window."""
+    view = (fig, traces, level, build_s)
+    sstate.zoom_cache[(sstate.zoom_key, window)] = view
+    while len(sstate.zoom_cache) > ZOOM_CACHE_SIZE:
+        sstate.zoom_cache.popitem(last=False)
+    return view
+
+
+def show_zoomable_chart(fig):
+    """Display a trace figure. Box selecting a time range zooms in.
+
+    Zooming re-queries the selected range, so that the plot resolution
+    increases up to the full samples. Return the time spent sending the
+    figure (serialization).
+    """
+    fig.update_layout(dragmode='select', selectdirection='h')
+    start = time.perf_counter()
+    st.plotly_chart(fig, use_container_width=True, theme=None,
+                    key=_chart_key(), on_select=_on_box_select,
+                    selection_mode='box')
+    return time.perf_counter() - start
+
+
+def show_plot_debug(fig, build_s, send_s):
+    """Display the figure payload size and timings, per plotted trace."""
+    payload = fig.to_json()  # as serialized by st.plotly_chart
+    st.caption(
+        f"Payload {len(payload) / 1e6:.2f} MB, figure built in "
+        + ("(cached)" if build_s is None else f"{build_s:.2f} s")
+        + f", sent in {send_s:.2f} s"
     )
-    return
+    rows = []
+    for trace in fig.data:
+        trace_json = trace.to_json()
+        rows.append({
+            'Type': trace.type,
+            'Points': 0 if trace.y is None else len(trace.y),
+            'y': str(getattr(trace.y, 'dtype', 'list')),
+            'x': 'x0 + dx' if trace.x is None else 'array',
+            'Size (MB)': len(trace_json) / 1e6,
+        })
+    st.dataframe(pd.DataFrame(rows), hide_index=True)
+
+
+def select_overview_level(loc, chans, start_date, end_date):
+    """Return the overview level to plot the window with, or None (raw).
+
+    The overview is only used when raw traces would be plotted as min/max
+    anyway (more than MIN_MAX_NPTS samples).
+    """
+    sub_df = sstate.channel_df.query('Location == @loc')
+    max_fs = sub_df[sub_df['Channel'].isin(chans)]['SampleRate'].max()
+    span_s = (end_date - start_date).total_seconds()
+    if not span_s * max_fs > MIN_MAX_NPTS:
+        return None
+    return choose_level(span_s)
+
+
+def fetch_overview(net, sta, loc, chans, start_date, end_date, level):
+    """Read the min/max overview of channels, None if one is missing."""
+    overviews = {}
+    for cha in chans:
+        overview = read_overview(net, sta, loc, cha, start_date, end_date,
+                                 level)
+        if overview is None:
+            return None
+        overviews[f'{net}.{sta}.{loc}.{cha}'] = overview
+    return overviews
+
+
+def plot_overview(overviews, start_date, end_date, height):
+    """Plot min/max overviews, one subplot per channel (as plot_traces).
+
+    Return the figure.
+    """
+    title = {
+        'text': f"{start_date.ctime()} - {end_date.ctime()}",
+        'x': 0.5,
+        'xanchor': 'center',
+        'font_size': 24
+    }
+    fig = go.Figure(layout=go.Layout(height=height, title=title,
+                                     font_color="black", font_size=20,
+                                     margin=dict(l=120)))
+    make_subplots(rows=len(overviews), cols=1, shared_xaxes=True,
+                  vertical_spacing=0, figure=fig)
+    for row, (tr_id, (times, mins, maxs)) in enumerate(overviews.items(), 1):
+        # One vertical segment per bucket, NaN buckets leave gaps
+        fig.add_scatter(x=np.repeat(times, 2),
+                        y=np.column_stack((mins, maxs)).ravel(),
+                        row=row, col=1, showlegend=False, hoverinfo='skip')
+        fig.add_annotation(text=tr_id, xref='x domain', x=0.004,
+                           yref='y domain', y=0.98, row=row, col=1,
+                           showarrow=False, bgcolor='white',
+                           bordercolor='black')
+    fig.update_xaxes(showline=True, linewidth=1, showgrid=True)
+    fig.update_xaxes(mirror=True, row=1, col=1)
+    fig.update_xaxes(title_text='Time', row=len(overviews), col=1)
+    fig.update_yaxes(showline=True, linewidth=1, mirror=True, showgrid=True)
+    fig.add_annotation(
+        text="Amplitude (counts)", textangle=-90,
+        xref='paper', xanchor='right', xshift=-90,
+        x=0, yref='paper', y=0.5, showarrow=False
+    )
+    return fig
 
 
 def select_day_plot_params():
@@ -253,10 +462,89 @@ def select_day_plot_params():
     )['Channel'].unique().tolist()
     chan = chan_column.selectbox("Select channel", chan_codes)
 
-    day = st.date_input('Day', value="today")
+    # In session state, so that the previous / next buttons can set it
+    if 'day_plot_date' not in sstate:
+        sstate.day_plot_date = datetime.date.today()
+    day = st.date_input('Day', key='day_plot_date')
     if not isinstance(day, datetime.date):
         st.error("Please select a valid date.")
         st.stop()
     start_date = datetime.datetime(day.year, day.month, day.day)
     end_date = start_date + datetime.timedelta(hours=24)
     return loc, chan, start_date, end_date
+
+
+def fetch_day_rows(net, sta, loc, chan, start_date, fmin, fmax):
+    """Return the day plot rows of a day (see utils.day_rows_cache), None
+    if there is no data.
+
+    Days neither cached nor being prefetched are fetched through the
+    waveform cache, with a progress bar.
+    """
+    day = start_date.date()
+
+    progress_bar = st.empty()
+
+    def show_progress(done, total):
+        progress_bar.progress(
+            done / total, text=f'Fetching traces... ({done}/{total} requests)'
+        )
+
+    def compute():
+        traces = get_waveform_cache().get_waveforms(
+            net, sta, loc, chan, start_date,
+            start_date + datetime.timedelta(hours=24), progress=show_progress
+        )
+        if traces is None:
+            return None
+        return reduce_day(traces, day, fmin, fmax)
+
+    try:
+        with st.spinner('Loading day plot...'):
+            return get_day_rows_cache().get(
+                (net, sta, loc, chan, day, fmin, fmax), compute)
+    except requests.exceptions.RequestException as e:
+        st.error(f"Request error: {e}", icon="🚨")
+        st.stop()
+    finally:
+        progress_bar.empty()
+
+
+def prefetch_adjacent_days(net, sta, loc, chan, start_date, fmin, fmax):
+    """Compute the day plots of the previous and next days in background."""
+    cache = get_day_rows_cache()
+    for day in adjacent_days(start_date.date()):
+        cache.prefetch((net, sta, loc, chan, day, fmin, fmax))
+
+
+def _shift_day(days):
+    sstate.day_plot_date += datetime.timedelta(days=days)
+
+
+def day_navigation(start_date):
+    """Show the day with previous and next day buttons."""
+    prev_col, date_col, next_col = st.columns([1, 4, 1])
+    prev_col.button('◀️', key='prev_day', help='Previous day',
+                    on_click=_shift_day, args=(-1,))
+    date_str = start_date.strftime("%A %d %B %Y")
+    date_col.markdown(
+        f'<div style="text-align: center;">{date_str}</div>',
+        unsafe_allow_html=True
+    )
+    next_col.button('▶️', key='next_day', help='Next day',
+                    on_click=_shift_day, args=(1,),
+                    disabled=start_date.date() >= datetime.date.today())
+
+
+def plot_day(rows):
+    """Plot day plot rows (see fetch_day_rows), return the figure."""
+    title = {
+        'text': rows['id'],
+        'x': 0.5,
+        'xanchor': 'center',
+        'font_size': 24
+    }
+    fig = go.Figure(layout=go.Layout(height=200 + 10 * rows['n_rows'],
+                                     title=title, font_color="black",
+                                     font_size=20, margin=dict(l=120)))
+    return plot_day_rows(fig, rows)
@@ -0,0 +1,266 @@
+"""Process-wide cache of waveform data, by fixed-size time chunks.
+
+Fetched waveforms are stored as hourly chunks per channel (NSLC), so that
+any time window can be assembled from cached chunks and only the missing
+chunks are read (consecutive missing chunks at once), from the local SDS
+archive if mounted, otherwise from fdsnws-dataselect. Changing the filter
+or zooming around a window already viewed thus costs no read at all.
+Instrument responses are cached separately, per channel and for all
+epochs, instead of being re-fetched with every waveform request.
+
+Missing chunks are split into (channel x day) sub-requests run
+concurrently by a thread pool shared by all sessions, whose size caps the
+load put on the archive or fdsnws (FETCH_WORKERS environment variable).
+Progress is reported as sub-requests complete.
+
+The cache is bounded by a byte budget with least recently used eviction,
+and reports its chunk hit rate and the volume of data served.
+
+Recent chunks may still receive data (upload latency, station reconnecting
+after an outage), so chunks ending less than COMPLETE_AFTER ago are only
+kept for RECENT_TTL seconds. So are empty or partial chunks (gaps)
+whatever their age, as the backlog of a station can be flushed after an
+outage of several days.
+"""
+
+import collections
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import streamlit as st
+from obspy import Stream, Trace, UTCDateTime
+
+from utils.fdsn_client import get_inventory
+from utils.sds_reader import get_waveforms
+
+CHUNK_S = 3600
+MAX_BYTES = 512 * 1024 ** 2
+COMPLETE_AFTER = 86400.  # s
+RECENT_TTL = 300.  # s
+RESPONSE_TTL = 3600.  # s
+REQUEST_CHUNKS = 24  # maximum number of chunks per sub-request
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', 4))
+
+
+class WaveformCache:
+    """Thread-safe chunk cache of waveforms, bounded in bytes.
+
+    fetch(net, sta, loc, cha, starttime, endtime) returns a Stream or None
+    (no data), fetch_inventory(net, sta, loc, cha) the response inventory
+    of a channel or None.
+    """
+
+    def __init__(self, fetch=get_waveforms, fetch_inventory=get_inventory,
+                 max_bytes=MAX_BYTES, chunk_s=CHUNK_S,
+                 request_chunks=REQUEST_CHUNKS, workers=FETCH_WORKERS):
+        self.fetch = fetch
+        self.fetch_inventory = fetch_inventory
+        self.max_bytes = max_bytes
+        self.chunk_s = chunk_s
+        self.request_chunks = request_chunks
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self.size = 0
+        self.hits = 0  # chunks
+        self.misses = 0
+        self.bytes_served = 0
+        self.bytes_fetched = 0
+        # (nslc, chunk index) -> (traces, nbytes, expiry)
+        self._chunks = collections.OrderedDict()
+        self._responses = {}  # nslc -> (inventory, expiry)
+        self._lock = threading.Lock()
+
+    def get_waveforms(self, net, sta, loc, chans, starttime, endtime,
+                      attach_response=False, progress=None):
+        """Return the waveforms of channels (comma separated) in a window.
+
+        The returned traces are copies that can be processed in place.
+        Return None if there is no data at all. If given, progress(done,
+        total) is called (from the calling thread) each time a sub-request
+        completes.
+        """
+        streams = self.get_bulk([(net, sta, loc, cha)
+                                 for cha in chans.split(',')],
+                                starttime, endtime, progress)
+        stream = Stream([trace for cha_stream in streams.values()
+                         if cha_stream is not None for trace in cha_stream])
+        if not stream:
+            return None
+        if attach_response:
+            for cha in chans.split(','):
+                inventory = self.get_response(net, sta, loc, cha)
+                if inventory is not None:
+                    stream.select(channel=cha).attach_response(inventory)
+        return stream
+
+    def get_bulk(self, nslcs, starttime, endtime, progress=None):
+        """Return the waveforms of channels (net, sta, loc, cha tuples) in
+        a window, as a dict of Streams (None if no data) by channel.
+
+        The missing chunks of all the channels are fetched concurrently
+        (many stations at once, e.g. for a record section), progress as
+        get_waveforms.
+        """
+        starttime, endtime = UTCDateTime(starttime), UTCDateTime(endtime)
+        first = math.floor(starttime.timestamp / self.chunk_s)
+        # Chunk containing endtime included (inclusive end, as FDSNWS)
+        last = math.floor(endtime.timestamp / self.chunk_s) + 1
+        chunks = {nslc: self._lookup(nslc, first, last) for nslc in nslcs}
+        futures = {}  # sub-request -> channel
+        for nslc, nslc_chunks in chunks.items():
+            for run_start, run_stop in _missing_runs(nslc_chunks, first):
+                for start in range(run_start, run_stop, self.request_chunks):
+                    stop = min(start + self.request_chunks, run_stop)
+                    future = self._executor.submit(
+                        self._fetch_chunks, nslc, start, stop)
+                    futures[future] = nslc
+        for done, future in enumerate(as_completed(futures), 1):
+            for index, traces in future.result().items():
+                chunks[futures[future]][index - first] = traces
+            if progress is not None:
+                progress(done, len(futures))
+        streams = {}
+        for nslc, nslc_chunks in chunks.items():
+            # New headers: merging must not alter the cached traces
+            stream = Stream([Trace(trace.data, trace.stats.copy())
+                             for traces in nslc_chunks for trace in traces])
+            stream.merge(method=-1)  # join the chunks of continuous data
+            stream = stream.slice(starttime, endtime, nearest_sample=False)
+            # Copies: the cache is shared
+            stream = Stream([trace.copy() for trace in stream])
+            streams[nslc] = stream or None
+        with self._lock:
+            self.bytes_served += sum(trace.data.nbytes
+                                     for stream in streams.values()
+                                     if stream is not None
+                                     for trace in stream)
+        return streams
+
+    def get_response(self, net, sta, loc, cha):
+        """Return the (cached) response inventory of a channel."""
+        nslc = (net, sta, loc, cha)
+        with self._lock:
+            entry = self._responses.get(nslc)
+            if entry is not None and entry[1] > time.monotonic():
+                return entry[0]
+        inventory = self.fetch_inventory(net, sta, loc, cha)
+        with self._lock:
+            self._responses[nslc] = (inventory,
+                                     time.monotonic() + RESPONSE_TTL)
+        return inventory
+
+    def invalidate_responses(self):
+        """Forget the cached responses (StationXML change)."""
+        with self._lock:
+            self._responses.clear()
+
+    def stats(self):
+        """Return a summary of the cache usage."""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'chunks': len(self._chunks),
+                'bytes': self.size,
+                'hit_rate': self.hits / requests if requests else None,
+                'bytes_served': self.bytes_served,
+                'bytes_fetched': self.bytes_fetched,
+            }
+
+    def _lookup(self, nslc, first, last):
+        """Return the cached traces of chunks first to last - 1 (or None)."""
+        now = time.monotonic()
+        chunks = []
+        with self._lock:
+            for index in range(first, last):
+                entry = self._chunks.get((nslc, index))
+                if entry is not None and entry[2] < now:
+                    self._remove((nslc, index))
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                    chunks.append(None)
+                else:
+                    self._chunks.move_to_end((nslc, index))
+                    self.hits += 1
+                    chunks.append(entry[0])
+        return chunks
+
+    def _fetch_chunks(self, nslc, start, stop):
+        """Fetch chunks start to stop - 1 in one request and cache them.
+
+        Return the traces of the chunks by chunk index.
+        """
+        t_start = UTCDateTime(start * self.chunk_s)
+        t_stop = UTCDateTime(stop * self.chunk_s)
+        stream = self.fetch(*nslc, t_start, t_stop) or Stream()
+        now = time.time()
+        chunks = {}
+        for index in range(start, stop):
+            chunk_start = UTCDateTime(index * self.chunk_s)
+            # Chunk end is exclusive: a sample at the boundary belongs to
+            # the next chunk only (UTCDateTime compares at us precision)
+            chunk_end = UTCDateTime((index + 1) * self.chunk_s) - 1e-6
+            # Copies, so that evicting a chunk releases its memory
+            traces = [trace.copy() for trace
+                      in stream.slice(chunk_start, chunk_end,
+                                      nearest_sample=False)
+                      if trace.stats.npts]
+            ttl = None
+            if now - chunk_end.timestamp < COMPLETE_AFTER or \
+                    not is_complete(traces, chunk_start, chunk_end):
+                ttl = RECENT_TTL
+            self._store((nslc, index), traces, ttl)
+            chunks[index] = traces
+        return chunks
+
+    def _store(self, key, traces, ttl=None):
+        nbytes = sum(trace.data.nbytes for trace in traces)
+        expiry = math.inf if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self.bytes_fetched += nbytes
+            if key in self._chunks:
+                self._remove(key)
+            if nbytes > self.max_bytes:
+                return
+            self._chunks[key] = (traces, nbytes, expiry)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._chunks)))
+
+    def _remove(self, key):
+        _, nbytes, _ = self._chunks.pop(key)
+        self.size -= nbytes
+
+
+def is_complete(traces, starttime, endtime):
+    """Check if traces cover a time span without gaps (within a sample)."""
+    covered = starttime
+    delta = None
+    for trace in sorted(traces, key=lambda trace: trace.stats.starttime):
+        delta = trace.stats.delta
+        if trace.stats.starttime - covered > 1.5 * delta:
+            return False
+        covered = max(covered, trace.stats.endtime)
+    return delta is not None and endtime - covered <= 1.5 * delta
+
+
+def _missing_runs(chunks, first):
+    """Return the (start, stop) index runs of consecutive missing chunks."""
+    runs = []
+    for offset, traces in enumerate(chunks):
+        if traces is not None:
+            continue
+        index = first + offset
+        if runs and runs[-1][1] == index:
+            runs[-1][1] = index + 1
+        else:
+            runs.append([index, index + 1])
+    return runs
+
+
+@st.cache_resource(show_spinner=False)
+def get_waveform_cache():
+    """Return the waveform cache shared by all sessions."""
+    return WaveformCache()
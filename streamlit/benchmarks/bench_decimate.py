@@ -0,0 +1,106 @@
+"""Min/max decimation time: utils.decimate versus the former per-trace code.
+
+Reduce one int32 channel of 1e6 to 1e8 samples (1e9 with --sizes, which
+needs about 4 GB of memory for the samples), split into a few segments
+with gaps, to 2000 pixels. The former __plot_min_max reduction (reshape
+per trace, ragged tail, linspace/repeat x values in days) is timed for
+reference.
+
+Usage (from the streamlit/app folder):
+    python ../benchmarks/bench_decimate.py
+    python ../benchmarks/bench_decimate.py --sizes 1e6 1e7 1e8 1e9
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+from utils import decimate  # noqa: E402
+
+SAMPLING_RATE = 1000.
+SEGMENTS = 4
+PIXELS = 2000
+
+
+def make_samples(npts, chunk=10 ** 7):
+    """Return npts int32 random walk samples (generated by chunks)."""
+    rng = np.random.default_rng(0)
+    data = np.empty(npts, dtype=np.int32)
+    level = 0
+    for start in range(0, npts, chunk):
+        steps = rng.integers(-50, 50, min(chunk, npts - start),
+                             dtype=np.int32)
+        data[start:start + len(steps)] = np.cumsum(steps) + level
+        level = int(data[start + len(steps) - 1])
+    return data
+
+
+def legacy_minmax(segments, width):
+    """Per-trace reduction of the former __plot_min_max (x in days)."""
+    start_day = segments[0][0] / 1e9 / 86400.
+    end = segments[-1][0] + (len(segments[-1][2]) - 1) * 1e9 / SAMPLING_RATE
+    x_width = (end / 1e9 / 86400. - start_day) * 86400.
+    pixel_length = int(np.ceil((x_width * SAMPLING_RATE + 1) / width))
+    xs, ys = [], []
+    for start_ns, sampling_rate, data in segments:
+        pixel_count = len(data) // pixel_length
+        remaining = len(data) % pixel_length
+        body = data[:len(data) - remaining].reshape(pixel_count,
+                                                    pixel_length)
+        extremes = np.empty((pixel_count + bool(remaining), 2))
+        extremes[:pixel_count, 0] = body.min(axis=1)
+        extremes[:pixel_count, 1] = body.max(axis=1)
+        if remaining:
+            extremes[-1] = data[-remaining:].min(), data[-remaining:].max()
+        start = start_ns / 1e9 / 86400.
+        stop = start + (len(data) - 1) / sampling_rate / 86400.
+        x_values = np.linspace(start, stop, num=extremes.shape[0])
+        xs.append(np.array(np.repeat(x_values, 2) * 86400.,
+                           dtype='datetime64[s]'))
+        ys.append(extremes.flatten())
+    return np.concatenate(xs), np.concatenate(ys)
+
+
+def best_time(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', type=float,
+                        default=[1e6, 1e7, 1e8])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'samples':>8} {'decimate':>10} {'legacy':>10}  (best of "
+          f"{args.repeat}, s, {SEGMENTS} segments, {PIXELS} pixels)")
+    for size in args.sizes:
+        npts = int(size)
+        data = make_samples(npts)
+        # Segments of equal length separated by 10 s gaps (views)
+        seg_npts = npts // SEGMENTS
+        segments = []
+        start_ns = 1_700_000_000_123_456_789
+        for index in range(SEGMENTS):
+            segment = data[index * seg_npts:(index + 1) * seg_npts]
+            segments.append((start_ns, SAMPLING_RATE, segment))
+            start_ns += int((seg_npts / SAMPLING_RATE + 10.) * 1e9)
+        end_ns = start_ns
+        times = [best_time(lambda: decimate.minmax(
+                     segments, segments[0][0], end_ns, PIXELS), args.repeat),
+                 best_time(lambda: legacy_minmax(segments, PIXELS),
+                           args.repeat)]
+        print(f'{npts:>8.0e} ' + ' '.join(f'{t:>10.3f}' for t in times))
+
+
+if __name__ == "__main__":
+    main()
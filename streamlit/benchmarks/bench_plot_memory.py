@@ -0,0 +1,107 @@
+"""Peak memory of the trace plot step, relative to the raw stream size.
+
+Each case runs in a child process: a stream of int32 channels is created,
+the peak resident set size (VmHWM) is reset, the plot step runs (full
+resolution path, whatever the number of samples), and the peak and kept
+increases are reported in multiples of the raw sample bytes. The
+"legacy" step reproduces the former preparation of __plot_straight
+(stream copy and trim, float64 calibrated copy and per-sample datetime64
+x values, Scatter traces) for reference.
+
+Usage (from the streamlit/app folder, Linux only):
+    python ../benchmarks/bench_plot_memory.py
+    python ../benchmarks/bench_plot_memory.py --channels 3 --npts 400000
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+from obspy import Stream, Trace, UTCDateTime
+from plotly.subplots import make_subplots
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+from utils.obspy_plot_mod import ModifiedWaveformPlotting  # noqa: E402
+
+
+def rss_kb(field):
+    """Return a memory field (VmRSS, VmHWM) of this process in kB."""
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    raise RuntimeError(f"{field} not found")
+
+
+def make_stream(channels, npts):
+    rng = np.random.default_rng(0)
+    return Stream([
+        Trace(rng.integers(-10000, 10000, npts, dtype=np.int32),
+              header={'network': 'XX', 'station': 'SYNTH', 'location': '00',
+                      'channel': f'HH{index}', 'sampling_rate': 100.,
+                      'starttime': UTCDateTime(2024, 3, 1), 'calib': 1.5})
+        for index in range(channels)
+    ])
+
+
+def plot_current(stream):
+    waveform = ModifiedWaveformPlotting(stream=stream, handle=True,
+                                        size=(1200, 800), method='full')
+    return waveform.plot_waveform(handle=True)
+
+
+def plot_legacy(stream):
+    stream = stream.copy()
+    stream.trim(min(tr.stats.starttime for tr in stream),
+                max(tr.stats.endtime for tr in stream))
+    fig = make_subplots(rows=len(stream), cols=1, shared_xaxes=True)
+    for row, trace in enumerate(stream, 1):
+        trace.data = np.require(trace.data, np.float64) * trace.stats.calib
+        x_values = np.array(
+            trace.stats.starttime.ns + trace.times() * 1_000_000_000,
+            dtype='datetime64[ns]'
+        )
+        fig.add_scatter(x=x_values, y=trace.data, row=row, col=1,
+                        showlegend=False, hoverinfo='skip')
+    return fig
+
+
+def run_case(step, channels, npts, queue):
+    step = {'current': plot_current, 'legacy': plot_legacy}[step]
+    step(make_stream(channels, 1000))  # warm up (lazy Plotly imports)
+    stream = make_stream(channels, npts)
+    raw_kb = sum(trace.data.nbytes for trace in stream) / 1024
+    with open('/proc/self/clear_refs', 'w') as clear_refs:
+        clear_refs.write('5')  # reset VmHWM to the current RSS
+    before = rss_kb('VmRSS')
+    fig = step(stream)
+    peak = rss_kb('VmHWM')
+    queue.put(((peak - before) / raw_kb, (rss_kb('VmRSS') - before) / raw_kb,
+               len(fig.data)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--channels', type=int, default=3)
+    parser.add_argument('--npts', type=int, default=400000)
+    args = parser.parse_args()
+
+    raw_mb = args.channels * args.npts * 4 / 1e6
+    print(f"{args.channels} channels x {args.npts} int32 samples "
+          f"({raw_mb:.1f} MB raw)")
+    print(f"{'step':>8} {'peak/raw':>9} {'kept/raw':>9}")
+    context = multiprocessing.get_context('spawn')  # fresh interpreter
+    for step in ('current', 'legacy'):
+        queue = context.Queue()
+        process = context.Process(target=run_case, args=(
+            step, args.channels, args.npts, queue))
+        process.start()
+        peak, kept, _ = queue.get()
+        process.join()
+        print(f'{step:>8} {peak:>9.1f} {kept:>9.1f}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Waveform retrieval latency: direct SDS reads versus FDSNWS over HTTP.
+
+Fetch 1 hour, 1 day and 7 day windows of one channel with the direct SDS
+reader of the app, ObsPy's SDS client (reference local reader) and, if a
+server URL is given, fdsnws-dataselect through the app HTTP client. Without
+--archive, a synthetic 8 day, 100 Hz archive is written to a temporary
+directory (the HTTP path then needs a server serving the same archive).
+
+Usage (from the streamlit/app folder):
+    python ../benchmarks/bench_sds_reader.py
+    python ../benchmarks/bench_sds_reader.py --archive /data/archive \\
+        --url http://seiscomp:8080/fdsnws --nslc NET.STA.00.HHZ \\
+        --start 2024-03-02T10:00:00
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from obspy import Trace, UTCDateTime
+from obspy.clients.filesystem.sds import Client as SDSClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+from utils import fdsn_client  # noqa: E402
+from utils.sds_reader import SDSReader  # noqa: E402
+
+WINDOWS = [('1 h', 3600), ('1 day', 86400), ('7 days', 7 * 86400)]
+
+
+def write_synthetic_archive(root, start, days=8, sampling_rate=100.):
+    """Write day files of random-walk counts for XX.SYNTH.00.HHZ."""
+    rng = np.random.default_rng(0)
+    npts = int(86400 * sampling_rate)
+    for day in range(days):
+        day_start = start + day * 86400
+        trace = Trace(
+            np.cumsum(rng.integers(-100, 100, npts)).astype(np.int32),
+            header={'network': 'XX', 'station': 'SYNTH', 'location': '00',
+                    'channel': 'HHZ', 'starttime': day_start,
+                    'sampling_rate': sampling_rate})
+        path = os.path.join(
+            root, str(day_start.year), 'XX', 'SYNTH', 'HHZ.D',
+            f'XX.SYNTH.00.HHZ.D.{day_start.year}.{day_start.julday:03d}')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        trace.write(path, format='MSEED', encoding='STEIM2', reclen=4096)
+
+
+def best_time(func, repeat):
+    """Return the best elapsed time of repeat calls and the last result."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--archive', help="SDS root (default: synthetic).")
+    parser.add_argument('--url', help="FDSNWS base URL for the HTTP path.")
+    parser.add_argument('--nslc', default='XX.SYNTH.00.HHZ')
+    parser.add_argument('--start', default='2024-03-01T10:00:00')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    net, sta, loc, cha = args.nslc.split('.')
+    start = UTCDateTime(args.start)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = args.archive
+        if root is None:
+            root = tmp_dir
+            write_synthetic_archive(root, UTCDateTime(start.date))
+        sds_reader = SDSReader(root)  # record indexes kept between calls
+        readers = {
+            'SDS reader': lambda t1, t2: sds_reader.get_waveforms(
+                net, sta, loc, cha, t1, t2),
+            'ObsPy SDS': lambda t1, t2: SDSClient(root).get_waveforms(
+                net, sta, loc, cha, t1, t2),
+        }
+        if args.url:
+            fdsn_client.BASE_URL = args.url
+            readers['FDSNWS'] = lambda t1, t2: fdsn_client.get_waveforms(
+                net, sta, loc, cha, t1, t2)
+        print(f"{'window':>8} " + ' '.join(f'{name:>13}' for name in readers)
+              + '  (best of %d, s)' % args.repeat)
+        for label, span in WINDOWS:
+            times = []
+            for read_window in readers.values():
+                elapsed, stream = best_time(
+                    lambda: read_window(start, start + span), args.repeat)
+                times.append(elapsed)
+            print(f'{label:>8} ' + ' '.join(f'{t:>13.3f}' for t in times)
+                  + f'  ({sum(tr.stats.npts for tr in stream)} samples)')
+
+
+if __name__ == "__main__":
+    main()